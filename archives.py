@@ -0,0 +1,194 @@
+import collections
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+
+import metrics
+import workers
+
+
+"""
+Validates the C files in .tar (optionally .gz, .bz2 or .xz compressed) and
+.zip archives without extracting them.
+
+Members are read from the archive one at a time, in archive order, and
+validated from memory. Errors are reported against "<archive>/<member>".
+With more than one job, members are validated in a pool of processes while
+the next ones are read, with only a few members held in memory at once.
+"""
+
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz",
+                    ".txz", ".zip")
+
+
+def is_archive(filename):
+    return filename.endswith(ARCHIVE_SUFFIXES)
+
+
+def _iter_tar_members(filename, extensions):
+    # A stream, so compressed archives are decompressed once, front to back
+    with tarfile.open(filename, "r|*") as archive:
+        for member in archive:
+            if member.isfile() and \
+                    os.path.splitext(member.name)[1] in extensions:
+                yield (member.name, archive.extractfile(member).read())
+
+
+def _iter_zip_members(filename, extensions):
+    with zipfile.ZipFile(filename) as archive:
+        for info in archive.infolist():
+            if not info.filename.endswith("/") and \
+                    os.path.splitext(info.filename)[1] in extensions:
+                yield (info.filename, archive.read(info))
+
+
+# Raised while reading a missing, corrupt or truncated archive
+_READ_ERRORS = (IOError, OSError, EOFError, tarfile.TarError,
+                zipfile.BadZipfile)
+
+
+def _read_members(filename, members):
+    try:
+        for member in members:
+            yield member
+    except _READ_ERRORS as e:
+        raise ValueError("Can't read archive {}: {}".format(filename, e))
+
+
+def iter_members(filename, extensions=(".c",)):
+    """
+    Yields (member name, contents as bytes) for each C file in an archive, in
+    archive order.
+
+    Raises ValueError if filename isn't named like an archive, or once it
+    turns out not to be readable as one.
+    """
+    if not is_archive(filename):
+        raise ValueError("{} is not a {} archive".format(
+                            filename, "/".join(ARCHIVE_SUFFIXES)))
+
+    if filename.endswith(".zip"):
+        members = _iter_zip_members(filename, extensions)
+    else:
+        members = _iter_tar_members(filename, extensions)
+
+    return _read_members(filename, members)
+
+
+def _validate_member(task):
+    import validate
+
+    path, contents = task
+    start = time.time()
+    try:
+        errors = validate.find_documentation_errors(
+                    path, contents.decode("utf-8", "replace"))
+    except Exception as e:
+        metrics.count("files_failed_total", reason="error")
+        errors = [validate.ValidationFailedError(
+                      path, "{}: {}".format(type(e).__name__, e))]
+
+    return (path, time.time() - start, errors, metrics.take())
+
+
+def _merged(result):
+    """Merges the metrics a member was validated with into this process"""
+    path, seconds, errors, member_metrics = result
+    metrics.merge(member_metrics)
+    return (path, seconds, errors)
+
+
+def validate_archive(filename, jobs=1, extensions=(".c",)):
+    """
+    Validates each C file in an archive, yielding (path, seconds, errors) for
+    each in archive order, where path is "<archive>/<member>".
+
+    Raises ValueError if the archive can't be read, see iter_members.
+    """
+    tasks = (("{}/{}".format(filename, name), contents)
+             for name, contents in iter_members(filename, extensions))
+
+    if jobs <= 1:
+        for task in tasks:
+            yield _merged(_validate_member(task))
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer=workers.apply_settings,
+                                initargs=(workers.current_settings(),))
+    try:
+        # Keep every worker busy, but read no further ahead than that
+        in_flight = collections.deque()
+        for task in tasks:
+            in_flight.append(pool.apply_async(_validate_member, (task,)))
+            if len(in_flight) >= 2 * jobs:
+                yield _merged(in_flight.popleft().get())
+
+        while in_flight:
+            yield _merged(in_flight.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def test_archives():
+    """Archived files give the same errors as the files on disk"""
+    import shutil
+    import tempfile
+
+    import validate
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    sources = os.path.join(dir_path, 'test_sources')
+    names = sorted(x for x in os.listdir(sources) if x.endswith(".c"))
+
+    def describe(errors):
+        return [(type(e).__name__, e.func.location.linenumber, e.func.name,
+                 e.argname) for e in errors]
+
+    expected = dict(("src/" + name,
+                     describe(validate.find_documentation_errors(
+                                  os.path.join(sources, name))))
+                    for name in names)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tar_path = os.path.join(tmp_dir, "vendor.tar.xz")
+        with tarfile.open(tar_path, "w:xz") as archive:
+            for name in names:
+                archive.add(os.path.join(sources, name), "src/" + name)
+            archive.add(sources, "src/headers", recursive=False)
+
+        zip_path = os.path.join(tmp_dir, "vendor.zip")
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            for name in names:
+                archive.write(os.path.join(sources, name), "src/" + name)
+            archive.writestr("README", "Not C\n")
+
+        for archive_path in [tar_path, zip_path]:
+            for jobs in [1, 2]:
+                found = [(path, describe(errors)) for path, _, errors in
+                         validate_archive(archive_path, jobs)]
+                assert found == [(archive_path + "/" + name, expected[name])
+                                 for name in sorted(expected)]
+
+        corrupt_path = os.path.join(tmp_dir, "corrupt.tar.gz")
+        with open(corrupt_path, "w") as f:
+            f.write("Not an archive\n")
+        for bad_path in [corrupt_path, os.path.join(tmp_dir, "missing.zip"),
+                         os.path.join(sources, names[0])]:
+            try:
+                list(validate_archive(bad_path))
+            except ValueError:
+                pass
+            else:
+                assert False, "validated {}".format(bad_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_archives()
+    print('Tests passed.')
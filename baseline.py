@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+
+"""
+A baseline records the documentation errors which already exist in a tree, so
+that later runs only report new ones.
+
+Each error is stored as a fingerprint of the file, function, error class and
+argument name. Line numbers are deliberately left out so that errors stay
+recognised when code moves around within a file.
+"""
+
+
+def fingerprint(key):
+    """
+    Returns the fingerprint of an error, given its key as a tuple of
+    (filename, function name, error class name, argname).
+    """
+    filename, funcname, error_class, argname = key
+
+    text = "\0".join([os.path.normpath(filename),
+                      funcname or "",
+                      error_class,
+                      argname or ""])
+
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def error_fingerprint(err):
+    return fingerprint(err.key())
+
+
+def dict_fingerprint(err_dict):
+    """Fingerprint of an error as stored in a JSON report"""
+    return fingerprint((err_dict["filename"],
+                        err_dict["function"],
+                        err_dict["error"],
+                        err_dict["argname"]))
+
+
+def load_baseline(filename):
+    """Returns the set of fingerprints stored in filename"""
+    if not os.path.exists(filename):
+        return set()
+
+    with open(filename) as f:
+        return set(x.strip() for x in f if x.strip())
+
+
+def save_baseline(filename, fingerprints):
+    """Rewrites the baseline in a single write"""
+    with open(filename, 'w') as f:
+        f.write("".join(x + "\n" for x in sorted(set(fingerprints))))
+
+
+def test_baseline():
+    """Errors keep their fingerprints when their function moves down a file"""
+    import shutil
+    import tempfile
+
+    import validate
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, "moved.c")
+        source = "int foo(int a)\n{\n}\n"
+
+        with open(filename, "w") as f:
+            f.write(source)
+        before = [error_fingerprint(err) for err in
+                  validate.find_documentation_errors(filename)]
+        assert before
+
+        with open(filename, "w") as f:
+            f.write("\n\n\n" + source + "\nint bar(int b)\n{\n}\n")
+        after = dict((err.func.name, error_fingerprint(err)) for err in
+                     validate.find_documentation_errors(filename))
+        assert before == [after["foo"]]
+        assert after["bar"] not in before
+
+        baseline_filename = os.path.join(tmp_dir, "baseline")
+        save_baseline(baseline_filename, before + before)
+        assert load_baseline(baseline_filename) == set(before)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_baseline()
+    print('Tests passed.')
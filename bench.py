@@ -0,0 +1,299 @@
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+"""
+Benchmarks for hornbill. Each benchmark is a bench_* function, run with:
+
+    python bench.py <name> [<name> ...]
+"""
+
+
+_dir_path = os.path.dirname(os.path.realpath(__file__))
+_hornbill = os.path.join(_dir_path, 'hornbill.py')
+_test_sources = os.path.join(_dir_path, 'test_sources')
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _time_command(argv, devnull):
+    start = time.time()
+    subprocess.call(argv, stdout=devnull, stderr=devnull)
+    return time.time() - start
+
+
+def _import_times(argv):
+    """
+    Runs hornbill with -X importtime.
+
+    Returns (a list of (cumulative microseconds, module) for the top level
+    imports, slowest first, set of every module imported).
+    """
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime'] + argv,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    _, stderr = proc.communicate()
+
+    times = []
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        modules.add(module.strip())
+        # Nested imports are indented below the module which imported them
+        if cumulative.strip().isdigit() and not module[1:].startswith(" "):
+            times.append((int(cumulative), module.strip()))
+
+    return (sorted(times, reverse=True), modules)
+
+
+def bench_startup(repeat=10):
+    """
+    Wall clock and import time of each way of starting hornbill, including
+    whether the clang bindings were loaded.
+    """
+    single_file = os.path.join(_test_sources, 'single_func.c')
+
+    entry_paths = [
+        ("--help",             [_hornbill, '--help']),
+        ("no files",           [_hornbill]),
+        ("one file, fast",     [_hornbill, '--engine', 'fast',
+                                '--comment-check', single_file]),
+        ("one file, clang",    [_hornbill, '--comment-check', single_file]),
+    ]
+
+    with open(os.devnull, 'w') as devnull:
+        baseline = _median([_time_command([sys.executable, '-c', 'pass'],
+                                          devnull)
+                            for _ in range(repeat)])
+
+        print("Interpreter startup: {:.1f}ms".format(baseline * 1000))
+        print()
+
+        for name, argv in entry_paths:
+            wall = _median([_time_command([sys.executable] + argv, devnull)
+                            for _ in range(repeat)])
+
+            imports, modules = _import_times(argv)
+
+            print("{}: {:.1f}ms ({:.1f}ms over interpreter startup)".format(
+                    name, wall * 1000, (wall - baseline) * 1000))
+            print("  clang loaded: {}".format("clang.cindex" in modules))
+            for cumulative, module in imports[:5]:
+                print("  {:8.1f}ms  {}".format(cumulative / 1000.0, module))
+
+
+def _generate_source(f, functions, body_lines=40):
+    """Writes a large generated C file, with a Doxygen comment per function"""
+    for i in range(functions):
+        f.write("/**\n"
+                " * Generated function {0}\n"
+                " *\n"
+                " * @param[in] a\n"
+                " *\n"
+                " * @return int\n"
+                " */\n"
+                "int\n"
+                "generated_{0} (int a, gen_t b)\n"
+                "{{\n".format(i))
+        for j in range(body_lines):
+            f.write("    a = (a * {0}) + {1}; /* {{ padding }} */\n".format(i, j))
+        f.write("    return (a);\n"
+                "}}\n\n".format())
+
+
+# Validates argv[1], streaming if argv[2] is "1", in a fresh interpreter, and
+# prints the peak Python and peak process memory as JSON
+_MEMORY_CHILD = """
+import json, os, resource, sys, time, tracemalloc
+sys.path.insert(0, {dir_path!r})
+import validate
+
+validate.streaming = sys.argv[2] == "1"
+tracemalloc.start()
+start = time.time()
+errors = validate.find_documentation_errors(sys.argv[1])
+elapsed = time.time() - start
+_, peak = tracemalloc.get_traced_memory()
+
+# Kilobytes on Linux, bytes on macOS
+scale = 1 if os.uname()[0] == "Darwin" else 1024
+print(json.dumps({{
+    "python_peak": peak,
+    "max_rss": scale * resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "seconds": elapsed,
+    "errors": len(errors)}}))
+"""
+
+
+def bench_memory(functions=5000):
+    """
+    Peak memory while validating a large generated file, reading it into
+    memory versus streaming it. Each mode runs in its own process, so its
+    peak resident set size includes libclang's allocations, which the
+    Python peak from tracemalloc can't see.
+    """
+    import json
+    import tempfile
+
+    fd, filename = tempfile.mkstemp(suffix=".c")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            _generate_source(f, functions)
+
+        print("File size: {:.1f}MB".format(os.path.getsize(filename) / 1e6))
+
+        code = _MEMORY_CHILD.format(dir_path=_dir_path)
+        for streaming in [False, True]:
+            output = subprocess.check_output(
+                        [sys.executable, '-c', code, filename,
+                         "1" if streaming else "0"],
+                        universal_newlines=True)
+            result = json.loads(output.splitlines()[-1])
+
+            print("{}: peak RSS {:.1f}MB, Python peak {:.1f}MB, {:.2f}s,"
+                  " {} errors".format(
+                    "streaming" if streaming else "in memory",
+                    result["max_rss"] / 1e6, result["python_peak"] / 1e6,
+                    result["seconds"], result["errors"]))
+    finally:
+        os.remove(filename)
+
+
+def bench_references(comments=20000):
+    """
+    Time to decide whether each comment of a comment-heavy file refers to
+    documentation elsewhere, for each comment format.
+    """
+    import doxygen
+    import edt
+
+    # A mix of ordinary comments and references, as the parsers see them
+    # after the comment markers are stripped
+    samples = [
+        ["Frobnicates the widget, returning the number of frobs.",
+         "Callers must hold the widget lock. See the design notes."],
+        ["See widget.h for documentation."],
+        ["Implements the widget_frob_cb callback."],
+        ["Resets every counter in the given table, then flushes the",
+         "statistics to the log. The table must not be in use by any",
+         "other thread while this runs."],
+    ]
+    lines = [samples[i % len(samples)] for i in range(comments)]
+
+    for name, is_reference in [("edt", edt._is_reference),
+                               ("doxygen", doxygen._is_reference)]:
+        start = time.time()
+        found = sum(1 for comment in lines if is_reference(comment))
+        elapsed = time.time() - start
+
+        print("{}: {:.2f}us per comment, {} references".format(
+                name, elapsed / comments * 1e6, found))
+
+
+def bench_render(functions=10000, description_words=50000):
+    """
+    Time to render comment templates for many functions, and for one function
+    with a very long description.
+    """
+    from classes import Function, Variable
+    import doxygen
+    import edt
+
+    def make_function(i, comment):
+        func = Function()
+        func.name = "generated_{}".format(i)
+        func.comment = comment
+        func.returns = Variable(typename="int", name="<return>")
+        func.args = [Variable(typename="int", name="arg_{}".format(j))
+                     for j in range(4)]
+        return func
+
+    many = [make_function(i, "Generated function {}, which frobs its four"
+                             " arguments and returns how many frobs it"
+                             " made.".format(i))
+            for i in range(functions)]
+    long_description = [make_function(0, " ".join(
+                            "word{}".format(i % 100)
+                            for i in range(description_words)))]
+
+    for name, funcs in [("{} functions".format(functions), many),
+                        ("{} word description".format(description_words),
+                         long_description)]:
+        for generator in [edt.gen_edt, doxygen.gen_doxygen]:
+            start = time.time()
+            size = sum(len(generator(func)) for func in funcs)
+            elapsed = time.time() - start
+
+            print("{}, {}: {:.3f}s ({:.1f}MB/s)".format(
+                    name, generator.__name__, elapsed,
+                    size / elapsed / 1e6))
+
+
+def bench_scheduling(jobs=4):
+    """
+    Wall clock and tail time of a parallel run over files of very different
+    sizes, in the order given versus longest first.
+    """
+    import shutil
+    import tempfile
+
+    import timings
+    import workers
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # Many small files with one big one at the end, as a naive directory
+        # order might have it
+        filenames = []
+        for i, functions in enumerate([200] * (jobs * 8) + [2000]):
+            filename = os.path.join(tmp_dir, "file_{}.c".format(i))
+            with open(filename, 'w') as f:
+                _generate_source(f, functions, body_lines=5)
+            filenames.append(filename)
+
+        indexed_files = list(enumerate(filenames))
+        costs = timings.predict_costs(filenames)
+
+        for name, file_costs in [("given order", None),
+                                 ("longest first", costs)]:
+            supervisor = workers.Supervisor(jobs)
+            for _ in supervisor.run(indexed_files, file_costs):
+                pass
+
+            print("{}: {:.2f}s, {:.2f}s with fewer than {} workers busy".format(
+                    name, supervisor.wall_seconds, supervisor.tail_seconds,
+                    jobs))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    benchmarks = dict((name[len("bench_"):], func)
+                      for name, func in globals().items()
+                      if name.startswith("bench_"))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks',
+                        nargs='*',
+                        help='Benchmarks to run, defaulting to all of: ' +
+                        ', '.join(sorted(benchmarks)))
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error("Unknown benchmark {}".format(name))
+
+    for name in args.benchmarks or sorted(benchmarks):
+        print("== {}".format(name))
+        benchmarks[name]()
+        print()
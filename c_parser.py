@@ -2,16 +2,13 @@
 
 from __future__ import print_function
 
+import os
 import re
-import sys
-import json
 import tempfile
-import linecache
 
 from classes import *
-
-import clang.cindex
-from clang.cindex import CursorKind
+import cache
+import metrics
 
 
 """
@@ -43,108 +40,605 @@ Second:
 This file implementes the second option.
 """
 
-clang.cindex.Config.set_library_file('/usr/lib/llvm-3.8/lib/libclang.so.1')
+LIBCLANG_FILE = '/usr/lib/llvm-3.8/lib/libclang.so.1'
 
-def stub_lines(lines):
-    """Remove any actual content from a set of lines describing c source, apart
-    from the top level declarations of functions and structs."""
-    #Remove the include
-    for i, line in enumerate(lines):
-        if line.startswith("#include"):
-            lines[i] = "\n"
+# The clang bindings, imported by _cindex() the first time a file is actually
+# parsed. Loading libclang dominates the startup time of short runs, so
+# importing this module must not do it.
+_clang_cindex = None
+
+def _cindex():
+    """Returns the clang.cindex module, loading libclang on first use"""
+    global _clang_cindex
 
-    # Remove all the function bodies. Or rather, replace all top level curly
-    # braces with a single semicolon.
-    # This removes the fields in any struct definitions, but that's OK for now.
+    if _clang_cindex is None:
+        import clang.cindex
+        clang.cindex.Config.set_library_file(LIBCLANG_FILE)
+        _clang_cindex = clang.cindex
+
+    return _clang_cindex
+
+_comment_text = re.compile(r"/\*.*?\*/|//[^\n]*", re.DOTALL)
+_attribute = re.compile(r"__attribute__\s*\(\(.*?\)\)", re.DOTALL)
+_type_keyword = re.compile(r"\b(?:struct|union|enum)\b")
+
+def _is_type_body(statement):
+    """
+    Whether the top level braces following the given characters of a
+    declaration hold the body of a struct, union or enum, rather than a
+    function body or an initializer.
+    """
+    text = _attribute.sub("", _comment_text.sub("", "".join(statement)))
+    return _type_keyword.search(text) is not None and \
+        "(" not in text and "=" not in text
+
+
+def iter_stub_lines(lines, keep_types=False):
+    """
+    Generator version of stub_lines, yielding each stubbed line in turn, so
+    that a file can be stubbed without holding all of it in memory.
+    """
     brace_levels = 0
-    for i, line in enumerate(lines):
+
+    # With keep_types, the characters of the current top level declaration
+    # before any braces, and whether the braces being read hold a type body
+    statement = []
+    in_type_body = False
+    in_directive = False
+
+    for line in lines:
+        #Remove the include
+        if line.startswith("#include"):
+            yield "\n"
+            continue
+
+        # Leave preprocessor directives, including any continuation lines,
+        # out of the declaration
+        if keep_types and brace_levels == 0 and \
+                (in_directive or line.lstrip().startswith("#")):
+            in_directive = line.rstrip().endswith("\\")
+            yield line
+            continue
+
+        # Remove all the function bodies. Or rather, replace all top level
+        # curly braces with a single semicolon.
+        # This removes the fields in any struct definitions, unless
+        # keep_types is set.
         line = list(line)
         for j, char in enumerate(line):
             if char == "{":
                 if brace_levels == 0:
-                    line[j] = ";"
-                else:
+                    in_type_body = keep_types and _is_type_body(statement)
+                    if not in_type_body:
+                        line[j] = ";"
+                elif not in_type_body:
                     line[j] = " "
 
                 brace_levels += 1
 
             elif char == "}":
-                if brace_levels > 0:
+                if brace_levels > 0 and not in_type_body:
                     line[j] = " "
 
                 brace_levels -= 1
+                if brace_levels == 0:
+                    in_type_body = False
+                    del statement[:]
 
             elif brace_levels > 0 and char != "\n":
-                line[j] = " "
+                if not in_type_body:
+                    line[j] = " "
+
+            elif keep_types and brace_levels == 0:
+                if char == ";":
+                    del statement[:]
+                else:
+                    statement.append(char)
 
         line = "".join(line)
 
-        if line.startswith("typedef"):
+        if line.startswith("typedef") and not keep_types:
             line = "// " + line
 
-        lines[i] = line
+        yield line
+
+
+def stub_lines(lines, keep_types=False):
+    """Remove any actual content from a set of lines describing c source, apart
+    from the top level declarations of functions and structs.
+
+    With keep_types, the bodies of top level structs, unions and enums, and
+    typedefs, are kept for parse_file_declarations.
+    """
+    lines[:] = iter_stub_lines(lines, keep_types)
 
     return lines
 
-def create_stubbed_file(filename):
-    """Transforms a single C source file into a new source file, but with each
-    function definition replaced with a similar declaration
+# The kinds of DataType returned by parse_file_declarations
+DATA_TYPE_KINDS = ["struct", "union", "enum", "typedef", "macro"]
 
-    Returns the filename of the new file
+# Which declaration extractor parse_file_functions uses, see ENGINES
+ENGINES = ["clang", "fast"]
+default_engine = "clang"
+
+# Memoized results of parse_file_functions, keyed by file contents. Replace
+# with a ResultCache with a directory to share results between runs.
+parse_cache = cache.ResultCache()
+
+# Clang never reads this file from disk, the stubbed source is passed to it in
+# memory. create_stubbed_file writes it out for inspection.
+STUBBED_FILENAME = "/tmp/hornbill_tmp.c"
+
+# Project-wide set of names which clang reported as unknown types in
+# previously parsed files. Any of them which appear in a file are typedef'd up
+# front, which usually makes the discovery parse unnecessary.
+known_unknown_types = set()
+
+_unknown_type_name = re.compile("unknown type name '([^']*)'")
+_quoted = re.compile("'([^']*)'")
+_identifier = re.compile("[A-Za-z_][A-Za-z0-9_]*")
+
+
+def load_type_cache(filename):
+    """Adds the newline delimited type names in filename to the known set"""
+    try:
+        with open(filename) as f:
+            known_unknown_types.update(x.strip() for x in f if x.strip())
+    except IOError:
+        pass
+
+
+def save_type_cache(filename):
+    with open(filename, 'w') as f:
+        f.write("".join(x + "\n" for x in sorted(known_unknown_types)))
+
+
+def _typedef_prelude(types):
+    """
+    Declares each of the given names as an int. The prelude has no newlines so
+    that line numbers in the rest of the file are unchanged.
     """
+    return "".join(["typedef int {};".format(x) for x in sorted(types)])
 
-    stubbed_filename = "/tmp/hornbill_tmp.c"
 
+def _read_lines(filename):
     with open(filename, 'r') as f:
-        lines = f.readlines()
+        return f.readlines()
+
+
+def _parse_with_prelude(parse, candidates):
+    """
+    Parses a stubbed file with a prelude declaring any unknown types.
+
+    parse(types) must parse the file with types declared in a prelude,
+    returning (root nodes, unknown types). candidates are the previously seen
+    unknown types which the file mentions.
+
+    Returns (the types in the prelude, list(ast root nodes))
+    """
+
+    if candidates:
+        root_nodes, unknown_types = parse(candidates)
+
+        if not unknown_types:
+            return (candidates, list(root_nodes))
+
+        # If a cached name is used as something other than a type in this
+        # file, the prelude itself caused an error, so start over without it.
+        if candidates.isdisjoint(unknown_types):
+            types = candidates.union(unknown_types)
+            root_nodes, _ = parse(types)
+            return (types, list(root_nodes))
+
+    root_nodes, unknown_types = parse([])
+
+    root_nodes, _ = parse(unknown_types)
+
+    return (unknown_types, list(root_nodes))
 
-    #Remove all includes and function bodies
-    lines = stub_lines(lines)
 
-    with open(stubbed_filename, 'w') as f:
-        f.writelines(lines)
+def _parse_stubbed_lines(lines):
+    """
+    Parses the given stubbed lines in memory, with a prelude declaring any
+    unknown types.
+
+    Returns (stubbed source, list(ast root nodes))
+    """
+
+    text = "".join(lines)
+
+    def parse(types):
+        return clang_parse_file(STUBBED_FILENAME, _typedef_prelude(types) + text)
+
+    # Start from the previously seen unknown types which this file mentions
+    candidates = known_unknown_types.intersection(_identifier.findall(text))
+
+    types, root_nodes = _parse_with_prelude(parse, candidates)
+
+    return (_typedef_prelude(types) + text, root_nodes)
+
 
-    root_nodes, unknown_types = clang_parse_file(stubbed_filename)
+def create_stubbed_file(filename, lines=None):
+    """Transforms a single C source file into a new source file, but with each
+    function definition replaced with a similar declaration
+
+    lines, if given, are used in place of the contents of filename.
+
+    Returns the filename of the new file
+    """
+
+    if lines is None:
+        lines = _read_lines(filename)
+
+    #Remove all includes and function bodies
+    lines = stub_lines(list(lines))
 
-    typedefs = "".join(["typedef int {};".format(x) for x in unknown_types])
+    source, _ = _parse_stubbed_lines(lines)
 
-    with open(stubbed_filename, 'w') as f:
-        f.writelines([typedefs])
-        f.writelines(lines)
+    with open(STUBBED_FILENAME, 'w') as f:
+        f.write(source)
 
-    return stubbed_filename
+    return STUBBED_FILENAME
 
 
-def clang_parse_file(filename):
+def clang_parse_file(filename, contents=None, include=None, options=0):
     """Parses a C source file into an AST with clang.
     Returns (list(ast root nodes), list(unknown types))
+
+    If contents is given it is parsed in place of the file on disk, which then
+    need not exist. include is an optional (filename, contents) pair for a
+    header to include before the file. options are clang TranslationUnit
+    parse options, eg. to keep macro definitions.
+
+    Names which clang reports as unknown types are also added to
+    known_unknown_types.
     """
 
-    index = clang.cindex.Index.create()
+    index = _cindex().Index.create()
+
+    args = ['-x', 'c']
+    unsaved_files = []
+
+    if contents is not None:
+        unsaved_files.append((filename, contents))
+
+    if include is not None:
+        args += ['-include', include[0]]
+        unsaved_files.append(include)
 
-    translation_unit = index.parse(filename, ['-x', 'c'])
+    metrics.count("libclang_parses_total")
+    with metrics.timed("libclang_parse_seconds"):
+        translation_unit = index.parse(filename, args,
+                                       unsaved_files=unsaved_files or None,
+                                       options=options)
 
     unknown_types = []
     for d in translation_unit.diagnostics:
         if d.severity == 3:
-            quoted = re.compile("'([^']*)'")
-            for value in quoted.findall(d.spelling):
+            for value in _quoted.findall(d.spelling):
                 unknown_types.append(value)
 
+            known_unknown_types.update(_unknown_type_name.findall(d.spelling))
+
     root_nodes = translation_unit.cursor.get_children()
 
     return (root_nodes, unknown_types)
 
 
-def parse_file_functions(filename):
-    """Returns a list of parsed Function objects from a given C file"""
-    stubbed_filename = create_stubbed_file(filename)
-
-    root_nodes, _ = clang_parse_file(stubbed_filename)
+def parse_file_functions_streaming(filename):
+    """
+    Returns a list of parsed Function objects from a given C file, like
+    parse_file_functions with the clang engine, while only holding one line of
+    the file in memory at a time.
 
-    functions = [Function(x) for x in root_nodes if x.kind == CursorKind.FUNCTION_DECL]
+    The stubbed file is streamed out to a temporary file for clang to read,
+    and the prelude of unknown types is passed to clang as a separate header
+    so that the stubbed file never needs rewriting.
+    """
+    fd, stubbed_filename = tempfile.mkstemp(prefix="hornbill_", suffix=".c")
+    prelude_filename = stubbed_filename[:-2] + "_prelude.h"
+
+    try:
+        candidates = set()
+        with open(filename) as src, os.fdopen(fd, 'w') as dst:
+            for line in iter_stub_lines(src):
+                dst.write(line)
+                candidates.update(known_unknown_types.intersection(
+                                    _identifier.findall(line)))
+
+        def parse(types):
+            return clang_parse_file(stubbed_filename,
+                                    include=(prelude_filename,
+                                             _typedef_prelude(types)))
+
+        _, root_nodes = _parse_with_prelude(parse, candidates)
+
+        function_decl = _cindex().CursorKind.FUNCTION_DECL
+        functions = [Function(x) for x in root_nodes
+                     if x.kind == function_decl and
+                        x.location.file.name == stubbed_filename]
+    finally:
+        os.remove(stubbed_filename)
 
     for f in functions:
         f.location.filename = filename
 
     return functions
+
+
+def extract_functions(stubbed_lines, engine):
+    """
+    Returns the Function objects declared in already stubbed lines, using the
+    given engine. Their location filenames are not filled in.
+    """
+    functions = None
+    if engine == "fast":
+        import fast_parser
+        functions = fast_parser.parse_functions(stubbed_lines)
+        metrics.count("fast_engine_files_total" if functions is not None
+                      else "fast_engine_fallbacks_total")
+
+    if functions is None:
+        _, root_nodes = _parse_stubbed_lines(stubbed_lines)
+        function_decl = _cindex().CursorKind.FUNCTION_DECL
+        functions = [Function(x) for x in root_nodes if x.kind == function_decl]
+
+    return functions
+
+
+_block_token = re.compile(r"[{};]|/\*|\*/|//")
+
+def toplevel_blocks(lines):
+    """
+    Splits C source into consecutive top level blocks, using the same brace
+    matching as stub_lines. Each block runs up to and including the line which
+    finishes a top level declaration or definition, so a function's block also
+    holds the comment above it. Semicolons in comments don't end a block, and
+    blocks never end part way through a comment.
+
+    Returns a list of (first line index, end line index) pairs, which cover
+    every line.
+    """
+    blocks = []
+    start = 0
+    brace_levels = 0
+    in_comment = False
+
+    for i, line in enumerate(lines):
+        finished = False
+        line_comment = False
+        for m in _block_token.finditer(line):
+            token = m.group(0)
+            if token == "{":
+                brace_levels += 1
+            elif token == "}":
+                brace_levels -= 1
+                finished = brace_levels == 0
+            elif token == ";":
+                if brace_levels == 0 and not (in_comment or line_comment):
+                    finished = True
+            elif token == "/*":
+                in_comment = in_comment or not line_comment
+            elif token == "*/":
+                in_comment = False
+            elif not in_comment:
+                line_comment = True
+
+        if finished and brace_levels == 0 and not in_comment:
+            blocks.append((start, i + 1))
+            start = i + 1
+
+    if start < len(lines):
+        blocks.append((start, len(lines)))
+
+    return blocks
+
+
+def declaration_start(lines, func):
+    """
+    Returns the index of the first line of a function's declaration, ie. the
+    line with the return type.
+    """
+    start = func.location.linenumber - 1
+    while start > 0:
+        previous = lines[start - 1].strip()
+        if not previous or previous.startswith("#") or \
+                previous.endswith((";", "}", "*/", "{")):
+            break
+        start -= 1
+
+    return start
+
+
+def parse_file_functions(filename, engine=None, lines=None):
+    """Returns a list of parsed Function objects from a given C file
+
+    engine is "clang" or "fast", defaulting to default_engine. The fast engine
+    reads the declarations without libclang, falling back to clang for any
+    file it can't read with certainty.
+
+    lines, if given, are used in place of the contents of filename, eg. for an
+    unsaved editor buffer. Results are memoized in parse_cache by content.
+    """
+    if engine is None:
+        engine = default_engine
+
+    if lines is None:
+        lines = _read_lines(filename)
+
+    key = cache.content_key("functions", engine, filename, "".join(lines))
+    functions = parse_cache.get(key)
+    if functions is not None:
+        metrics.count("parse_cache_hits_total")
+        return list(functions)
+    metrics.count("parse_cache_misses_total")
+
+    #Remove all includes and function bodies
+    functions = extract_functions(stub_lines(list(lines)), engine)
+
+    for f in functions:
+        f.location.filename = filename
+
+    parse_cache.put(key, functions)
+
+    return list(functions)
+
+
+_typedef_statement = re.compile(r"\btypedef\b((?:[^;{}]|\{[^{}]*\})*);")
+_pointer_name = re.compile(r"\(\s*\*\s*([A-Za-z_][A-Za-z0-9_]*)\s*\)")
+
+def _typedef_names(text):
+    """
+    The names of the top level typedefs in stubbed text, which mustn't also be
+    declared in the prelude. Nested braces are rare enough in typedefs that
+    they're not handled.
+    """
+    names = set()
+    for m in _typedef_statement.finditer(_comment_text.sub("", text)):
+        declaration = re.sub(r"\{[^{}]*\}|\[[^\]]*\]", " ", m.group(1))
+        pointer = _pointer_name.search(declaration)
+        if pointer:
+            names.add(pointer.group(1))
+        else:
+            names.update(_identifier.findall(declaration)[-1:])
+
+    return names
+
+
+def _prelude_types(types, defined):
+    """
+    The names from types which can be declared in a prelude, ie. identifiers
+    which aren't keywords or defined by the file itself.
+    """
+    import fast_parser
+
+    prelude = []
+    for x in types:
+        # Diagnostics can quote things other than identifiers
+        m = _identifier.match(x)
+        if m is not None and m.group(0) == x and \
+                x not in fast_parser._keywords and x not in defined:
+            prelude.append(x)
+
+    return prelude
+
+
+def _in_file(node, stubbed_filename, prelude_length):
+    location = node.location
+    return location.file is not None and \
+        location.file.name == stubbed_filename and \
+        not (location.line == 1 and location.column <= prelude_length)
+
+
+def _data_types(root_nodes, filename):
+    """
+    Returns the DataTypes among the top level nodes of a file. A struct, union
+    or enum which is defined inside a typedef is named by the typedef, and
+    only returned once.
+    """
+    kinds = _cindex().CursorKind
+    record_kinds = {kinds.STRUCT_DECL: "struct",
+                    kinds.UNION_DECL : "union",
+                    kinds.ENUM_DECL  : "enum"}
+    member_kinds = (kinds.FIELD_DECL, kinds.ENUM_CONSTANT_DECL)
+
+    def members(node):
+        return [Variable(typename=x.type.spelling
+                                  if x.kind == kinds.FIELD_DECL else None,
+                         name=x.spelling,
+                         location=Location(filename, x.location.line))
+                for x in node.get_children()
+                if x.kind in member_kinds and x.spelling]
+
+    def inline_record(typedef):
+        declaration = typedef.underlying_typedef_type.get_declaration()
+        if declaration.kind in record_kinds and declaration.is_definition() and \
+                typedef.extent.start.offset <= \
+                declaration.extent.start.offset < typedef.extent.end.offset:
+            return declaration
+        return None
+
+    named_by_typedef = set()
+    for node in root_nodes:
+        if node.kind == kinds.TYPEDEF_DECL:
+            record = inline_record(node)
+            if record is not None:
+                named_by_typedef.add(record.extent.start.offset)
+
+    data_types = []
+    for node in root_nodes:
+        location = Location(filename, node.extent.start.line)
+
+        if node.kind in record_kinds:
+            if not node.is_definition() or node.is_anonymous() or \
+                    node.extent.start.offset in named_by_typedef:
+                continue
+            data_types.append(DataType(record_kinds[node.kind], node.spelling,
+                                       location, members(node)))
+
+        elif node.kind == kinds.TYPEDEF_DECL:
+            record = inline_record(node)
+            if record is None:
+                data_types.append(DataType("typedef", node.spelling, location))
+            else:
+                data_types.append(DataType(record_kinds[record.kind],
+                                           node.spelling, location,
+                                           members(record)))
+
+        elif node.kind == kinds.MACRO_DEFINITION:
+            # Include guards and flags, which have nothing to document
+            if len(list(node.get_tokens())) > 1:
+                data_types.append(DataType("macro", node.spelling, location))
+
+    return data_types
+
+
+def parse_file_declarations(filename, lines=None):
+    """
+    Returns (functions, data types) declared at the top level of a C file,
+    as lists of Function and DataType objects, from a single clang parse.
+
+    Unlike parse_file_functions, the bodies of structs, unions and enums and
+    the typedefs are kept in the stubbed source, and the macro definitions
+    are kept in the AST. The fast engine can't read these, so clang is always
+    used. lines and caching are as for parse_file_functions.
+    """
+    if lines is None:
+        lines = _read_lines(filename)
+
+    key = cache.content_key("declarations", filename, "".join(lines))
+    declarations = parse_cache.get(key)
+    if declarations is not None:
+        metrics.count("parse_cache_hits_total")
+        return (list(declarations[0]), list(declarations[1]))
+    metrics.count("parse_cache_misses_total")
+
+    text = "".join(stub_lines(list(lines), keep_types=True))
+    defined = _typedef_names(text)
+
+    def parse(types):
+        return clang_parse_file(
+                    STUBBED_FILENAME,
+                    _typedef_prelude(_prelude_types(types, defined)) + text,
+                    options=_cindex().TranslationUnit.
+                                PARSE_DETAILED_PROCESSING_RECORD)
+
+    candidates = set(_prelude_types(
+                        known_unknown_types.intersection(
+                            _identifier.findall(text)), defined))
+    types, root_nodes = _parse_with_prelude(parse, candidates)
+    prelude_length = len(_typedef_prelude(_prelude_types(types, defined)))
+
+    root_nodes = [x for x in root_nodes
+                  if _in_file(x, STUBBED_FILENAME, prelude_length)]
+
+    function_decl = _cindex().CursorKind.FUNCTION_DECL
+    functions = [Function(x) for x in root_nodes if x.kind == function_decl]
+    for f in functions:
+        f.location.filename = filename
+
+    data_types = _data_types(root_nodes, filename)
+
+    parse_cache.put(key, (functions, data_types))
+
+    return (list(functions), list(data_types))
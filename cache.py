@@ -0,0 +1,87 @@
+import collections
+import hashlib
+import os
+import pickle
+
+
+# Bump whenever the format of anything stored in a ResultCache changes, so
+# that stale entries written by older versions are never read back.
+CACHE_VERSION = 2
+
+
+def content_key(*parts):
+    """
+    Returns a cache key for the given strings (or bytes), eg. a kind of
+    result, a filename and the contents of that file.
+    """
+    digest = hashlib.sha1(str(CACHE_VERSION).encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part if isinstance(part, bytes) else part.encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Memoizes expensive results keyed by content_key.
+
+    The most recently used results are kept in memory. If a directory is
+    given, every result is also pickled there so that later runs can reuse
+    it.
+    """
+
+    def __init__(self, directory=None, memory_size=64):
+        self.directory = directory
+        self.memory_size = memory_size
+        self._memory = collections.OrderedDict()
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def _remember(self, key, value):
+        # Pop and reinsert to mark it most recently used
+        self._memory.pop(key, None)
+        self._memory[key] = value
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+        if key in self._memory:
+            value = self._memory.pop(key)
+            self._memory[key] = value
+            return value
+
+        if self.directory is None:
+            return default
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+
+        if self.directory is None:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+        # Write then rename, so that a concurrent reader never sees a
+        # partially written entry
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
@@ -17,6 +17,53 @@ VerbatimComment = namedtuple("VerbatimComment",
                              ["start_loc", "end_loc", "filename", "comment"])
 
 
+class BufferComment(object):
+    """
+    Represents a comment as written in a C file, like a VerbatimComment, but
+    stored as the (start, end) byte offsets of the comment in a buffer holding
+    the whole file (eg. bytes or an mmap). Many comments share the one buffer,
+    and the lines of a comment are only decoded when they're asked for.
+    """
+    __slots__ = ["buffer", "start", "end", "start_loc", "end_loc", "filename"]
+
+    def __init__(self, buffer, start, end, start_loc, end_loc, filename=None):
+        self.buffer    = buffer
+        self.start     = start
+        self.end       = end
+        self.start_loc = start_loc
+        self.end_loc   = end_loc
+        self.filename  = filename
+
+    def raw(self):
+        """The bytes of the comment, exactly as they are in the buffer"""
+        return bytes(self.buffer[self.start:self.end])
+
+    @property
+    def comment(self):
+        """The lines of the comment, as in VerbatimComment.comment"""
+        text = self.raw().decode("utf-8", "replace")
+        return [line.rstrip() for line in text.split("\n")]
+
+    def __eq__(self, other):
+        return isinstance(other, BufferComment) and \
+            self.buffer is other.buffer and \
+            (self.start, self.end) == (other.start, other.end)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.buffer), self.start, self.end))
+
+    def __repr__(self):
+        return "BufferComment(start_loc={}, end_loc={}, filename={!r})".format(
+                    self.start_loc, self.end_loc, self.filename)
+
+
+# Anything parse_doxygen and parse_edt accept as a comment from a C file
+SOURCE_COMMENTS = (VerbatimComment, BufferComment)
+
+
 class Error(object):
     def __init__(self, linenumber = None, colnumber = None, error = ""):
         self.rel_linenumber = linenumber
@@ -40,11 +87,13 @@ class Location(object):
 
 
 class Variable(object):
-    def __init__(self, typename = "", name = "", comment = "<Placeholder comment>"):
+    def __init__(self, typename = "", name = "", comment = "<Placeholder comment>",
+                 location = None):
         self.typename = typename
         self.name     = name
         self.comment  = comment
         self.inout    = "in"
+        self.location = location
 
     def __str__(self):
         if self.name == "<return>":
@@ -156,8 +205,40 @@ class DummyFunction(Function):
             return True
 
 
-class ParserError():
+class DataType(object):
+    """
+    A struct, union, enum, typedef or macro defined at the top level of a C
+    file. kind is one of c_parser.DATA_TYPE_KINDS.
+
+    members are the fields of a struct or union, or the constants of an enum,
+    as Variables with the location each is declared at.
+    """
+    def __init__(self, kind = None, name = None, location = None, members = None):
+        self.kind     = kind
+        self.name     = name
+        self.location = location or Location()
+        self.members  = members or []
+
+    def __str__(self):
+        string = "{} {}\n".format(self.kind.capitalize(), self.name)
+        string += "  Location: {}\n".format(self.location)
+        if self.members:
+            string += "  Members:\n"
+            for member in self.members:
+                string += "    {}\n".format(member.name)
+
+        return string
+
+    def dictify(self):
+        return {"kind"    : self.kind,
+                "location": self.location.dictify(),
+                "name"    : self.name,
+                "members" : [x.name for x in self.members]}
+
+
+class ParserError(Exception):
     def __init__(self, problem, location=None):
+        super(ParserError, self).__init__(problem)
         self.problem = problem
         self.location = location
 
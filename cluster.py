@@ -0,0 +1,348 @@
+import collections
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from multiprocessing.connection import Client, Listener
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import c_parser
+import metrics
+import workers
+
+
+"""
+Validates a file manifest across several machines.
+
+A coordinator serves the manifest over TCP, and any number of workers, on
+any machines which share the same checkout, connect to it and pull batches of
+files. Each worker streams the errors for each file back as soon as it has
+them. A batch is finished once every file in it has been reported, so if a
+worker disconnects or goes quiet for too long, whatever it hadn't yet
+reported is re-queued for the others.
+
+Messages are pickled, so anyone who can connect can run code on the
+coordinator and its workers. Connections are therefore authenticated with a
+shared key, which must be set in the HORNBILL_CLUSTER_KEY environment
+variable of every node, and the coordinator listens on localhost unless
+told otherwise. Even so, only run a cluster on a trusted network. The
+protocol, from the worker's side, is:
+
+    -> ("hello", name)                      <- ("settings", settings)
+    -> ("next",)                            <- ("batch", [(index, filename)])
+                                               or ("done",)
+    -> ("result", index, seconds, errors, metrics, types)
+                                            (once per file in the batch, see
+                                             metrics.take and
+                                             workers.new_types)
+"""
+
+
+def authkey():
+    """
+    Returns the key shared by the coordinator and its workers. Raises
+    ValueError if HORNBILL_CLUSTER_KEY isn't set, as there is no safe default.
+    """
+    key = os.environ.get("HORNBILL_CLUSTER_KEY")
+    if not key:
+        raise ValueError("HORNBILL_CLUSTER_KEY must be set to a secret shared"
+                         " by the coordinator and its workers")
+
+    return key.encode("utf-8")
+
+
+def parse_address(spec):
+    """
+    Parses an address of the form "host:port", where host may be left out
+    for localhost.
+
+    Returns (host, port).
+    """
+    host, _, port = spec.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError("Address \"{}\" is not of the form host:port".format(
+                            spec))
+
+    return (host or "127.0.0.1", port)
+
+
+class _WorkerLost(Exception):
+    pass
+
+
+class Coordinator(object):
+    """
+    Serves (index, filename) pairs to workers in batches of batch_size.
+
+    timeout is the most seconds a worker holding a batch may go without
+    reporting a result before it's presumed lost, or None to only notice
+    workers which disconnect. A file handed out max_attempts times without a
+    result is reported as a validate.ValidationFailedError rather than
+    re-queued again.
+    """
+
+    def __init__(self, address, batch_size=16, timeout=None, max_attempts=3,
+                 settings=None):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.settings = dict(settings or workers.current_settings(),
+                             cache_dir=None)
+
+        self._listener = Listener(address, authkey=authkey())
+        # The address actually listened on, eg. when asked for port 0
+        self.address = self._listener.address
+
+        self._lock = threading.Condition()
+        self._pending = collections.deque()
+        self._attempts = dict()
+        self._finished = set()
+        self._total = 0
+        self._results = queue.Queue()
+
+        # Names of the workers which have connected, and how many files were
+        # re-queued after losing their worker
+        self.workers = []
+        self.requeued = 0
+
+    def _all_finished(self):
+        return len(self._finished) == self._total
+
+    def _take_batch(self):
+        """
+        Returns the next batch, waiting for one to be re-queued if every file
+        has been handed out but some are unfinished. Returns None once every
+        file is finished.
+        """
+        with self._lock:
+            while not self._pending and not self._all_finished():
+                self._lock.wait()
+
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                task = self._pending.popleft()
+                self._attempts[task[0]] = self._attempts.get(task[0], 0) + 1
+                batch.append(task)
+
+            return batch or None
+
+    def _finish(self, index, filename, seconds, errors):
+        with self._lock:
+            if index in self._finished:
+                return
+            self._finished.add(index)
+            self._results.put((index, filename, seconds, errors))
+
+            if self._all_finished():
+                self._lock.notify_all()
+
+    def _requeue(self, tasks, reason):
+        import validate
+
+        with self._lock:
+            requeue = []
+            for index, filename in tasks:
+                if self._attempts[index] >= self.max_attempts:
+                    metrics.count("files_failed_total", reason="lost")
+                    self._finish(index, filename, 0.0,
+                                 [validate.ValidationFailedError(
+                                      filename, "{} ({} attempts)".format(
+                                          reason, self._attempts[index]))])
+                elif index not in self._finished:
+                    requeue.append((index, filename))
+
+            # Ahead of the rest, in their original order
+            self._pending.extendleft(reversed(requeue))
+            self.requeued += len(requeue)
+            self._lock.notify_all()
+
+    def _receive(self, conn, busy):
+        if busy and self.timeout is not None and \
+                not conn.poll(self.timeout):
+            raise _WorkerLost("worker timed out after {}s".format(
+                                  self.timeout))
+        return conn.recv()
+
+    def _serve(self, conn):
+        outstanding = collections.OrderedDict()
+        reason = "worker disconnected"
+        try:
+            _, name = conn.recv()
+            self.workers.append(name)
+            conn.send(("settings", self.settings))
+
+            while True:
+                message = self._receive(conn, bool(outstanding))
+
+                if message[0] == "next":
+                    batch = self._take_batch()
+                    if batch is None:
+                        conn.send(("done",))
+                        break
+                    outstanding.update(batch)
+                    conn.send(("batch", batch))
+
+                elif message[0] == "result":
+                    _, index, seconds, errors, worker_metrics, types = message
+                    metrics.merge(worker_metrics)
+                    c_parser.known_unknown_types.update(types)
+                    filename = outstanding.pop(index)
+                    self._finish(index, filename, seconds, errors)
+
+        except _WorkerLost as e:
+            reason = str(e)
+        except (EOFError, IOError, OSError):
+            pass
+        finally:
+            self._requeue(list(outstanding.items()), reason)
+            conn.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (IOError, OSError, EOFError,
+                    multiprocessing.AuthenticationError):
+                # Closed, or a connection which failed to authenticate
+                if self._closed:
+                    break
+                continue
+
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def run(self, indexed_files):
+        """
+        Starts serving each (index, filename) pair to the workers. Returns an
+        iterator of (index, filename, seconds, errors) for each file as it's
+        reported.
+        """
+        with self._lock:
+            self._pending.extend(indexed_files)
+            self._total = len(self._pending)
+
+        self._closed = False
+        self._threads = []
+        accepter = threading.Thread(target=self._accept)
+        accepter.daemon = True
+        accepter.start()
+
+        return self._iter_results()
+
+    def _iter_results(self):
+        try:
+            for _ in range(self._total):
+                yield self._results.get()
+        finally:
+            self._closed = True
+            self._listener.close()
+
+            # Give the idle workers a chance to hear that there's no more work
+            for thread in list(self._threads):
+                thread.join(1)
+
+
+def run_worker(address, cache_dir=None, name=None):
+    """
+    Validates batches from the coordinator at address until there are none
+    left, using a result cache in cache_dir if given.
+
+    Returns the number of files validated.
+    """
+    import validate
+
+    conn = Client(address, authkey=authkey())
+    try:
+        conn.send(("hello", name or "{}:{}".format(socket.gethostname(),
+                                                   os.getpid())))
+        _, settings = conn.recv()
+        workers.apply_settings(dict(settings, cache_dir=cache_dir))
+        sent_types = set(c_parser.known_unknown_types)
+
+        validated = 0
+        while True:
+            conn.send(("next",))
+            message = conn.recv()
+            if message[0] == "done":
+                break
+
+            for index, filename in message[1]:
+                start = time.time()
+                try:
+                    errors = validate.find_documentation_errors(filename)
+                except Exception as e:
+                    metrics.count("files_failed_total", reason="error")
+                    errors = [validate.ValidationFailedError(
+                                  filename,
+                                  "{}: {}".format(type(e).__name__, e))]
+
+                conn.send(("result", index, time.time() - start, errors,
+                           metrics.take(), workers.new_types(sent_types)))
+                validated += 1
+    finally:
+        conn.close()
+
+    return validated
+
+
+def test_cluster():
+    """
+    Several workers on localhost share a manifest, including a batch taken by
+    a worker which disconnects without reporting anything.
+    """
+    import validate
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    good = os.path.join(dir_path, 'test_sources', 'single_func.c')
+    missing = os.path.join(dir_path, 'test_sources', 'missing.c')
+    manifest = list(enumerate([good] * 10 + [missing]))
+
+    os.environ.setdefault("HORNBILL_CLUSTER_KEY", "test_cluster")
+    coordinator = Coordinator(("127.0.0.1", 0), batch_size=3, timeout=30)
+    results = coordinator.run(manifest)
+
+    # A worker which takes the first batch and dies with it
+    lost = Client(coordinator.address, authkey=authkey())
+    lost.send(("hello", "lost"))
+    lost.recv()
+    lost.send(("next",))
+    assert lost.recv()[0] == "batch"
+    lost.close()
+
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(coordinator.address,))
+                 for _ in range(3)]
+    for process in processes:
+        process.start()
+
+    found = dict((index, errors) for index, _, _, errors in results)
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    assert sorted(found) == [index for index, _ in manifest]
+    for index, filename in manifest:
+        if filename == good:
+            assert [type(e) for e in found[index]] == \
+                [validate.NoDocumentationError]
+
+    [err] = found[len(manifest) - 1]
+    assert isinstance(err, validate.ValidationFailedError)
+
+    assert coordinator.requeued == 3
+    assert len(coordinator.workers) == 4
+
+
+if __name__ == '__main__':
+    test_cluster()
+    print('Tests passed.')
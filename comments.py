@@ -1,9 +1,57 @@
+import collections
+import copy
+import re
+
 from classes import *
+import cache
+import metrics
+import references
 
 from edt import parse_edt
 from doxygen import parse_doxygen
 
 
+# Parse results keyed by the text of each comment, so that re-matching an
+# edited file only parses the comments which changed.
+_parsed_comments = cache.ResultCache(memory_size=4096)
+_not_parsed = object()
+
+
+def _parse_comment(parse, verbatim_comment):
+    """
+    Returns parse(verbatim_comment), reusing the result for an identical
+    comment if there is one.
+    """
+    if isinstance(verbatim_comment, BufferComment):
+        text = verbatim_comment.raw()
+    else:
+        text = "\n".join(verbatim_comment.comment)
+    key = cache.content_key(parse.__name__, references.rules_digest, text)
+
+    result = _parsed_comments.get(key, _not_parsed)
+    if result is _not_parsed:
+        metrics.count("comment_cache_misses_total")
+        result = parse(verbatim_comment)
+
+        # Cache it without the docstring, which a BufferComment would pin
+        # the whole file's buffer with; it's attached again on each hit
+        cached = result
+        if getattr(result, "docstring", None) is not None:
+            cached = copy.copy(result)
+            cached.docstring = None
+        _parsed_comments.put(key, cached)
+        return result
+
+    metrics.count("comment_cache_hits_total")
+    if result is not None:
+        # The result may refer back to where the comment was found
+        result = copy.copy(result)
+        if hasattr(result, "docstring"):
+            result.docstring = verbatim_comment
+
+    return result
+
+
 class _State(enum.Enum):
     """
     During parsing, we need to keep track of which kind of comment line
@@ -14,16 +62,14 @@ class _State(enum.Enum):
     COMMENT_NOT_ENCOUNTERED = 6
 
 
-def _find_toplevel_comments(c_lines, comment_format, filename=None):
+def _iter_toplevel_comments(c_lines, comment_format, filename=None):
     """
-    Find all top-level Doxygen docstrings in a C file.
-
-    Returns a list of VerbatimComments.
+    Find all top-level docstrings of the given format in C source, yielding
+    each VerbatimComment as soon as it ends.
 
-    c_lines is a list of lines of C source.
+    c_lines is any iterable of lines of C source, so a file can be scanned
+    without reading all of it into memory.
     """
-    comments = []  # This is what we will return
-    c_lines = [l.rstrip() for l in c_lines]
     state = _State.COMMENT_NOT_ENCOUNTERED
 
     if comment_format == CommentFormat.Doxygen:
@@ -34,6 +80,7 @@ def _find_toplevel_comments(c_lines, comment_format, filename=None):
         raise InputError("Unknown CommentFormat {}".format(comment_format))
 
     for num, line in enumerate(c_lines):
+        line = line.rstrip()
         if line == comment_start:
             state = _State.COMMENT_STARTED
             start_line = num + 1
@@ -42,43 +89,120 @@ def _find_toplevel_comments(c_lines, comment_format, filename=None):
             state = _State.COMMENT_ENDED
             comment.append(' */')
 
-            comments.append(VerbatimComment(comment=comment,
-                                            start_loc=start_line,
-                                            end_loc=num+1,
-                                            filename=filename))
+            yield VerbatimComment(comment=comment,
+                                  start_loc=start_line,
+                                  end_loc=num+1,
+                                  filename=filename)
         else:
             if state == _State.COMMENT_STARTED:
                 comment.append(line)
 
-    return comments
+
+# The lines which start and end a top level comment of each format, matching
+# the same lines as _iter_toplevel_comments does (ie. after an rstrip)
+_comment_delimiters = dict(
+    (comment_format,
+     re.compile(br"^(?:(" + re.escape(comment_start) + br")|( \*/))"
+                br"[ \t\r\x0b\x0c\x1c-\x1f]*$", re.MULTILINE))
+    for comment_format, comment_start in [(CommentFormat.Doxygen, b"/**"),
+                                          (CommentFormat.EDT, b"/*")])
+
+
+def _iter_buffer_comments(buffer, comment_format, filename=None):
+    """
+    Does the same as _iter_toplevel_comments, but over a buffer holding the
+    whole of the C source (bytes, or anything else re can search, eg. an
+    mmap), yielding a BufferComment for each comment.
+
+    Only the delimiting lines are looked at here, so nothing is copied out of
+    the buffer until a comment's lines are used.
+    """
+    if comment_format not in _comment_delimiters:
+        raise InputError("Unknown CommentFormat {}".format(comment_format))
+
+    linenumber = 1
+    counted_to = 0
+    start = None
+
+    for match in _comment_delimiters[comment_format].finditer(buffer):
+        if isinstance(buffer, bytes):
+            linenumber += buffer.count(b"\n", counted_to, match.start())
+        else:
+            linenumber += buffer[counted_to:match.start()].count(b"\n")
+        counted_to = match.start()
+
+        if match.group(1) is not None:
+            start = (match.start(), linenumber)
+        elif start is not None:
+            yield BufferComment(buffer, start[0], match.end(),
+                                start_loc=start[1],
+                                end_loc=linenumber,
+                                filename=filename)
+            start = None
 
 
-def find_toplevel_docstrings(filename, comment_format):
+def _find_toplevel_comments(c_lines, comment_format, filename=None):
+    """
+    Find all top-level Doxygen docstrings in a C file.
+
+    Returns a list of VerbatimComments, or BufferComments if c_lines is a
+    buffer rather than a list of lines.
+
+    c_lines is a list of lines of C source, or a buffer holding the source.
+    """
+    if isinstance(c_lines, list):
+        comments = _iter_toplevel_comments(c_lines, comment_format, filename)
+    else:
+        comments = _iter_buffer_comments(c_lines, comment_format, filename)
+
+    return list(comments)
+
+
+def _read_buffer(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _iter_file_lines(filename):
+    with open(filename) as f:
+        for line in f:
+            yield line
+
+
+def find_toplevel_docstrings(filename, comment_format, c_lines=None):
     """
     Find all top-level docstrings in a C file.
 
-    Returns a list of the function docstrings, each docstring a VerbatimComment.
+    Returns a list of the function docstrings, each docstring a VerbatimComment
+    or BufferComment.
 
-    c_lines is a list of lines of C source.
     comment_format is a CommentFormat enum.
+    c_lines, if given, is the list of lines of C source (or a buffer holding
+    the source) to use in place of the contents of filename.
     """
 
-    with open(filename) as f:
-        c_lines = f.readlines()
+    if c_lines is None:
+        c_lines = _read_buffer(filename)
 
     return _find_toplevel_comments(c_lines, comment_format, filename)
 
 
-def find_func_docstrings(filename, functions):
+def find_func_docstrings(filename, functions, c_lines=None):
     """
     For each function in the given list of functions, attempts to find the
-    relevant docstring in filename.
+    relevant docstring in filename (or in c_lines, if given, which is either
+    a list of lines or a buffer holding the source).
     Returns a zipped object of (function, relevant_docstring), where
     relevant_docstring is None if no suitable comment could be found
     """
 
-    doxygen_comments = find_toplevel_docstrings(filename, CommentFormat.Doxygen)
-    edt_comments = find_toplevel_docstrings(filename, CommentFormat.EDT)
+    if c_lines is None:
+        c_lines = _read_buffer(filename)
+
+    doxygen_comments = find_toplevel_docstrings(filename, CommentFormat.Doxygen,
+                                                c_lines)
+    edt_comments = find_toplevel_docstrings(filename, CommentFormat.EDT,
+                                            c_lines)
 
     found_docstrings = list()
 
@@ -89,7 +213,8 @@ def find_func_docstrings(filename, functions):
         found = False
         for docstring in doxygen_comments:
             if func_line - 2 <= docstring.end_loc < func_line:
-                found_docstrings.append(parse_doxygen(docstring))
+                found_docstrings.append(_parse_comment(parse_doxygen,
+                                                       docstring))
                 found = True
                 break
 
@@ -101,7 +226,7 @@ def find_func_docstrings(filename, functions):
     else:
         for i, verbatim_comment in enumerate(edt_comments):
             try:
-                edt_comments[i] = parse_edt(verbatim_comment)
+                edt_comments[i] = _parse_comment(parse_edt, verbatim_comment)
             except ParserError as e:
                 edt_comments[i] = None
                 print(e)
@@ -131,3 +256,185 @@ def find_func_docstrings(filename, functions):
                     break
 
     return zip(functions, found_docstrings)
+
+
+# Any comment or string literal in a buffer of C source. Strings are matched
+# only so that comment markers inside them are skipped.
+_any_comment = re.compile(br"""
+      "(?:\\.|[^"\\\n])*"
+    | '(?:\\.|[^'\\\n])*'
+    | /\*.*?\*/
+    | //[^\n]*
+    """, re.VERBOSE | re.DOTALL)
+
+_doxygen_markers = (b"/**", b"/*!", b"///", b"//!")
+
+
+def _iter_own_line_comments(buffer, filename=None):
+    """
+    Yields (comment, own line) for every comment in a buffer of C source,
+    including those inside declarations, where comment is a BufferComment and
+    own line is whether nothing but whitespace comes before it on its line.
+    """
+    linenumber = 1
+    counted_to = 0
+
+    for match in _any_comment.finditer(buffer):
+        if match.group(0)[:1] in (b'"', b"'"):
+            continue
+
+        linenumber += buffer.count(b"\n", counted_to, match.start())
+        counted_to = match.start()
+
+        line_start = buffer.rfind(b"\n", 0, match.start()) + 1
+        yield (BufferComment(buffer, match.start(), match.end(),
+                             start_loc=linenumber,
+                             end_loc=linenumber +
+                                     buffer.count(b"\n", match.start(),
+                                                  match.end()),
+                             filename=filename),
+               not buffer[line_start:match.start()].strip())
+
+
+def _is_type_docstring(comment, buffer):
+    """
+    Whether a comment on its own line can document the declaration below it:
+    a Doxygen comment, or any top level comment in either format.
+    """
+    raw = comment.raw()
+    if raw.startswith(_doxygen_markers):
+        return True
+
+    at_line_start = comment.start == 0 or buffer[comment.start - 1:
+                                                 comment.start] == b"\n"
+    return at_line_start and raw.split(b"\n", 1)[0].rstrip() == b"/*"
+
+
+def find_type_docstrings(filename, data_types, c_lines=None):
+    """
+    For each DataType in data_types, attempts to find the comment documenting
+    it in filename (or in c_lines, if given, as for find_func_docstrings),
+    and which of its members have no comment of their own.
+
+    A data type is documented by a Doxygen or top level comment which ends
+    just above it, as a function is, except that single line Doxygen comments
+    count too. A member is documented by a comment on its own line, or by a
+    comment on the line(s) just above it.
+
+    Returns a list of (data type, comment, undocumented member names), where
+    comment is a BufferComment, or None if none could be found.
+    """
+    if c_lines is None:
+        c_lines = _read_buffer(filename)
+
+    if isinstance(c_lines, list):
+        buffer = "".join(c_lines).encode("utf-8")
+    else:
+        buffer = c_lines
+
+    # Lines which have a comment of their own, and those just below one
+    documented_lines = set()
+    docstrings = dict()
+    for comment, own_line in _iter_own_line_comments(buffer, filename):
+        documented_lines.add(comment.start_loc)
+
+        if own_line:
+            documented_lines.add(comment.end_loc + 1)
+            if _is_type_docstring(comment, buffer):
+                docstrings[comment.end_loc] = comment
+
+    found = []
+    for data_type in data_types:
+        line = data_type.location.linenumber
+        docstring = docstrings.get(line - 1) or docstrings.get(line - 2)
+
+        found.append((data_type, docstring,
+                      [member.name for member in data_type.members
+                       if member.location.linenumber not in documented_lines]))
+
+    return found
+
+
+def find_func_docstrings_streaming(filename, functions):
+    """
+    Does the same as find_func_docstrings, but streams the comments out of
+    filename rather than reading it into memory. Only the comment currently
+    being scanned is held in full; matched EDT comments are kept without
+    their text.
+
+    """
+    found_docstrings = [None] * len(functions)
+
+    # Doxygen comments are matched by position, so walk them alongside the
+    # functions, keeping only those which could still match.
+    doxygen_comments = _iter_toplevel_comments(_iter_file_lines(filename),
+                                               CommentFormat.Doxygen, filename)
+    window = collections.deque()
+    next_comment = next(doxygen_comments, None)
+
+    in_file_order = sorted(range(len(functions)),
+                           key=lambda i: functions[i].location.linenumber)
+
+    for i in in_file_order:
+        func_line = functions[i].location.linenumber
+
+        while next_comment is not None and next_comment.end_loc < func_line:
+            window.append(next_comment)
+            next_comment = next(doxygen_comments, None)
+
+        while window and window[0].end_loc < func_line - 2:
+            window.popleft()
+
+        for docstring in window:
+            if func_line - 2 <= docstring.end_loc < func_line:
+                found_docstrings[i] = _parse_comment(parse_doxygen, docstring)
+                break
+
+    if None not in found_docstrings:
+        return zip(functions, found_docstrings)
+
+    # Parse every EDT comment, indexing them by name and by end line so that
+    # each function can find the first which matches either way.
+    by_name = dict()
+    by_end_loc = dict()
+    edt_comments = []
+
+    for verbatim_comment in _iter_toplevel_comments(_iter_file_lines(filename),
+                                                    CommentFormat.EDT,
+                                                    filename):
+        try:
+            edt = _parse_comment(parse_edt, verbatim_comment)
+        except ParserError as e:
+            print(e)
+            continue
+        except Exception as e:
+            print("Comment {} caused exception {}".format(
+                verbatim_comment, e))
+            continue
+
+        if edt is None:
+            continue
+
+        edt = copy.copy(edt)
+        edt.docstring = verbatim_comment._replace(comment=None)
+
+        index = len(edt_comments)
+        edt_comments.append(edt)
+        by_name.setdefault(edt.name, index)
+        by_end_loc.setdefault(verbatim_comment.end_loc, index)
+
+    for i, func in enumerate(functions):
+        if found_docstrings[i] is not None:
+            continue
+
+        func_line = func.location.linenumber
+
+        candidates = [by_name.get(func.name),
+                      by_end_loc.get(func_line - 2),
+                      by_end_loc.get(func_line - 1)]
+        candidates = [x for x in candidates if x is not None]
+
+        if candidates:
+            found_docstrings[i] = edt_comments[min(candidates)]
+
+    return zip(functions, found_docstrings)
@@ -0,0 +1,296 @@
+import hashlib
+import sqlite3
+
+from classes import *
+
+
+"""
+Exports the functions in a tree, the docstrings matched to them and their
+documentation errors to a SQLite database, for querying documentation
+coverage over time, eg. every undocumented function in a subsystem which
+returns int:
+
+    SELECT files.filename, functions.name
+    FROM files
+    JOIN functions ON functions.hash = files.hash
+    WHERE files.release = '4.2'
+      AND files.filename LIKE 'net/%'
+      AND functions.return_type = 'int'
+      AND functions.doc_format IS NULL;
+
+Parse results are stored against the SHA-1 of each file's contents, and files
+only point at them, so a file which is unchanged since it was last exported
+(in any release) is not parsed again.
+"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    release     TEXT NOT NULL,
+    filename    TEXT NOT NULL,
+    hash        TEXT NOT NULL,
+    PRIMARY KEY (release, filename)
+);
+
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+
+CREATE TABLE IF NOT EXISTS sources (
+    hash        TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS functions (
+    id          INTEGER PRIMARY KEY,
+    hash        TEXT NOT NULL,
+    line        INTEGER,
+    name        TEXT,
+    return_type TEXT,
+    doc_format  TEXT,
+    doc_comment TEXT,
+    doc_returns INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS functions_hash ON functions (hash);
+
+CREATE TABLE IF NOT EXISTS args (
+    function_id INTEGER NOT NULL,
+    position    INTEGER NOT NULL,
+    name        TEXT,
+    type        TEXT,
+    documented  INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS args_function ON args (function_id);
+
+CREATE TABLE IF NOT EXISTS errors (
+    function_id INTEGER NOT NULL,
+    error       TEXT NOT NULL,
+    argname     TEXT,
+    message     TEXT
+);
+
+CREATE INDEX IF NOT EXISTS errors_function ON errors (function_id);
+"""
+
+
+def connect(filename):
+    """Opens (creating if need be) a documentation database"""
+    db = sqlite3.connect(filename)
+    db.executescript(_SCHEMA)
+    return db
+
+
+def _doc_format(doc):
+    if doc is None:
+        return None
+    elif isinstance(doc, DummyFunction):
+        # An EDT comment saying the function is documented elsewhere
+        return "reference"
+    elif hasattr(doc, "docstring"):
+        return "edt"
+    else:
+        return "doxygen"
+
+
+class _Batch(object):
+    """The rows for a batch of files, inserted in one transaction"""
+
+    def __init__(self, next_function_id):
+        self.next_function_id = next_function_id
+        self.files = []
+        self.sources = []
+        self.functions = []
+        self.args = []
+        self.errors = []
+
+        # (release, filename) of files no longer in the release
+        self.removed = []
+
+    def add_source(self, file_hash, func_docstrings, errors):
+        self.sources.append((file_hash,))
+
+        function_ids = dict()
+        for func, doc in func_docstrings:
+            function_id = self.next_function_id
+            self.next_function_id += 1
+            function_ids[id(func)] = function_id
+
+            documented = set(arg.name for arg in doc.args) if doc else set()
+
+            self.functions.append((
+                function_id,
+                file_hash,
+                func.location.linenumber,
+                func.name,
+                func.returns.typename if func.returns else None,
+                _doc_format(doc),
+                doc.comment if doc and isinstance(doc.comment, str) else None,
+                int(doc.returns is not None) if doc else None))
+
+            self.args.extend((function_id, position, arg.name, arg.typename,
+                              int(arg.name in documented))
+                             for position, arg in enumerate(func.args))
+
+        self.errors.extend((function_ids[id(err.func)],
+                            type(err).__name__,
+                            err.argname,
+                            err.message())
+                           for err in errors)
+
+    def write(self, db):
+        with db:
+            db.executemany("INSERT OR IGNORE INTO sources VALUES (?)",
+                           self.sources)
+            db.executemany("INSERT INTO functions"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           self.functions)
+            db.executemany("INSERT INTO args VALUES (?, ?, ?, ?, ?)",
+                           self.args)
+            db.executemany("INSERT INTO errors VALUES (?, ?, ?, ?)",
+                           self.errors)
+            db.executemany("INSERT INTO files VALUES (?, ?, ?)"
+                           " ON CONFLICT (release, filename)"
+                           " DO UPDATE SET hash = excluded.hash",
+                           self.files)
+            db.executemany("DELETE FROM files"
+                           " WHERE release = ? AND filename = ?",
+                           self.removed)
+
+
+def _prune(db):
+    """Deletes the results for contents which no file points at any more"""
+    with db:
+        db.execute("DELETE FROM sources"
+                   " WHERE hash NOT IN (SELECT hash FROM files)")
+        db.execute("DELETE FROM errors WHERE function_id IN"
+                   " (SELECT id FROM functions"
+                   "  WHERE hash NOT IN (SELECT hash FROM sources))")
+        db.execute("DELETE FROM args WHERE function_id IN"
+                   " (SELECT id FROM functions"
+                   "  WHERE hash NOT IN (SELECT hash FROM sources))")
+        db.execute("DELETE FROM functions"
+                   " WHERE hash NOT IN (SELECT hash FROM sources)")
+
+
+def export_files(db_filename, filenames, release="", batch_size=100):
+    """
+    Exports each of the given C files to the database in db_filename, under
+    the given release name. Files exported under the release before which
+    aren't among filenames are taken out of it, as they've been deleted.
+
+    Returns the number of files which had to be parsed.
+    """
+    import validate
+
+    db = connect(db_filename)
+    try:
+        known = dict(db.execute("SELECT filename, hash FROM files"
+                                " WHERE release = ?", (release,)))
+        ingested = set(x for x, in db.execute("SELECT hash FROM sources"))
+
+        def new_batch():
+            last_id, = db.execute("SELECT MAX(id) FROM functions").fetchone()
+            return _Batch((last_id or 0) + 1)
+
+        batch = new_batch()
+        parsed = 0
+        changed = False
+
+        filenames = list(filenames)
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                contents = f.read()
+            file_hash = hashlib.sha1(contents).hexdigest()
+
+            if known.get(filename) == file_hash:
+                continue
+
+            changed = True
+            batch.files.append((release, filename, file_hash))
+
+            if file_hash not in ingested:
+                source = contents.decode("utf-8", "replace")
+                func_docstrings = validate.find_documented_functions(filename,
+                                                                     source)
+                errors = validate.check_func_docstrings(func_docstrings)
+
+                batch.add_source(file_hash, func_docstrings, errors)
+                ingested.add(file_hash)
+                parsed += 1
+
+            if len(batch.files) >= batch_size:
+                batch.write(db)
+                batch = new_batch()
+
+        # Files exported before which aren't any more have been deleted, and
+        # go in the same transaction as the last of the new rows
+        exported = set(filenames)
+        batch.removed = [(release, filename) for filename in sorted(known)
+                         if filename not in exported]
+        batch.write(db)
+
+        if changed or batch.removed:
+            _prune(db)
+    finally:
+        db.close()
+
+    return parsed
+
+
+def test_export():
+    """Unchanged files are not parsed again, even for a new release"""
+    import os
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_filename = os.path.join(tmp_dir, "docs.db")
+        documented = os.path.join(tmp_dir, "documented.c")
+        undocumented = os.path.join(tmp_dir, "undocumented.c")
+        with open(documented, "w") as f:
+            f.write("/**\n * Does foo\n */\nvoid foo(void)\n{\n}\n")
+        with open(undocumented, "w") as f:
+            f.write("int bar(int a)\n{\n}\n")
+        filenames = [documented, undocumented]
+
+        assert export_files(db_filename, filenames, "1.0") == 2
+        assert export_files(db_filename, filenames, "1.0") == 0
+        assert export_files(db_filename, filenames, "1.1") == 0
+
+        with open(undocumented, "w") as f:
+            f.write("/**\n * Does bar\n *\n * @param[in] a\n *\n"
+                    " * @return int\n */\nint bar(int a)\n{\n}\n")
+        assert export_files(db_filename, filenames, "1.1") == 1
+
+        db = connect(db_filename)
+        try:
+            rows = db.execute("SELECT files.release, functions.name"
+                              " FROM files JOIN functions"
+                              " ON functions.hash = files.hash"
+                              " WHERE functions.doc_format IS NULL").fetchall()
+        finally:
+            db.close()
+        assert rows == [("1.0", "bar")]
+
+        # Deleting a file drops it from the release it was deleted in only
+        os.remove(undocumented)
+        assert export_files(db_filename, [documented], "1.1") == 0
+
+        db = connect(db_filename)
+        try:
+            files = db.execute("SELECT release, filename FROM files"
+                               " ORDER BY release, filename").fetchall()
+            sources = db.execute("SELECT COUNT(*) FROM sources").fetchone()
+        finally:
+            db.close()
+        assert files == [("1.0", documented), ("1.0", undocumented),
+                         ("1.1", documented)]
+        # The edited file's contents were only in 1.1, so are pruned
+        assert sources == (2,)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_export()
+    print('Tests passed.')
@@ -0,0 +1,208 @@
+import os
+
+from classes import *
+import cache
+import c_parser
+import references
+
+
+"""
+Documentation coverage of a tree of C files, aggregated by directory.
+
+Each file is summarised as one record per function, which is kept in a
+ResultCache keyed by the file's contents. Regenerating a report after a
+small change then only re-parses the files which changed, and re-adds the
+cached records for the rest.
+"""
+
+
+# Errors which mean a documented function's arguments don't match its comment
+_ARGUMENT_ERRORS = {"MissingArgumentError", "ExtraArgumentError",
+                    "WrongArgumentError"}
+
+
+def _function_records(func_docstrings, errors):
+    """
+    Returns a list of (function name, documented, complete args, missing
+    return) for each function.
+    """
+    error_names = dict()
+    for err in errors:
+        error_names.setdefault(id(err.func), set()).add(type(err).__name__)
+
+    records = []
+    for func, _ in func_docstrings:
+        names = error_names.get(id(func), set())
+        documented = "NoDocumentationError" not in names
+        records.append((func.name,
+                        documented,
+                        documented and not names & _ARGUMENT_ERRORS,
+                        "NoReturnError" in names))
+
+    return records
+
+
+def file_records(filename, result_cache):
+    """
+    Returns the function records of a C file (see _function_records), from
+    result_cache if the file hasn't changed.
+    """
+    import validate
+
+    with open(filename, 'rb') as f:
+        contents = f.read()
+
+    key = cache.content_key("coverage", c_parser.default_engine,
+                            references.rules_digest, filename, contents)
+    records = result_cache.get(key)
+
+    if records is None:
+        func_docstrings = validate.find_documented_functions(
+                                filename, contents.decode("utf-8", "replace"))
+        errors = validate.check_func_docstrings(func_docstrings)
+        records = _function_records(func_docstrings, errors)
+        result_cache.put(key, records)
+
+    return records
+
+
+def _directories(filename, top):
+    """
+    Yields the directory of filename, then each of its parents up to and
+    including top, or up to the root if filename isn't below top.
+    """
+    directory = os.path.dirname(os.path.normpath(filename))
+    while True:
+        yield directory or "."
+        parent = os.path.dirname(directory)
+        if not directory or parent == directory or directory == top:
+            break
+        directory = parent
+
+
+def _common_directory(paths):
+    """The deepest directory holding all of paths, or "" for the current"""
+    split = [os.path.normpath(path).split(os.sep) for path in paths]
+    common = []
+    for parts in zip(*split):
+        if any(part != parts[0] for part in parts):
+            break
+        common.append(parts[0])
+
+    if common == [""]:
+        # Only the root
+        return os.sep
+    return os.sep.join(common)
+
+
+def aggregate(filenames, result_cache, ignore_funcs=(), roots=None):
+    """
+    Returns {directory: counts} for every directory holding any of the given
+    files, directly or below it, up to the deepest directory holding all of
+    roots (the files and directories given on the command line), or by
+    default of the files. counts is a dict of the number of functions, and
+    how many are documented, have complete args or are missing returns.
+    """
+    filenames = list(filenames)
+    top = _common_directory([root if os.path.isdir(root)
+                             else os.path.dirname(root) or "."
+                             for root in roots or filenames])
+    if top == ".":
+        top = ""
+
+    tree = dict()
+
+    for filename in filenames:
+        records = [r for r in file_records(filename, result_cache)
+                   if r[0] not in ignore_funcs]
+
+        file_counts = [len(records),
+                       sum(1 for r in records if r[1]),
+                       sum(1 for r in records if r[2]),
+                       sum(1 for r in records if r[3])]
+
+        for directory in _directories(filename, top):
+            counts = tree.setdefault(directory, [0, 0, 0, 0])
+            for i, count in enumerate(file_counts):
+                counts[i] += count
+
+    return dict((directory, {"functions"      : counts[0],
+                             "documented"     : counts[1],
+                             "complete_args"  : counts[2],
+                             "missing_returns": counts[3]})
+                for directory, counts in tree.items())
+
+
+def _percent(count, total):
+    return "{:.1f}%".format(100.0 * count / total) if total else "-"
+
+
+def format_report(tree):
+    """Returns the coverage tree as a table, one directory per line"""
+    lines = ["{:<40} {:>9} {:>11} {:>14} {:>16}".format(
+                "Directory", "Functions", "Documented", "Complete args",
+                "Missing returns")]
+
+    for directory in sorted(tree):
+        counts = tree[directory]
+        lines.append("{:<40} {:>9} {:>11} {:>14} {:>16}".format(
+                        directory,
+                        counts["functions"],
+                        _percent(counts["documented"], counts["functions"]),
+                        _percent(counts["complete_args"], counts["functions"]),
+                        counts["missing_returns"]))
+
+    return "\n".join(lines)
+
+
+def test_aggregate():
+    """Each directory's totals include the files below it"""
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmp_dir, "net", "ipv4"))
+        sources = {
+            os.path.join("net", "core.c"):
+                "/**\n * Does foo\n */\nvoid foo(void)\n{\n}\n\n"
+                "int bar(int a)\n{\n}\n",
+            os.path.join("net", "ipv4", "route.c"):
+                "/**\n * Does baz\n */\nint baz(int a)\n{\n}\n\n"
+                "void ignored(void)\n{\n}\n",
+        }
+        filenames = []
+        for name, source in sorted(sources.items()):
+            filenames.append(os.path.join(tmp_dir, name))
+            with open(filenames[-1], "w") as f:
+                f.write(source)
+
+        result_cache = cache.ResultCache()
+        for _ in range(2):
+            tree = aggregate(filenames, result_cache, ["ignored"])
+            assert tree[os.path.join(tmp_dir, "net")] == \
+                {"functions": 3, "documented": 2, "complete_args": 1,
+                 "missing_returns": 1}
+            assert tree[os.path.join(tmp_dir, "net", "ipv4")] == \
+                {"functions": 1, "documented": 1, "complete_args": 0,
+                 "missing_returns": 1}
+            # Without roots, the walk stops at the files' common directory
+            assert sorted(tree) == [os.path.join(tmp_dir, "net"),
+                                    os.path.join(tmp_dir, "net", "ipv4")]
+
+        # and otherwise at that of the roots, never above it to /
+        tree = aggregate(filenames, result_cache, ["ignored"],
+                         roots=[tmp_dir])
+        assert sorted(tree) == [tmp_dir, os.path.join(tmp_dir, "net"),
+                                os.path.join(tmp_dir, "net", "ipv4")]
+        assert tree[tmp_dir] == tree[os.path.join(tmp_dir, "net")]
+
+        tree = aggregate(filenames[1:], result_cache, roots=filenames[1:])
+        assert list(tree) == [os.path.join(tmp_dir, "net", "ipv4")]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_aggregate()
+    print('Tests passed.')
@@ -2,9 +2,9 @@ from __future__ import print_function
 
 import os
 import enum
-import re
 
 from classes import *
+import references
 
 
 class _State(enum.Enum):
@@ -36,41 +36,19 @@ def _is_reference(lines):
     Returns True iff the comment lines seem to indicate that the documentation
     can be found elsewhere.
     """
-
-    key_phrases = [
-            "function description",
-            "for documentation",
-            "see"
-            ]
-
-    header_file = re.compile(".* [^. ]*\.h.*")
-    implements_cb = re.compile(".* (implements) [^ ]*_cb.*")
-
-    # Referencing a header file?
-    for line in lines:
-        if header_file.match(line):
-            for phrase in key_phrases:
-                if phrase in line.lower():
-                    return True
-
-    # Referencing a callback type?
-    for line in lines:
-        if implements_cb.match(line):
-            return True
-
-    return False
+    return references.is_reference(CommentFormat.Doxygen, lines)
 
 
 def parse_doxygen(in_lines):
     """
     Parse lines representing a Doxygen comment into a structure.
 
-    The lines may be a list of lines, or a VerbatimComment.
+    The lines may be a list of lines, a VerbatimComment or a BufferComment.
 
     The list of lines should be verbatim plucked from a C file.
     The result is a Function object.
     """
-    if isinstance(in_lines, VerbatimComment):
+    if isinstance(in_lines, SOURCE_COMMENTS):
         internal_lines = in_lines.comment
     else:
         internal_lines = in_lines
@@ -78,7 +56,7 @@ def parse_doxygen(in_lines):
     lines = [line.strip() for line in internal_lines]
 
     if lines[0] != "/**":
-        raise AssertionError("First line {} is not /**.".format(in_lines[0]))
+        raise AssertionError("First line {} is not /**.".format(lines[0]))
 
     lines = lines[1:]
     for i, line in enumerate(lines):
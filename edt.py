@@ -7,9 +7,13 @@ import enum
 import re
 
 from classes import *
+import references
 
 _location = None
 
+_leading_space = re.compile(r"\s*")
+
+
 def wrap_single_line(line, length=80, indent_len=4, already_indented=False):
     """
     Take a string and, if it is too long, convert it to several smaller.
@@ -22,36 +26,79 @@ def wrap_single_line(line, length=80, indent_len=4, already_indented=False):
     plus the indentation width.
     already_indented tracks the negation of whether we need to indent again.
     """
+    result = []
+
+    # The part still to be wrapped is always (' ' * indent) + line[pos:], so
+    # the rest of a long line is never copied
+    indent = 0
+    pos = 0
+
+    while indent + len(line) - pos > length:
+        head = ' ' * indent + line[pos:pos + length]
+
+        # Slice the line if it's too long, based on the previous whitespace
+        if head[length-1].isspace():
+            before_whitespace = head[:length-1].rsplit(' ', 1)[0]
+            if before_whitespace.isspace():
+                # If we're only typing spaces, there's no point trying to break
+                # at a sane place, so just break at the end
+                last_whitespace = length
+            else:
+                last_whitespace = len(before_whitespace)
+        else:
+            last_whitespace = length
+
+        result.append(head[:last_whitespace])
+
+        # To wrap the remaining string, we should indent on the front
+        current_indent = indent + _leading_space.match(line, pos).end() - pos
+        next_pos = _leading_space.match(
+                        line, pos + max(0, last_whitespace - indent)).end()
+
+        if not already_indented:
+            current_indent += indent_len
+        elif (current_indent, next_pos) == (indent, pos):
+            raise ValueError("Can't wrap \"{}\" to {} characters".format(
+                                line, length))
+
+        indent = current_indent
+        pos = next_pos
+        already_indented = True
+
+    result.append(' ' * indent + line[pos:])
+    return result
+
+
+def _wrap_single_line_recursive(line, length=80, indent_len=4,
+                                already_indented=False):
+    """
+    The original recursive version of wrap_single_line, kept to test that the
+    two stay identical.
+    """
     if len(line) <= length:
         return [line]
 
-    # Slice the line if it's too long, based on the previous whitespace
     if line[length-1].isspace():
         before_whitespace = line[:length-1].rsplit(' ', 1)[0]
         if before_whitespace.isspace():
-            # If we're only typing spaces, there's no point trying to break at a
-            # sane place, so just break at the end
             last_whitespace = length
         else:
             last_whitespace = len(before_whitespace)
     else:
         last_whitespace = length
 
-    # We can be sure that up to last_whitespace should definitely be on the
-    # first line.
     result = [line[:last_whitespace]]
 
-    # To wrap the remaining string, we should indent on the front
     current_indent = len(line) - len(line.lstrip())
     remaining = (' ' * current_indent) + line[last_whitespace:].lstrip()
 
     if not already_indented:
         remaining = (' ' * indent_len) + remaining
 
-    rest_of_lines = wrap_single_line(line=remaining,
-                                     length=length,
-                                     indent_len=indent_len,
-                                     already_indented=True)
+    rest_of_lines = _wrap_single_line_recursive(line=remaining,
+                                                length=length,
+                                                indent_len=indent_len,
+                                                already_indented=True)
     return result + rest_of_lines
 
 
@@ -63,27 +110,17 @@ def edt_to_comment(in_str, length=80):
     Takes a string and puts comment marks on either side, and puts * down the
     left-hand side.
     """
-    # For each line, wrap it at length-3, to make room for ' * ' at the start
-    lines = [wrap_single_line(line, length-3) for line in in_str.split('\n')]
-    # Flatten into a single list of lines
-    lines = [line for linelist in lines for line in linelist]
+    lines = ['/*']
 
-    # Add comment marks
+    # For each line, wrap it at length-3, to make room for ' * ' at the start.
     # If a line is nonempty, we want it to start with ' * ';
     # otherwise we want it to start with [and be] ' *'.
-    # int(bool(.)) takes the integer and outputs 0 if it's 0, and 1 otherwise.
-    lines = [' *' + ' '* int(bool(len(line))) + line for line in lines]
-    lines = ['/*'] + lines
+    for line in in_str.split('\n'):
+        for wrapped in wrap_single_line(line, length-3):
+            lines.append(' * ' + wrapped if wrapped else ' *')
 
-    result_str = '\n'.join(lines)
-    # Add the closing comment mark, which means replacing the final space 
-    # with a slash
-    # Python has immutable strings which is here annoying
-    result_list = list(result_str)
-    result_list[-1] = '*/'
-    result_str = ''.join(result_list)
-
-    return result_str
+    # Add the closing comment mark, which replaces the final character
+    return '\n'.join(lines)[:-1] + '*/'
 
 
 def edt_func(func, edt='edt'):
@@ -174,44 +211,7 @@ def _is_reference(lines):
     Returns True iff the comment lines seem to indicate that the documentation
     can be found elsewhere.
     """
-
-    key_phrases = [
-            "function description",
-            "for documentation",
-            "see",
-            "edt in"
-            "edt comments in"
-            ]
-
-    header_file = re.compile(".* (([^. ]*\.h)|(header file)).*")
-
-    signature_type_regexes = [
-            "([^ ]*_cb[^ ]*)",
-            "([^ ]*_fn[^ ]*)",
-            "([^ ]*_func[^ ]*)",
-            "([^ ]*_type[^ ]*)",
-            "([^ ]*_callback[^ ]*)",
-            "(event_handler)",
-            ]
-
-    implements_regex = ".*implements ({}).*".format(
-            "|".join(signature_type_regexes))
-
-    implements_regex = re.compile(implements_regex)
-
-    # Referencing a header file?
-    for line in lines:
-        if header_file.match(line):
-            for phrase in key_phrases:
-                if phrase in line.lower():
-                    return True
-
-    # Referencing a callback type?
-    for line in lines:
-        if implements_regex.match(line.lower()):
-            return True
-
-    return False
+    return references.is_reference(CommentFormat.EDT, lines)
 
 
 def parse_edt(in_lines):
@@ -221,7 +221,7 @@ def parse_edt(in_lines):
 
     global _location
 
-    if isinstance(in_lines, VerbatimComment):
+    if isinstance(in_lines, SOURCE_COMMENTS):
         lines = in_lines.comment
         _location = Location(in_lines.filename, in_lines.start_loc)
     else:
@@ -311,7 +311,7 @@ def parse_edt(in_lines):
         result.name = def_line[2]
         result.comment = "\n".join(initial_comment).strip()
 
-    if isinstance(in_lines, VerbatimComment):
+    if isinstance(in_lines, SOURCE_COMMENTS):
         result.docstring = in_lines
     else:
         result.docstring = None
@@ -344,6 +344,27 @@ def test_indent():
     assert(wrapped == ['abcd', '  ef', '  gh', '  ij', '  k'])
 
 
+def test_wrap_matches_recursive():
+    """
+    wrap_single_line must wrap exactly as the original recursive version did.
+    """
+    import random
+
+    rand = random.Random(0)
+    for _ in range(2000):
+        line = ' ' * rand.randint(0, 6) + ''.join(
+                    rand.choice('ab  \t,.') for _ in range(rand.randint(0, 80)))
+        args = (line, rand.randint(2, 30), rand.randint(1, 5),
+                rand.random() < 0.3)
+
+        try:
+            expected = _wrap_single_line_recursive(*args)
+        except RecursionError:
+            continue
+
+        assert(wrap_single_line(*args) == expected)
+
+
 _reference_edt = """edt: * function fry
 
 Fry some eggs.
@@ -415,6 +436,7 @@ def gen_edt(func):
 
 if __name__ == '__main__':
     test_indent()
-    test_edt()
+    test_wrap_matches_recursive()
+    test_edt_creator()
     test_edt_to_comment()
     print('Tests passed.')
@@ -0,0 +1,443 @@
+from __future__ import print_function
+
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from classes import *
+import cache
+import c_parser
+import comments
+import validate
+
+
+"""
+Differential equivalence harness for the fast paths.
+
+Every optimized pipeline must give exactly the same functions and errors as
+the reference one: the stubbed lines parsed by clang, with the comments found
+in a list of lines by comments.find_func_docstrings. Run with:
+
+    python equivalence.py [--generated N] [--seed S] [PATHS ...]
+
+Each pipeline is run over randomly generated C files and any real files or
+directories given. For any file where a pipeline disagrees with the
+reference, the file is shrunk to the smallest set of lines which still shows
+the difference, and printed along with both results. The time each pipeline
+took over the whole corpus is reported as a speedup over the reference.
+
+Every parse is done from scratch, with none of the caches shared between
+pipelines or files. `python equivalence.py test` runs this module's own tests.
+"""
+
+
+@contextlib.contextmanager
+def _uncached():
+    """Runs with the module level caches disabled"""
+    saved = (c_parser.parse_cache, comments._parsed_comments,
+             validate.function_cache, validate.streaming)
+
+    c_parser.parse_cache = cache.ResultCache(memory_size=0)
+    comments._parsed_comments = cache.ResultCache(memory_size=0)
+    validate.function_cache = None
+    validate.streaming = False
+    try:
+        yield
+    finally:
+        (c_parser.parse_cache, comments._parsed_comments,
+         validate.function_cache, validate.streaming) = saved
+
+
+def _describe_functions(func_docstrings):
+    return [(f.name, f.location.linenumber, f.returns.typename,
+             [(a.typename, a.name) for a in f.args],
+             doc is not None)
+            for f, doc in func_docstrings]
+
+
+def _describe_errors(errors):
+    # The filename is left out, as the streaming pipeline reads a copy
+    return [(type(err).__name__, err.func.location.linenumber, err.func.name,
+             err.argname)
+            for err in errors]
+
+
+def _reference(filename, source):
+    _, lines = validate._read_source(filename, source)
+
+    functions = c_parser.extract_functions(c_parser.stub_lines(list(lines)),
+                                           "clang")
+    for f in functions:
+        f.location.filename = filename
+
+    func_docstrings = list(comments.find_func_docstrings(filename, functions,
+                                                         lines))
+    return (_describe_functions(func_docstrings),
+            _describe_errors(validate.check_func_docstrings(func_docstrings)))
+
+
+def _fast_engine(filename, source):
+    buffer, lines = validate._read_source(filename, source)
+
+    functions = c_parser.parse_file_functions(filename, engine="fast",
+                                              lines=lines)
+    func_docstrings = list(comments.find_func_docstrings(filename, functions,
+                                                         buffer))
+    return (_describe_functions(func_docstrings),
+            _describe_errors(validate.check_func_docstrings(func_docstrings)))
+
+
+def _buffer_comments(filename, source):
+    func_docstrings = validate.find_documented_functions(filename, source)
+    return (_describe_functions(func_docstrings),
+            _describe_errors(validate.check_func_docstrings(func_docstrings)))
+
+
+def _declarations(filename, source):
+    buffer, lines = validate._read_source(filename, source)
+
+    functions, _ = c_parser.parse_file_declarations(filename, lines)
+    func_docstrings = list(comments.find_func_docstrings(filename, functions,
+                                                         buffer))
+    return (_describe_functions(func_docstrings),
+            _describe_errors(validate.check_func_docstrings(func_docstrings)))
+
+
+def _incremental(filename, source):
+    import incremental
+
+    _, lines = validate._read_source(filename, source)
+    errors = incremental.find_documentation_errors(filename, lines,
+                                                   cache.ResultCache())
+    return (None, _describe_errors(errors))
+
+
+def _streaming(filename, source):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmp_dir, os.path.basename(filename))
+        with open(copy, 'wb') as f:
+            f.write(source.encode("utf-8"))
+        errors = validate.find_documentation_errors_streaming(copy)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return (None, _describe_errors(errors))
+
+
+# Each pipeline takes (filename, source) and returns (functions, errors), as
+# lists of plain tuples. Pipelines which never see the functions return None
+# in place of them, and only their errors are compared.
+REFERENCE = ("reference", _reference)
+
+PIPELINES = [
+    ("fast", _fast_engine),
+    ("buffer", _buffer_comments),
+    ("declarations", _declarations),
+    ("incremental", _incremental),
+    ("streaming", _streaming),
+]
+
+
+def _run(pipeline, filename, source):
+    """Returns the results of a pipeline, or the exception it raised"""
+    with _uncached():
+        try:
+            return pipeline(filename, source)
+        except Exception as e:
+            return ("raised", "{}: {}".format(type(e).__name__, e))
+
+
+def _differs(expected, actual):
+    if expected[0] == "raised" or actual[0] == "raised":
+        return expected != actual
+
+    if actual[0] is not None and actual[0] != expected[0]:
+        return True
+
+    return actual[1] != expected[1]
+
+
+def minimize(source, fails):
+    """
+    Returns the smallest source found, made by deleting lines from the given
+    source, for which fails(source) is still true.
+
+    Whole chunks of lines are deleted at a time, halving the chunk size
+    whenever no chunk can be deleted, down to single lines.
+    """
+    lines = source.splitlines(True)
+    chunk = max(1, len(lines) // 2)
+
+    while True:
+        i = 0
+        removed = False
+        while i < len(lines):
+            candidate = lines[:i] + lines[i + chunk:]
+            if candidate and fails("".join(candidate)):
+                lines = candidate
+                removed = True
+            else:
+                i += chunk
+
+        if removed:
+            continue
+        if chunk == 1:
+            break
+        chunk //= 2
+
+    return "".join(lines)
+
+
+class Mismatch(object):
+    """A file on which a pipeline disagreed with the reference"""
+
+    def __init__(self, pipeline, filename, source, expected, actual):
+        self.pipeline = pipeline
+        self.filename = filename
+        self.source = source
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        lines = ["{} differs from reference on {}".format(self.pipeline,
+                                                          self.filename),
+                 "Minimized input:"]
+        lines.extend("  | " + line for line in self.source.splitlines())
+        lines.append("reference: {!r}".format(self.expected))
+        lines.append("{}: {!r}".format(self.pipeline, self.actual))
+        return "\n".join(lines)
+
+
+def compare(corpus, pipelines=PIPELINES, shrink=True):
+    """
+    Runs the reference and each pipeline over every (filename, source) in
+    corpus.
+
+    Returns (mismatches, seconds), where mismatches is a list of Mismatch,
+    with the source minimized if shrink is set, and seconds is
+    {pipeline name: total time}.
+    """
+    seconds = dict((name, 0.0) for name, _ in [REFERENCE] + list(pipelines))
+    mismatches = []
+
+    for filename, source in corpus:
+        start = time.time()
+        expected = _run(REFERENCE[1], filename, source)
+        seconds[REFERENCE[0]] += time.time() - start
+
+        for name, pipeline in pipelines:
+            start = time.time()
+            actual = _run(pipeline, filename, source)
+            seconds[name] += time.time() - start
+
+            if not _differs(expected, actual):
+                continue
+
+            if shrink:
+                def fails(candidate):
+                    return _differs(_run(REFERENCE[1], filename, candidate),
+                                    _run(pipeline, filename, candidate))
+
+                source_min = minimize(source, fails)
+                mismatches.append(Mismatch(
+                    name, filename, source_min,
+                    _run(REFERENCE[1], filename, source_min),
+                    _run(pipeline, filename, source_min)))
+            else:
+                mismatches.append(Mismatch(name, filename, source,
+                                           expected, actual))
+
+    return (mismatches, seconds)
+
+
+_TYPES = ["int", "void", "char *", "const char *", "unsigned long",
+          "struct widget *", "widget_t", "size_t", "double", "uint8_t *"]
+
+
+def _generated_function(rng, index):
+    """
+    Returns the source of one function, randomly documented correctly,
+    wrongly or not at all.
+    """
+    func = Function()
+    func.name = "gen_{}_{}".format(rng.choice(["frob", "get", "set", "do"]),
+                                   index)
+    func.returns = Variable(typename=rng.choice(_TYPES), name="<return>")
+    func.args = [Variable(typename=rng.choice(_TYPES[2:]),
+                          name="arg_{}".format(i))
+                 for i in range(rng.randint(0, 4))]
+
+    args = (",\n" + " " * (len(func.name) + 2)).join(
+                "{} {}".format(arg.typename, arg.name).replace("* ", "*")
+                for arg in func.args) or "void"
+
+    declaration = "{}\n{} ({})".format(func.returns.typename, func.name, args)
+    if rng.random() < 0.2:
+        declaration = "static " + declaration
+
+    if rng.random() < 0.3:
+        body = ";\n"
+    else:
+        body = "\n{\n" + "".join("    x = f(x, {0}); /* {{ {0} }} */\n".format(i)
+                                 for i in range(rng.randint(0, 5))) + \
+               ("" if func.returns.typename == "void" else "    return (x);\n") + \
+               "}\n"
+
+    kind = rng.random()
+    if kind < 0.15:
+        return declaration + body
+
+    # Document a mutated copy of the function
+    documented = Function()
+    documented.name = func.name
+    documented.returns = func.returns
+    documented.args = [Variable(typename=arg.typename, name=arg.name)
+                       for arg in func.args]
+
+    mutation = rng.random()
+    if mutation < 0.1 and documented.args:
+        documented.args.pop(rng.randrange(len(documented.args)))
+    elif mutation < 0.2:
+        documented.args.append(Variable(typename="int", name="extra"))
+    elif mutation < 0.3 and documented.args:
+        documented.args[0].name = "renamed"
+
+    import lsp
+    comment_format = CommentFormat.EDT if kind < 0.55 else CommentFormat.Doxygen
+    comment = lsp.generate_comment(documented, comment_format)
+
+    if mutation > 0.9:
+        # No return documentation
+        kept = []
+        for line in comment.splitlines(True):
+            if "@return" in line or "Return:" in line:
+                break
+            kept.append(line)
+        comment = "".join(kept) + " */\n"
+    elif 0.8 < mutation < 0.85:
+        comment = "/*\n * See widget.h for documentation.\n */\n"
+
+    return comment + declaration + body
+
+
+def generate_source(rng, functions):
+    """Returns a random C file of the given number of functions"""
+    parts = ["#include <stdint.h>\n",
+             "#include \"widget.h\"\n\n",
+             "#define GEN_MAX(a, b) ((a) > (b) ? (a) : (b))\n\n"]
+
+    for i in range(functions):
+        parts.append(_generated_function(rng, i))
+        parts.append(rng.choice(["\n", "\n\n", "\n/* Unrelated remark */\n\n",
+                                 "\nstatic int counter_{} = 0;\n\n".format(i)]))
+
+    return "".join(parts)
+
+
+def generated_corpus(count, seed=0, functions=20):
+    """Yields (filename, source) for count generated C files"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield ("generated_{}.c".format(i), generate_source(rng, functions))
+
+
+def file_corpus(paths):
+    """Yields (filename, source) for every C file in the given paths"""
+    import formatter
+
+    for filename in formatter.iter_c_files(paths):
+        with open(filename, 'rb') as f:
+            yield (filename, f.read().decode("utf-8", "replace"))
+
+
+def test_minimize():
+    source = "".join("line {}\n".format(i) for i in range(40))
+
+    def fails(candidate):
+        return "line 7\n" in candidate and "line 31\n" in candidate
+
+    assert minimize(source, fails) == "line 7\nline 31\n"
+
+
+def test_pipelines_agree():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    corpus = list(generated_corpus(3, seed=1, functions=8)) + \
+             list(file_corpus([os.path.join(dir_path, 'test_sources')]))
+
+    mismatches, _ = compare(corpus)
+    assert not mismatches, "\n\n".join(str(m) for m in mismatches)
+
+
+def main(argv=None):
+    names = [name for name, _ in PIPELINES]
+
+    parser = argparse.ArgumentParser(
+                description="Checks that the fast paths give the same results "
+                            "as the reference pipeline")
+    parser.add_argument('paths',
+                        nargs='*',
+                        help='Real C files, or directories of them, to compare '
+                             'on as well as the generated ones')
+    parser.add_argument('--generated',
+                        type=int,
+                        default=50,
+                        help='How many C files to generate (default 50)')
+    parser.add_argument('--functions',
+                        type=int,
+                        default=20,
+                        help='Functions per generated file (default 20)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the generated files')
+    parser.add_argument('--pipelines',
+                        default=",".join(names),
+                        help='Comma separated pipelines to compare, from: ' +
+                             ", ".join(names))
+    parser.add_argument('--no-minimize',
+                        action='store_true',
+                        help='Report mismatching files whole')
+    args = parser.parse_args(argv)
+
+    selected = args.pipelines.split(",")
+    for name in selected:
+        if name not in names:
+            parser.error("Unknown pipeline {}".format(name))
+
+    corpus = list(generated_corpus(args.generated, args.seed,
+                                   args.functions)) + \
+             list(file_corpus(args.paths))
+
+    mismatches, seconds = compare(corpus,
+                                  [p for p in PIPELINES if p[0] in selected],
+                                  shrink=not args.no_minimize)
+
+    for mismatch in mismatches:
+        print(mismatch)
+        print()
+
+    print("{} files".format(len(corpus)))
+    print("{:<12} {:>8} {:>8} {:>11}".format("Pipeline", "Seconds", "Speedup",
+                                             "Mismatches"))
+    for name in [REFERENCE[0]] + selected:
+        print("{:<12} {:>8.2f} {:>7.2f}x {:>11}".format(
+                name, seconds[name],
+                seconds[REFERENCE[0]] / seconds[name] if seconds[name] else 0,
+                sum(1 for m in mismatches if m.pipeline == name)))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ["test"]:
+        test_minimize()
+        test_pipelines_agree()
+        print('Tests passed.')
+    else:
+        sys.exit(main())
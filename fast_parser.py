@@ -0,0 +1,372 @@
+from __future__ import print_function
+
+import glob
+import os
+import re
+
+from classes import *
+
+
+"""
+A libclang-free extractor for the top level function declarations in a
+stubbed C file (see c_parser.stub_lines).
+
+Once the function bodies have been stubbed out, the vast majority of C files
+are just a sequence of simple declarations, which can be read straight from
+the token stream much faster than clang can parse them. The types are spelled
+the way clang would spell them, so the resulting Function objects are the same
+as those built from clang cursors.
+
+Anything which can't be read with certainty (macros, function pointers,
+arrays, K&R style definitions, conditional compilation, ...) makes
+parse_functions return None, in which case the caller should fall back to
+clang.
+"""
+
+
+_token = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<number>\.?[0-9][A-Za-z0-9_.]*)
+    | (?P<ellipsis>\.\.\.)
+    | (?P<punct>.)
+    """, re.VERBOSE | re.DOTALL)
+
+_directive = re.compile(r"\s*#\s*([A-Za-z_]*)\s*([A-Za-z_][A-Za-z0-9_]*)?")
+
+_qualifiers = ["const", "volatile", "restrict"]
+
+_storage_classes = {"static", "extern", "inline", "register", "auto",
+                    "__inline", "__inline__", "_Noreturn", "_Thread_local"}
+
+_builtin_words = {"void", "_Bool", "char", "short", "int", "long", "float",
+                  "double", "signed", "unsigned"}
+
+_tag_words = {"struct", "union", "enum"}
+
+_keywords = (set(_qualifiers) | _storage_classes | _builtin_words | _tag_words |
+             {"typedef", "sizeof", "return", "if", "else", "for", "while",
+              "do", "switch", "case", "default", "break", "continue", "goto",
+              "_Complex", "_Imaginary", "_Atomic", "_Alignas", "_Alignof",
+              "_Static_assert", "_Generic", "__attribute__", "__restrict",
+              "__const", "__volatile__", "__extension__", "asm", "__asm__"})
+
+
+def _builtin_spellings():
+    """
+    Returns {sorted tuple of keywords: clang spelling} for every way of writing
+    each builtin type.
+    """
+    variants = {
+        "void"              : ["void"],
+        "_Bool"             : ["_Bool"],
+        "char"              : ["char"],
+        "signed char"       : ["signed char"],
+        "unsigned char"     : ["unsigned char"],
+        "short"             : ["short", "short int", "signed short",
+                               "signed short int"],
+        "unsigned short"    : ["unsigned short", "unsigned short int"],
+        "int"               : ["int", "signed", "signed int"],
+        "unsigned int"      : ["unsigned", "unsigned int"],
+        "long"              : ["long", "long int", "signed long",
+                               "signed long int"],
+        "unsigned long"     : ["unsigned long", "unsigned long int"],
+        "long long"         : ["long long", "long long int",
+                               "signed long long", "signed long long int"],
+        "unsigned long long": ["unsigned long long",
+                               "unsigned long long int"],
+        "float"             : ["float"],
+        "double"            : ["double"],
+        "long double"       : ["long double"],
+    }
+
+    spellings = dict()
+    for spelling, ways in variants.items():
+        for way in ways:
+            spellings[tuple(sorted(way.split()))] = spelling
+
+    return spellings
+
+_builtin_types = _builtin_spellings()
+
+
+class _Ambiguous(Exception):
+    """Raised when a declaration can't be read without clang"""
+    pass
+
+
+def _tokenize(lines):
+    """
+    Splits stubbed C source into a list of (token, linenumber) pairs, dropping
+    whitespace and comments.
+
+    Returns (tokens, set of macro names defined in the file).
+    """
+    tokens = []
+    macros = set()
+    source_lines = []
+
+    continuation = False
+    for line in lines:
+        if continuation or line.lstrip().startswith("#"):
+            if not continuation:
+                m = _directive.match(line)
+                if m.group(1) not in ("define", "undef", ""):
+                    # Conditional compilation and friends change which
+                    # declarations clang sees.
+                    raise _Ambiguous(line)
+                if m.group(2):
+                    macros.add(m.group(2))
+
+            continuation = line.rstrip().endswith("\\")
+            source_lines.append("\n")
+        else:
+            source_lines.append(line)
+
+    linenumber = 1
+    for m in _token.finditer("".join(source_lines)):
+        kind = m.lastgroup
+        text = m.group(kind)
+
+        if kind not in ("space", "comment"):
+            tokens.append((text, linenumber))
+
+        linenumber += text.count("\n")
+
+    return tokens, macros
+
+
+def _split(tokens, separator):
+    """Splits a token list on separator tokens which are not inside brackets"""
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        text = token[0]
+        if text in ("(", "["):
+            depth += 1
+        elif text in (")", "]"):
+            depth -= 1
+
+        if text == separator and depth == 0:
+            parts.append([])
+        else:
+            parts[-1].append(token)
+
+    return parts
+
+
+def _is_identifier(text):
+    return (text[0].isalpha() or text[0] == "_") and text not in _keywords
+
+
+def _spell_type(words):
+    """
+    Given the words of a declaration up to, but not including, the declared
+    name, returns the type as clang would spell it.
+    """
+    specifier_end = words.index("*") if "*" in words else len(words)
+    specifiers = words[:specifier_end]
+
+    quals = [q for q in _qualifiers if q in specifiers]
+    builtins = []
+    base = None
+
+    i = 0
+    while i < len(specifiers):
+        word = specifiers[i]
+        if word in _qualifiers or word in _storage_classes:
+            pass
+        elif word in _builtin_words:
+            builtins.append(word)
+        elif word in _tag_words:
+            if base is not None or i + 1 >= len(specifiers) or \
+                    not _is_identifier(specifiers[i + 1]):
+                raise _Ambiguous(words)
+            base = word + " " + specifiers[i + 1]
+            i += 1
+        elif _is_identifier(word) and base is None:
+            base = word
+        else:
+            raise _Ambiguous(words)
+        i += 1
+
+    if builtins:
+        if base is not None:
+            raise _Ambiguous(words)
+        key = tuple(sorted(builtins))
+        if key not in _builtin_types:
+            raise _Ambiguous(words)
+        base = _builtin_types[key]
+    elif base is None:
+        raise _Ambiguous(words)
+
+    spelling = " ".join(quals + [base])
+
+    for word in words[specifier_end:]:
+        if word == "*":
+            if spelling.endswith("*"):
+                spelling += "*"
+            else:
+                spelling += " *"
+        elif word in _qualifiers:
+            if spelling.endswith("*"):
+                spelling += word
+            else:
+                spelling += " " + word
+        else:
+            raise _Ambiguous(words)
+
+    return spelling
+
+
+def _parse_argument(tokens):
+    """Returns a Variable for a single parameter declaration"""
+    words = [t[0] for t in tokens]
+
+    if not words or "..." in words:
+        raise _Ambiguous(words)
+
+    # An identifier at the end is the name, as long as something before it
+    # gives the type. A lone identifier could be either.
+    if _is_identifier(words[-1]) and len(words) > 1 and \
+            words[-2] not in _tag_words:
+        return Variable(typename=_spell_type(words[:-1]), name=words[-1])
+    elif _is_identifier(words[-1]) and len(words) == 1:
+        raise _Ambiguous(words)
+    else:
+        return Variable(typename=_spell_type(words), name="")
+
+
+def _parse_declaration(tokens, macros):
+    """
+    Returns a Function for a single top level statement if it declares a
+    function, or None if it declares something else.
+    """
+    words = [t[0] for t in tokens]
+
+    if "(" not in words:
+        return None
+
+    if "=" in words[:words.index("(")] or words[0] == "typedef":
+        return None
+
+    if macros.intersection(words):
+        raise _Ambiguous(words)
+
+    open_paren = words.index("(")
+
+    # The argument list must be the only bracketed part, and must end the
+    # statement. Anything after it is K&R style or an attribute.
+    if words[-1] != ")" or "(" in words[open_paren+1:] or \
+            ")" in words[open_paren+1:-1] or "[" in words:
+        raise _Ambiguous(words)
+
+    if open_paren < 2 or not _is_identifier(words[open_paren - 1]):
+        raise _Ambiguous(words)
+
+    func = Function()
+    func.name = words[open_paren - 1]
+    func.location = Location(linenumber=tokens[open_paren - 1][1])
+    func.returns = Variable(typename=_spell_type(words[:open_paren - 1]),
+                            name="<return>")
+
+    arg_tokens = tokens[open_paren+1:-1]
+    if [t[0] for t in arg_tokens] in ([], ["void"]):
+        func.args = []
+    else:
+        func.args = [_parse_argument(arg) for arg in _split(arg_tokens, ",")]
+
+    return func
+
+
+def parse_functions(lines):
+    """
+    Returns the list of Function objects declared in the given stubbed lines,
+    in the same order as clang would give them, or None if the lines contain
+    anything which only clang can read reliably.
+
+    The functions' location filenames are left empty for the caller to fill.
+    """
+    try:
+        tokens, macros = _tokenize(lines)
+
+        functions = []
+        for statement in _split(tokens, ";"):
+            if not statement:
+                continue
+            func = _parse_declaration(statement, macros)
+            if func is not None:
+                functions.append(func)
+
+    except _Ambiguous:
+        return None
+
+    return functions
+
+
+def _corpus():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    return sorted(glob.glob(os.path.join(dir_path, 'test_sources', '*.c')))
+
+
+def test_engines_agree():
+    """
+    Differential test: for every file in the test corpus which the fast engine
+    accepts, the functions must be identical to those clang produces.
+    """
+    import c_parser
+
+    def describe(functions):
+        return [(f.name, f.location.linenumber, f.returns.typename,
+                 [(a.typename, a.name) for a in f.args])
+                for f in functions]
+
+    accepted = 0
+    for filename in _corpus():
+        with open(filename) as f:
+            fast = parse_functions(c_parser.stub_lines(f.readlines()))
+
+        if fast is None:
+            continue
+        accepted += 1
+
+        slow = c_parser.parse_file_functions(filename, engine="clang")
+
+        assert describe(fast) == describe(slow), filename
+
+    assert accepted > 0
+
+
+def test_ambiguous_falls_back():
+    """Anything only clang can read reliably must be rejected"""
+    ambiguous = [
+        ["#define API extern\n", "API int f(int a);\n"],
+        ["#ifdef FOO\n", "int f(int a);\n", "#endif\n"],
+        ["int (*get_cb(int a))(int);\n"],
+        ["int f(a, b) int a; int b; ;\n"],
+        ["int f(int a[]);\n"],
+        ["int f(int a, ...);\n"],
+        ["int f(foo_t);\n"],
+        ["MACRO(x);\n"],
+        ["void f(int a) __attribute__((unused));\n"],
+        ["unsigned foo_t f(void);\n"],
+    ]
+    for lines in ambiguous:
+        assert parse_functions(lines) is None, lines
+
+    plain = ["static const char * const *\n", "f (char const *a,\n",
+             "   unsigned long int b);\n", "int x = 5;\n"]
+    functions = parse_functions(plain)
+    assert len(functions) == 1
+    assert functions[0].location.linenumber == 2
+    assert functions[0].returns.typename == "const char *const *"
+    assert [(a.typename, a.name) for a in functions[0].args] == \
+        [("const char *", "a"), ("unsigned long", "b")]
+
+
+if __name__ == '__main__':
+    test_ambiguous_falls_back()
+    test_engines_agree()
+    print('Tests passed.')
@@ -1,6 +1,8 @@
+import os
 import re
 
 from classes import Function, Variable
+import c_parser
 
 def format_func(func, header = False):
     """
@@ -53,14 +55,207 @@ def format_func(func, header = False):
         lines[-1] += typename + " "*(name_start_column - len(typename) - num_asterisks) + "*"*num_asterisks + arg.name + ","
         lines.append(" "*var_start_col)
 
-    lines = lines[0:-2]
+    # Drop the indent started for an argument after the last
+    lines = lines[0:-1]
 
     if header:
         lines[-1] = lines[-1][:-1] + ");"
     else:
         lines[-1] = lines[-1][:-1] + ")"
 
-    for line in lines:
-        print(line)
+    return "\n".join(lines)
 
-    return ""
+
+_token = re.compile(r"\w+|[^\w\s]")
+
+
+def _signature_end(lines, func):
+    """
+    Finds the closing parenthesis of a function definition's argument list.
+
+    Returns (line index, column) of the parenthesis, or None if func isn't
+    followed by a function body.
+    """
+    name_line = func.location.linenumber - 1
+    column = lines[name_line].find(func.name)
+    if column < 0:
+        return None
+    column += len(func.name)
+
+    depth = 0
+    end = None
+    for i in range(name_line, len(lines)):
+        for j in range(column, len(lines[i])):
+            if lines[i][j] == "(":
+                depth += 1
+            elif lines[i][j] == ")":
+                depth -= 1
+                if depth == 0:
+                    end = (i, j)
+                    break
+        if end is not None:
+            break
+        column = 0
+
+    if end is None:
+        return None
+
+    # Only definitions are formatted, so the body must come next
+    i, j = end
+    following = lines[i][j + 1:].strip()
+    while not following and i + 1 < len(lines):
+        i += 1
+        following = lines[i].strip()
+
+    if not following.startswith("{"):
+        return None
+
+    return end
+
+
+def format_signature(lines, func):
+    """
+    Returns (first line index, end line index, new lines) to replace the
+    signature of the definition of func in lines with an aligned one, or None
+    if it's already aligned or can't be reformatted.
+
+    Signatures are only rewritten when that changes nothing but whitespace, so
+    anything format_func can't spell out (eg. storage classes, function
+    pointer arguments, comments) is left alone.
+    """
+    if any(not arg.name for arg in func.args):
+        return None
+
+    end = _signature_end(lines, func)
+    if end is None:
+        return None
+
+    first = c_parser.declaration_start(lines, func)
+    last, column = end
+
+    original = "".join(lines[first:last]) + lines[last][:column + 1]
+    formatted = format_func(func)
+
+    if original == formatted or \
+            _token.findall(original) != _token.findall(formatted):
+        return None
+
+    return (first, last + 1,
+            (formatted + lines[last][column + 1:]).splitlines(True))
+
+
+def format_file(filename, check=False):
+    """
+    Aligns the signature of every function defined in a C file, rewriting the
+    file in a single write. If check is set, the file is left untouched.
+
+    Returns the list of Functions whose signatures were (or, with check, would
+    be) reformatted.
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+
+    rewrites = []
+    for func in c_parser.parse_file_functions(filename, lines=lines):
+        rewrite = format_signature(lines, func)
+        if rewrite is not None:
+            rewrites.append((rewrite, func))
+
+    rewrites.sort(key=lambda x: x[0][0])
+
+    output = []
+    formatted = []
+    position = 0
+    for (first, end, new_lines), func in rewrites:
+        if first < position:
+            # Overlaps one already rewritten, eg. the same definition twice
+            continue
+        output.extend(lines[position:first])
+        output.extend(new_lines)
+        position = end
+        formatted.append(func)
+    output.extend(lines[position:])
+
+    if formatted and not check:
+        with open(filename, 'w') as f:
+            f.write("".join(output))
+
+    return formatted
+
+
+def iter_c_files(paths, extensions=(".c",)):
+    """Yields each given file, and every C file under each given directory"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1] in extensions:
+                    yield os.path.join(directory, filename)
+
+
+def format_tree(paths, check=False):
+    """
+    Runs format_file over the given files and directories.
+
+    Returns a list of (filename, [Function]) for each file with signatures
+    that were (or would be) reformatted.
+    """
+    results = []
+    for filename in iter_c_files(paths):
+        formatted = format_file(filename, check)
+        if formatted:
+            results.append((filename, formatted))
+
+    return results
+
+
+def test_format_tree():
+    """--check finds what formatting fixes, and formatting is idempotent"""
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, "unaligned.c")
+        source = ("/* Comment */\n"
+                  "int\n"
+                  "foo (int a, char *b,\n"
+                  "     unsigned long c)\n"
+                  "{\n"
+                  "    return (a);\n"
+                  "}\n")
+        with open(filename, "w") as f:
+            f.write(source)
+
+        [(_, [func])] = format_tree([tmp_dir], check=True)
+        assert func.name == "foo"
+        with open(filename) as f:
+            assert f.read() == source
+
+        assert [name for name, _ in format_tree([tmp_dir])] == [filename]
+        with open(filename) as f:
+            formatted = f.read()
+        assert formatted == ("/* Comment */\n"
+                             "int\n"
+                             "foo (int            a,\n"
+                             "     char          *b,\n"
+                             "     unsigned long  c)\n"
+                             "{\n"
+                             "    return (a);\n"
+                             "}\n")
+
+        assert format_tree([tmp_dir], check=True) == []
+        assert format_tree([tmp_dir]) == []
+        with open(filename) as f:
+            assert f.read() == formatted
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_format_tree()
+    print('Tests passed.')
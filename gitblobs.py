@@ -0,0 +1,181 @@
+import os
+import subprocess
+
+import cache
+import c_parser
+import references
+
+
+"""
+Validates the C files in the git index, or in a commit, straight from their
+blobs rather than the working tree, eg. from a pre-commit hook.
+
+Blob contents are read through a single long-lived `git cat-file --batch`
+process. Errors are cached by blob SHA, so a file which hasn't changed since
+the last run is skipped without reading its contents.
+"""
+
+
+def _git(args):
+    return subprocess.check_output(["git"] + args)
+
+
+def git_dir():
+    """The path of the .git directory of the current repository"""
+    return _git(["rev-parse", "--git-dir"]).decode("utf-8").strip()
+
+
+def _is_c_file(path, extensions):
+    return os.path.splitext(path)[1] in extensions
+
+
+def staged_blobs(extensions=(".c",)):
+    """
+    Returns a list of (path, blob SHA) for every C file in the index, with
+    paths relative to the current directory.
+    """
+    blobs = []
+    for entry in _git(["ls-files", "--stage", "-z"]).split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        mode, sha, stage = info.split()
+        path = path.decode("utf-8")
+
+        # Skip submodules and symlinks, and all but "ours" while merging
+        if mode.startswith(b"100") and stage in (b"0", b"2") and \
+                _is_c_file(path, extensions):
+            blobs.append((path, sha.decode("ascii")))
+
+    return blobs
+
+
+def committed_blobs(rev, extensions=(".c",)):
+    """
+    Returns a list of (path, blob SHA) for every C file in the tree of the
+    given revision, with paths relative to the current directory.
+    """
+    blobs = []
+    for entry in _git(["ls-tree", "-r", "-z", rev]).split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        mode, kind, sha = info.split()
+        path = path.decode("utf-8")
+
+        if kind == b"blob" and mode.startswith(b"100") and \
+                _is_c_file(path, extensions):
+            blobs.append((path, sha.decode("ascii")))
+
+    return blobs
+
+
+class CatFile(object):
+    """A `git cat-file --batch` process, reading any number of objects"""
+
+    def __init__(self):
+        self._proc = subprocess.Popen(["git", "cat-file", "--batch"],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+
+    def read(self, sha):
+        """Returns the contents of the object with the given SHA, as bytes"""
+        self._proc.stdin.write(sha.encode("ascii") + b"\n")
+        self._proc.stdin.flush()
+
+        header = self._proc.stdout.readline().split()
+        if len(header) != 3:
+            raise KeyError("No git object {}".format(sha))
+
+        size = int(header[2])
+        contents = self._proc.stdout.read(size)
+        # Each object is followed by a newline
+        self._proc.stdout.read(1)
+
+        return contents
+
+    def close(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BlobValidator(object):
+    """
+    Finds the documentation errors in a set of blobs, reusing the errors
+    found for the same blob at the same path from result_cache.
+    """
+
+    def __init__(self, blobs, result_cache, cat_file):
+        self.shas = dict(blobs)
+        self.result_cache = result_cache
+        self.cat_file = cat_file
+
+        # How many blobs have had to be read and validated
+        self.validated = 0
+
+    def find_errors(self, path):
+        import validate
+
+        key = cache.content_key("blob", c_parser.default_engine,
+                                references.rules_digest,
+                                "data types" if validate.data_types else "",
+                                path, self.shas[path])
+        errors = self.result_cache.get(key)
+
+        if errors is None:
+            source = self.cat_file.read(self.shas[path]).decode("utf-8",
+                                                                "replace")
+            errors = validate.find_documentation_errors(path, source)
+            self.result_cache.put(key, errors)
+            self.validated += 1
+
+        return errors
+
+
+def test_blob_cache():
+    """A blob validated by an earlier run isn't read or validated again"""
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp_dir)
+        _git(["init", "-q"])
+        with open("staged.c", "w") as f:
+            f.write("int foo(int a)\n{\n}\n")
+        _git(["add", "staged.c"])
+
+        # Unstaged edits aren't what's validated
+        with open("staged.c", "w") as f:
+            f.write("/**\n * Does foo\n */\nvoid foo(void)\n{\n}\n")
+
+        blobs = staged_blobs()
+        assert [path for path, _ in blobs] == ["staged.c"]
+
+        found = []
+        cache_dir = os.path.join(git_dir(), "hornbill")
+        for _ in range(2):
+            with CatFile() as cat_file:
+                validator = BlobValidator(blobs, cache.ResultCache(cache_dir),
+                                          cat_file)
+                errors = validator.find_errors("staged.c")
+            found.append((validator.validated,
+                          [(type(e).__name__, e.func.name) for e in errors]))
+
+        assert found == [(1, [("NoDocumentationError", "foo")]),
+                         (0, [("NoDocumentationError", "foo")])]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_blob_cache()
+    print('Tests passed.')
@@ -1,6 +1,82 @@
 import argparse
+import json
+import time
 
-import validate
+import c_parser
+import metrics
+
+
+def read_stdin():
+    """
+    Returns the text of stdin, decoded as UTF-8 with bad bytes replaced, as
+    validate._read_source decodes files.
+    """
+    import sys
+
+    return getattr(sys.stdin, "buffer", sys.stdin).read().decode("utf-8",
+                                                                  "replace")
+
+
+def validate_files(indexed_files, ignore_func_list, timing_cache=None,
+                   known_errors=None, sources=None, find_errors=None):
+    """
+    Validates each (index, filename) pair, printing errors as it goes.
+
+    Errors whose fingerprint is in the known_errors baseline are left out.
+    sources optionally maps filenames to their text, which is validated in
+    place of the file on disk. find_errors, if given, is called with each
+    filename to find its errors in place of validate.find_documentation_errors.
+
+    Returns the report entries for the files, and records how long each file
+    took in timing_cache if one is given.
+    """
+    import validate
+
+    entries = list()
+
+    for index, filename in indexed_files:
+        start = time.time()
+        if find_errors is not None:
+            found = find_errors(filename)
+        else:
+            source = sources.get(filename) if sources else None
+            found = validate.find_documentation_errors(filename, source)
+
+        entries.append(report_file(index, filename, found,
+                                   time.time() - start, ignore_func_list,
+                                   timing_cache, known_errors))
+
+    return entries
+
+
+def report_file(index, filename, found, elapsed, ignore_func_list,
+                timing_cache=None, known_errors=None):
+    """
+    Filters and prints the errors found in one file, as validate_files does,
+    returning its report entry.
+    """
+    import validate
+
+    errors = [err for err in found
+              if err.func.name not in ignore_func_list]
+
+    if known_errors:
+        import baseline
+
+        errors = [err for err in errors
+                  if baseline.error_fingerprint(err) not in known_errors]
+
+    if timing_cache is not None:
+        timing_cache[filename] = elapsed
+
+    for err in errors:
+        err.print_err()
+    validate.count_errors(errors)
+
+    return {"index"   : index,
+            "filename": filename,
+            "seconds" : elapsed,
+            "errors"  : [err.dictify() for err in errors]}
 
 
 if __name__ == "__main__":
@@ -12,24 +88,541 @@ if __name__ == "__main__":
                       nargs="+",
                       help='C file in which to validate comments')
 
+    parser.add_argument('--archives',
+                      metavar="ARCHIVE",
+                      nargs="+",
+                      help='.tar(.gz/.bz2/.xz) or .zip archives in which to'
+                      ' validate the C files without extracting them, across'
+                      ' --jobs processes')
+
+    parser.add_argument('--stdin',
+                      action='store_true',
+                      help='Validate C source read from stdin, eg. an unsaved'
+                      ' editor buffer, without touching disk')
+
+    parser.add_argument('--stdin-filename',
+                      metavar="NAME",
+                      default="<stdin>",
+                      help='Filename to report --stdin errors against')
+
+    parser.add_argument('--generate',
+                      choices=sorted(acceptable_types),
+                      help='Generate a comment of this format for the function'
+                      ' at --line of the --stdin source, printing'
+                      ' {"line": N, "comment": TEXT} as JSON, where N is the'
+                      ' line to insert it above. Used by hornbill.vim')
+
+    parser.add_argument('--line',
+                      metavar="N",
+                      type=int,
+                      help='Line of the function to --generate a comment for')
+
+    parser.add_argument('--staged',
+                      action='store_true',
+                      help='Validate the C files staged in the git index, eg.'
+                      ' from a pre-commit hook. Exits with status 1 if any'
+                      ' errors are found')
+
+    parser.add_argument('--commit',
+                      metavar="REV",
+                      help='Validate the C files in the given git commit, in'
+                      ' the same way as --staged')
+
     parser.add_argument('--ignore-funcs',
                       metavar="FILENAME",
                       help='A newline delimited file containing function names'
                       ' to ignore while validating docstrings')
 
+    parser.add_argument('--baseline',
+                      metavar="FILENAME",
+                      help='Only report errors which are not recorded in this'
+                      ' baseline of known errors')
+
+    parser.add_argument('--update-baseline',
+                      action='store_true',
+                      help='Rewrite --baseline with every error found by this'
+                      ' run (or in the --merge reports)')
+
+    parser.add_argument('--json',
+                      metavar="FILENAME",
+                      help='Also write the errors found to FILENAME as a JSON'
+                      ' report')
+
+    parser.add_argument('--shard',
+                      metavar="I/N",
+                      help='Only validate the I\'th of N shards of the'
+                      ' --comment-check files, balanced by predicted cost')
+
+    parser.add_argument('--timings',
+                      metavar="FILENAME",
+                      help='Timing cache of per-file validation times, used to'
+                      ' balance --shard and updated by each run')
+
+    parser.add_argument('--jobs',
+                      metavar="N",
+                      type=int,
+                      help='Validate the --comment-check files in N supervised'
+                      ' worker processes. Files which time out or crash their'
+                      ' worker are reported as ValidationFailedErrors')
+
+    parser.add_argument('--timeout',
+                      metavar="SECONDS",
+                      type=float,
+                      default=300,
+                      help='Longest a single file may take with --jobs')
+
+    parser.add_argument('--memory-limit',
+                      metavar="MB",
+                      type=int,
+                      help='Address space limit of each --jobs worker')
+
+    parser.add_argument('--coordinator',
+                      metavar="HOST:PORT",
+                      help='Serve the --comment-check files to --worker'
+                      ' processes on other machines, and report their'
+                      ' results. HOST defaults to localhost, and'
+                      ' HORNBILL_CLUSTER_KEY must be set. See cluster.py')
+
+    parser.add_argument('--worker',
+                      metavar="HOST:PORT",
+                      help='Validate files for the --coordinator at HOST:PORT'
+                      ' until it has none left. Runs --jobs workers if given.'
+                      ' HORNBILL_CLUSTER_KEY must be set')
+
+    parser.add_argument('--batch-size',
+                      metavar="N",
+                      type=int,
+                      default=16,
+                      help='Files handed to a --worker at a time')
+
+    parser.add_argument('--reference-rules',
+                      metavar="FILENAME",
+                      help='JSON file of project specific rules for comments'
+                      ' which refer to documentation elsewhere, see'
+                      ' references.py')
+
+    parser.add_argument('--engine',
+                      choices=c_parser.ENGINES,
+                      default=c_parser.default_engine,
+                      help='How to extract function declarations. "fast"'
+                      ' avoids libclang for plain C files, falling back to'
+                      ' clang for anything ambiguous')
+
+    parser.add_argument('--type-cache',
+                      metavar="FILENAME",
+                      help='Project-wide list of type names unknown to clang,'
+                      ' used to skip the discovery parse and updated by each'
+                      ' run')
+
+    parser.add_argument('--streaming',
+                      action='store_true',
+                      help='Stream files through the parsers instead of reading'
+                      ' them into memory, for huge generated sources. Not'
+                      ' with --cache-dir or --data-types')
+
+    parser.add_argument('--data-types',
+                      action='store_true',
+                      help='Also validate the documentation of top level'
+                      ' structs, unions, enums, typedefs and macros, from'
+                      ' the same parse as the functions')
+
+    parser.add_argument('--metrics',
+                      metavar="FILENAME",
+                      help='Write run metrics (timings, cache hit rates, error'
+                      ' counts) to FILENAME when hornbill exits, as JSON if it'
+                      ' ends in .json and as a Prometheus textfile otherwise.'
+                      ' SIGUSR1 writes them at any time, eg. with --watch')
+
+    parser.add_argument('--cache-dir',
+                      metavar="DIR",
+                      help='Directory in which to keep parse results between'
+                      ' runs, keyed by file contents')
+
+    parser.add_argument('--export-db',
+                      metavar="FILENAME",
+                      help='Instead of printing errors, export the functions,'
+                      ' docstrings and errors of the --comment-check files to'
+                      ' this SQLite database. Unchanged files are skipped')
+
+    parser.add_argument('--coverage',
+                      action='store_true',
+                      help='Instead of printing errors, print the documentation'
+                      ' coverage of the --comment-check files (or of every C'
+                      ' file under them, for directories) by directory. With'
+                      ' --json, also write it there')
+
+    parser.add_argument('--release',
+                      metavar="NAME",
+                      default="",
+                      help='Release to record --export-db files under')
+
+    parser.add_argument('--format',
+                      metavar="PATH(S)",
+                      nargs="+",
+                      help='Align the signatures of the functions defined in'
+                      ' these C files, or in every C file under these'
+                      ' directories')
+
+    parser.add_argument('--check',
+                      action='store_true',
+                      help='With --format, report signatures which are not'
+                      ' aligned instead of rewriting them, exiting with status'
+                      ' 1 if there are any')
+
+    parser.add_argument('--merge',
+                      metavar="REPORT(S)",
+                      nargs="+",
+                      help='Combine the --json reports of several shards into'
+                      ' one report (written to --json) ordered as a serial run')
+
+    parser.add_argument('--lsp',
+                      action='store_true',
+                      help='Run a Language Server Protocol server on'
+                      ' stdin/stdout')
+
+    parser.add_argument('--watch',
+                      metavar="DIR",
+                      help='Validate every C file under DIR, then keep polling'
+                      ' for changes and print new (+) and resolved (-) errors')
+
+    parser.add_argument('--poll-interval',
+                      metavar="SECONDS",
+                      type=float,
+                      default=0.5,
+                      help='How often --watch checks file modification times')
+
+    parser.add_argument('--debounce',
+                      metavar="SECONDS",
+                      type=float,
+                      default=0.3,
+                      help='How long --watch waits for a burst of saves to'
+                      ' settle before re-validating')
+
     args = parser.parse_args()
 
     if args.ignore_funcs:
         with open(args.ignore_funcs) as f:
-            ignore_func_list = [x.strip() for x in f.readlines()]
+            ignore_func_list = set(x.strip() for x in f.readlines())
+    else:
+        ignore_func_list = set()
+
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline requires --baseline")
+
+    if args.update_baseline and (args.stdin or args.staged or args.commit or
+                                 args.archives or
+                                 not (args.comment_check or args.merge)):
+        parser.error("--update-baseline only records the errors of"
+                     " --comment-check or --merge")
+
+    if args.coordinator or args.worker:
+        import cluster
+
+        try:
+            cluster.authkey()
+            for spec in [args.coordinator, args.worker]:
+                if spec:
+                    cluster.parse_address(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.baseline:
+        import baseline
+
+    if args.baseline and not args.update_baseline:
+        known_errors = baseline.load_baseline(args.baseline)
     else:
-        ignore_func_list = list()
+        known_errors = None
+
+    if args.timings:
+        import timings
+        timing_cache = timings.load_timings(args.timings)
+    else:
+        timing_cache = None
+
+    c_parser.default_engine = args.engine
+
+    if args.reference_rules:
+        import references
+        references.load_rules(args.reference_rules)
+
+    if args.type_cache:
+        c_parser.load_type_cache(args.type_cache)
+
+    if args.streaming and args.cache_dir:
+        parser.error("--streaming can't be combined with --cache-dir, as"
+                     " streamed files aren't cached")
+
+    if args.streaming and args.data_types:
+        parser.error("--streaming can't be combined with --data-types, as"
+                     " streamed files only have their functions validated")
+
+    if args.streaming:
+        import validate
+        validate.streaming = True
+
+    if args.metrics:
+        import atexit
+        import signal
+        import metrics
+
+        atexit.register(metrics.write, args.metrics)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1,
+                          lambda signum, frame: metrics.write(args.metrics))
+
+    if args.data_types:
+        import validate
+        validate.data_types = True
+
+    if args.cache_dir:
+        import cache
+        import validate
+        c_parser.parse_cache = cache.ResultCache(args.cache_dir)
+        validate.function_cache = c_parser.parse_cache
+
+    if args.generate:
+        import io
+        import sys
+        import lsp
+        from classes import CommentFormat
+
+        if not args.stdin or args.line is None:
+            parser.error("--generate requires --stdin and --line")
+
+        lines = io.StringIO(read_stdin(), newline=None).readlines()
+        comment_format = {"edt"    : CommentFormat.EDT,
+                          "doxygen": CommentFormat.Doxygen}[args.generate]
+
+        generated = lsp.generate_at_line(args.stdin_filename, lines,
+                                         args.line, comment_format)
+        if generated is None:
+            print(json.dumps({"error": "No function at line {}".format(
+                                            args.line)}))
+            sys.exit(1)
+
+        print(json.dumps({"line": generated[0], "comment": generated[1]}))
+
+    elif args.stdin:
+        sources = {args.stdin_filename: read_stdin()}
+        validate_files([(0, args.stdin_filename)], ignore_func_list,
+                       known_errors=known_errors, sources=sources)
+
+    if args.staged or args.commit:
+        import os
+        import sys
+        import cache
+        import gitblobs
+
+        if args.staged:
+            blobs = gitblobs.staged_blobs()
+        else:
+            blobs = gitblobs.committed_blobs(args.commit)
+
+        # Blob results are only useful between runs, so keep them in the
+        # repository unless told otherwise
+        blob_cache = cache.ResultCache(args.cache_dir or os.path.join(
+                                           gitblobs.git_dir(), 'hornbill'))
+
+        with gitblobs.CatFile() as cat_file:
+            validator = gitblobs.BlobValidator(blobs, blob_cache, cat_file)
+            report = {"files": validate_files(
+                                    list(enumerate(path for path, _ in blobs)),
+                                    ignore_func_list,
+                                    known_errors=known_errors,
+                                    find_errors=validator.find_errors)}
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=1)
+
+        if any(entry["errors"] for entry in report["files"]):
+            sys.exit(1)
+
+    if args.archives:
+        import archives
+
+        entries = []
+        try:
+            for archive in args.archives:
+                for path, seconds, errors in archives.validate_archive(
+                                                    archive, args.jobs or 1):
+                    entries.append(report_file(len(entries), path, errors,
+                                               seconds, ignore_func_list,
+                                               known_errors=known_errors))
+        except ValueError as e:
+            parser.error("--archives: {}".format(e))
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({"files": entries}, f, indent=1)
+
+    if args.comment_check and args.export_db:
+        import database
+
+        parsed = database.export_files(args.export_db, args.comment_check,
+                                       args.release)
+        print("Exported {} files ({} already in the database)".format(
+                len(args.comment_check), len(args.comment_check) - parsed))
+
+    if args.comment_check and args.coverage:
+        import doc_coverage
+        import formatter
+
+        tree = doc_coverage.aggregate(
+                    formatter.iter_c_files(args.comment_check),
+                    c_parser.parse_cache, ignore_func_list,
+                    roots=args.comment_check)
+        print(doc_coverage.format_report(tree))
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({"coverage": tree}, f, indent=1, sort_keys=True)
+
+    if args.comment_check and not (args.export_db or args.coverage):
+        if args.shard:
+            import shard
+            indexed_files = shard.shard_files(args.comment_check, args.shard,
+                                              timing_cache)
+        else:
+            indexed_files = list(enumerate(args.comment_check))
+
+        if args.coordinator:
+            import sys
+            import cluster
+
+            coordinator = cluster.Coordinator(
+                                cluster.parse_address(args.coordinator),
+                                args.batch_size, args.timeout)
+            entries = [report_file(index, filename, errors, seconds,
+                                   ignore_func_list, timing_cache,
+                                   known_errors)
+                       for index, filename, seconds, errors
+                       in coordinator.run(indexed_files)]
+            report = {"files": sorted(entries, key=lambda x: x["index"])}
+
+            sys.stderr.write("Validated {} files with {} workers, re-queueing"
+                             " {} files from lost workers\n".format(
+                                 len(entries), len(coordinator.workers),
+                                 coordinator.requeued))
+        elif args.jobs:
+            import sys
+            import timings
+            import workers
+
+            costs = timings.predict_costs([x[1] for x in indexed_files],
+                                          timing_cache)
+            supervisor = workers.Supervisor(args.jobs, args.timeout,
+                                            args.memory_limit and
+                                            args.memory_limit * 1024 * 1024)
+            entries = [report_file(index, filename, errors, seconds,
+                                   ignore_func_list, timing_cache,
+                                   known_errors)
+                       for index, filename, seconds, errors
+                       in supervisor.run(indexed_files, costs)]
+            report = {"files": sorted(entries, key=lambda x: x["index"])}
+
+            sys.stderr.write("Validated {} files in {:.1f}s with {} workers,"
+                             " {:.1f}s of it with fewer than {} busy\n".format(
+                                 len(entries), supervisor.wall_seconds,
+                                 args.jobs, supervisor.tail_seconds,
+                                 args.jobs))
+        else:
+            report = {"files": validate_files(indexed_files, ignore_func_list,
+                                              timing_cache, known_errors)}
+        if args.shard:
+            report["shard"] = args.shard
+            report["total_files"] = len(args.comment_check)
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=1)
+
+        if timing_cache is not None:
+            timings.save_timings(args.timings, timing_cache)
+
+        if args.type_cache:
+            c_parser.save_type_cache(args.type_cache)
+
+        if args.update_baseline:
+            baseline.save_baseline(args.baseline,
+                                   [baseline.dict_fingerprint(err)
+                                    for entry in report["files"]
+                                    for err in entry["errors"]])
+
+    if args.worker:
+        import multiprocessing
+        import cluster
+
+        address = cluster.parse_address(args.worker)
+        processes = [multiprocessing.Process(target=cluster.run_worker,
+                                             args=(address, args.cache_dir))
+                     for _ in range(args.jobs or 1)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    if args.format:
+        import os
+        import sys
+        import formatter
+
+        results = formatter.format_tree(args.format, args.check)
+        for filename, functions in results:
+            for func in functions:
+                print("{}:{} in function {} - {}".format(
+                        os.path.basename(filename), func.location.linenumber,
+                        func.name, "Signature is not aligned" if args.check
+                        else "Reformatted signature"))
+
+        if args.check and results:
+            sys.exit(1)
+
+    if args.merge:
+        import shard
+
+        try:
+            report = shard.merge_reports(args.merge)
+        except ValueError as e:
+            parser.error("--merge: {}".format(e))
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=1)
+        else:
+            print(json.dumps(report, indent=1))
+
+        if timing_cache is not None:
+            for entry in report["files"]:
+                timing_cache[entry["filename"]] = entry["seconds"]
+            timings.save_timings(args.timings, timing_cache)
+
+        if args.update_baseline:
+            baseline.save_baseline(args.baseline,
+                                   [baseline.dict_fingerprint(err)
+                                    for entry in report["files"]
+                                    for err in entry["errors"]])
+
+    if args.watch:
+        import cache
+        import validate
+        import watch
+
+        # Keep every function's results, so that re-validating a changed file
+        # only re-parses the functions which changed
+        if validate.function_cache is None:
+            validate.function_cache = cache.ResultCache(memory_size=1000000)
 
-    if args.comment_check:
-        errors = list()
-        for filename in args.comment_check:
-            errors.extend(validate.find_documentation_errors(filename))
+        watcher = watch.Watcher(args.watch,
+                                ignore_funcs=ignore_func_list,
+                                poll_interval=args.poll_interval,
+                                debounce=args.debounce)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
 
-        for err in errors:
-            if err.func.name not in ignore_func_list:
-                err.print_err()
+    if args.lsp:
+        import lsp
+        lsp.serve()
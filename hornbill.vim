@@ -1,15 +1,167 @@
-function GenEDT()
-    let current_line = line('.')
-    let current_filename = expand('%:p')
-    let command = join(["~/Documents/independence_day/hornbill/hornbill.py edt", current_filename, current_line], " ")
-    let @a = system(command)
-    normal {"ap
-endfunction
-
-function GenDoxygen()
-    let current_line = line('.')
-    let current_filename = expand('%:p')
-    let command = join(["~/Documents/independence_day/hornbill/hornbill.py doxygen", current_filename, current_line], " ")
-    let @a = system(command)
-    normal {"ap
+" Generates EDT or Doxygen comments for the function under the cursor.
+"
+" hornbill runs as a background job (Vim 8 jobs or Neovim jobs), which is
+" sent the contents of the buffer, so the editor never waits on the parse.
+" The comment is inserted above the function when the job finishes, unless
+" the buffer has changed in the meantime. Moving the cursor off the line, or
+" asking for another comment, cancels the job.
+"
+" Set g:hornbill_command to the command which runs hornbill.py, as a list, if
+" it isn't next to this file in a python-venv set up by init.bash.
+
+let s:dir = expand('<sfile>:p:h')
+
+" The request in progress, if any, and the id to give the next one
+let s:request = {}
+let s:next_id = 0
+
+function! s:Command(format, line) abort
+    if exists('g:hornbill_command')
+        let command = copy(g:hornbill_command)
+    elseif executable(s:dir . '/python-venv/bin/python')
+        let command = [s:dir . '/python-venv/bin/python', s:dir . '/hornbill.py']
+    else
+        let command = ['python', s:dir . '/hornbill.py']
+    endif
+
+    return command + ['--generate', a:format, '--line', string(a:line),
+                \ '--stdin', '--stdin-filename', expand('%:p')]
+endfunction
+
+function! s:Cancel() abort
+    if empty(s:request)
+        return
+    endif
+
+    let job = s:request.job
+    let s:request = {}
+
+    if has('nvim')
+        silent! call jobstop(job)
+    else
+        call job_stop(job)
+    endif
+endfunction
+
+function! s:Insert(bufnr, line, comment) abort
+    let lines = split(a:comment, "\n")
+    if has('nvim')
+        call nvim_buf_set_lines(a:bufnr, a:line - 1, a:line - 1, v:true, lines)
+    else
+        call appendbufline(a:bufnr, a:line - 1, lines)
+    endif
+endfunction
+
+function! s:Finish(id, output) abort
+    if empty(s:request) || s:request.id != a:id
+        " Cancelled, or replaced by a newer request
+        return
+    endif
+
+    let request = s:request
+    let s:request = {}
+
+    if getbufvar(request.bufnr, 'changedtick') != request.changedtick
+        echomsg 'hornbill: buffer changed, comment discarded'
+        return
+    endif
+
+    " Anything hornbill printed along the way comes before the result
+    let output = filter(copy(a:output), 'v:val !=# ""')
+    try
+        let result = json_decode(output[-1])
+    catch
+        echomsg 'hornbill: ' . join(output, ' ')
+        return
+    endtry
+
+    if has_key(result, 'error')
+        echomsg 'hornbill: ' . result.error
+        return
+    endif
+
+    call s:Insert(request.bufnr, result.line, result.comment)
+endfunction
+
+function! s:OnVimOutput(id, channel, message) abort
+    if !empty(s:request) && s:request.id == a:id
+        call add(s:request.output, a:message)
+    endif
+endfunction
+
+function! s:OnVimClose(id, channel) abort
+    if !empty(s:request) && s:request.id == a:id
+        call s:Finish(a:id, s:request.output)
+    endif
+endfunction
+
+function! s:OnNvimStdout(id, job, data, event) abort
+    if !empty(s:request) && s:request.id == a:id
+        call extend(s:request.output, a:data)
+    endif
+endfunction
+
+function! s:OnNvimExit(id, job, code, event) abort
+    if !empty(s:request) && s:request.id == a:id
+        call s:Finish(a:id, s:request.output)
+    endif
+endfunction
+
+function! s:Generate(format) abort
+    call s:Cancel()
+
+    let s:next_id += 1
+    let request = {'id'         : s:next_id,
+                \  'bufnr'      : bufnr('%'),
+                \  'line'       : line('.'),
+                \  'changedtick': b:changedtick,
+                \  'output'     : []}
+    let command = s:Command(a:format, request.line)
+
+    if has('nvim')
+        let request.job = jobstart(command, {
+                    \ 'stdout_buffered': v:true,
+                    \ 'on_stdout'      : function('s:OnNvimStdout', [request.id]),
+                    \ 'on_exit'        : function('s:OnNvimExit', [request.id])})
+        let s:request = request
+        call chansend(request.job, getline(1, '$') + [''])
+        call chanclose(request.job, 'stdin')
+
+    elseif exists('*job_start')
+        let s:request = request
+        let request.job = job_start(command, {
+                    \ 'in_io'   : 'buffer',
+                    \ 'in_buf'  : request.bufnr,
+                    \ 'err_io'  : 'out',
+                    \ 'out_cb'  : function('s:OnVimOutput', [request.id]),
+                    \ 'close_cb': function('s:OnVimClose', [request.id])})
+
+    else
+        " No job support, so all there is to do is wait
+        let request.output = split(system(join(map(command, 'shellescape(v:val)')),
+                    \ getline(1, '$')), "\n")
+        let s:request = request
+        let s:request.job = 0
+        call s:Finish(request.id, request.output)
+    endif
+endfunction
+
+function! s:CursorMoved() abort
+    if !empty(s:request) &&
+                \ (bufnr('%') != s:request.bufnr || line('.') != s:request.line)
+        call s:Cancel()
+    endif
+endfunction
+
+augroup hornbill
+    autocmd!
+    autocmd CursorMoved,CursorMovedI,BufLeave * call s:CursorMoved()
+augroup END
+
+function! GenEDT()
+    call s:Generate('edt')
+endfunction
+
+function! GenDoxygen()
+    call s:Generate('doxygen')
 endfunction
@@ -0,0 +1,258 @@
+import bisect
+import copy
+import re
+
+from classes import *
+import cache
+import c_parser
+import comments
+import references
+import validate
+
+
+"""
+Incremental analysis of C files, one top level block at a time.
+
+A file is split into blocks with c_parser.toplevel_blocks, so each function
+definition shares a block with the comment above it. Blocks whose results
+aren't already known are parsed together in one pass, in a copy of the file
+where every other line is blank apart from the preprocessor directives. That
+keeps line numbers and macro definitions the same as in a full parse.
+
+Results are stored with line numbers relative to the start of their block, so
+they stay valid when the block moves.
+"""
+
+
+_called_name = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+_word = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class _SplitSource(object):
+    """The stubbed lines, top level blocks and directives of some C source"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.stubbed = c_parser.stub_lines(list(lines))
+        self.blocks = c_parser.toplevel_blocks(lines)
+
+        self.directive_lines = []
+        continuation = False
+        for i, line in enumerate(self.stubbed):
+            if continuation or line.lstrip().startswith("#"):
+                self.directive_lines.append(i)
+                continuation = line.rstrip().endswith("\\")
+
+        self.directives = "".join(self.stubbed[i]
+                                  for i in self.directive_lines)
+
+    def stubbed_text(self, block):
+        start, end = block
+        return "".join(self.stubbed[start:end])
+
+    def sparse_lines(self, blocks, source_lines):
+        """
+        Returns a copy of source_lines which is blank apart from the given
+        blocks and the preprocessor directives.
+        """
+        sparse = ["\n"] * len(source_lines)
+        for i in self.directive_lines:
+            sparse[i] = self.stubbed[i]
+        for start, end in blocks:
+            sparse[start:end] = source_lines[start:end]
+
+        return sparse
+
+    def block_index(self, blocks, linenumber):
+        """
+        Returns the index in blocks (sorted by start) of the block holding the
+        given 1-based line, or None.
+        """
+        line = linenumber - 1
+        index = bisect.bisect_right([start for start, _ in blocks], line) - 1
+        if index >= 0 and line < blocks[index][1]:
+            return index
+
+        return None
+
+    def parse_blocks(self, blocks, engine):
+        """
+        Parses only the given blocks, returning a list of the Functions
+        declared in each.
+        """
+        parsed = c_parser.extract_functions(
+                    self.sparse_lines(blocks, self.stubbed), engine)
+
+        functions = [[] for _ in blocks]
+        for func in parsed:
+            index = self.block_index(blocks, func.location.linenumber)
+            if index is not None:
+                functions[index].append(func)
+
+        return functions
+
+
+def _relocated(func, filename, linenumber):
+    func = copy.copy(func)
+    func.location = Location(filename, linenumber)
+    return func
+
+
+def _relocated_error(err, filename, linenumber):
+    err = copy.copy(err)
+    err.func = _relocated(err.func, filename, linenumber)
+    return err
+
+
+class IncrementalParser(object):
+    """
+    Keeps the Functions declared in each top level block of a single file, so
+    that after an edit only the blocks which changed are stubbed and parsed
+    again.
+    """
+
+    def __init__(self, filename, engine=None):
+        self.filename = filename
+        self.engine = engine or c_parser.default_engine
+
+        # {block key: [Function]}
+        self._blocks = dict()
+
+        # How many blocks the last call to functions() had to parse
+        self.parsed_blocks = 0
+
+    def functions(self, lines):
+        """Returns the list of Functions declared in the given source lines"""
+        source = _SplitSource(lines)
+
+        keys = [cache.content_key(self.engine, "".join(lines[start:end]),
+                                  source.directives)
+                for start, end in source.blocks]
+
+        # Blocks which weren't in the previous version of the file. Identical
+        # blocks only need parsing once.
+        changed = []
+        new_blocks = dict()
+        for i, key in enumerate(keys):
+            if key in self._blocks:
+                new_blocks[key] = self._blocks[key]
+            elif key not in new_blocks:
+                new_blocks[key] = None
+                changed.append(i)
+
+        self.parsed_blocks = len(changed)
+
+        if changed:
+            blocks = [source.blocks[i] for i in changed]
+            parsed = source.parse_blocks(blocks, self.engine)
+            for i, (start, _), functions in zip(changed, blocks, parsed):
+                new_blocks[keys[i]] = [
+                    _relocated(func, "", func.location.linenumber - start)
+                    for func in functions]
+
+        # Only keep the blocks in the current version of the file
+        self._blocks = new_blocks
+
+        functions = []
+        for (start, _), key in zip(source.blocks, keys):
+            for func in new_blocks[key]:
+                functions.append(_relocated(func, self.filename,
+                                            start + func.location.linenumber))
+
+        return functions
+
+
+def _edt_comments_by_name(lines):
+    """
+    Returns {name: [VerbatimComment]} for every EDT comment, by each word on
+    its "edt:" definition line. Finding these doesn't need parse_edt.
+    """
+    by_name = dict()
+    for comment in comments.find_toplevel_docstrings(None, CommentFormat.EDT,
+                                                     lines):
+        for line in comment.comment:
+            if "edt:" in line:
+                for name in set(_word.findall(line)):
+                    by_name.setdefault(name, []).append(comment)
+
+    return by_name
+
+
+def find_documentation_errors(filename, lines, result_cache, engine=None):
+    """
+    Returns the documentation errors in the given lines of a C file, the same
+    as validate.find_documentation_errors does.
+
+    The errors for each top level block are kept in result_cache, keyed by a
+    fingerprint of the block with its function bodies stubbed out (ie. the
+    signatures and the comments above them), plus any EDT comments elsewhere
+    in the file which name a function in the block. Only blocks with a new
+    fingerprint are sent through libclang and the comment parsers.
+    """
+    engine = engine or c_parser.default_engine
+    source = _SplitSource(lines)
+    edt_by_name = _edt_comments_by_name(lines)
+
+    keys = []
+    related = []
+    for start, end in source.blocks:
+        text = source.stubbed_text((start, end))
+
+        # EDT comments can be matched to a function by name from anywhere
+        block_related = []
+        for name in sorted(set(_called_name.findall(text))):
+            for comment in edt_by_name.get(name, []):
+                if not start < comment.start_loc <= end and \
+                        comment not in block_related:
+                    block_related.append(comment)
+
+        related.append(block_related)
+        keys.append(cache.content_key("errors", engine,
+                                      references.rules_digest,
+                                      "data types" if validate.data_types
+                                      else "",
+                                      filename, text,
+                                      source.directives,
+                                      *["\n".join(c.comment)
+                                        for c in block_related]))
+
+    block_errors = [result_cache.get(key) for key in keys]
+
+    missing = [i for i, errors in enumerate(block_errors) if errors is None]
+    if missing:
+        blocks = [source.blocks[i] for i in missing]
+        functions = [func for block_functions in
+                     source.parse_blocks(blocks, engine)
+                     for func in block_functions]
+
+        # Match against just the missing blocks and the comments they depend
+        # on, so that only those comments get parsed
+        matching_blocks = list(blocks)
+        for i in missing:
+            matching_blocks.extend((c.start_loc - 1, c.end_loc)
+                                   for c in related[i])
+        matching_lines = source.sparse_lines(matching_blocks, lines)
+
+        func_docstrings = comments.find_func_docstrings(filename, functions,
+                                                        matching_lines)
+        errors = validate.check_func_docstrings(func_docstrings)
+
+        for i in missing:
+            block_errors[i] = []
+        for err in errors:
+            index = source.block_index(blocks, err.func.location.linenumber)
+            start = blocks[index][0]
+            block_errors[missing[index]].append(
+                _relocated_error(err, filename,
+                                 err.func.location.linenumber - start))
+
+        for i in missing:
+            result_cache.put(keys[i], block_errors[i])
+
+    errors = []
+    for (start, _), block in zip(source.blocks, block_errors):
+        errors.extend(_relocated_error(err, filename,
+                                       start + err.func.location.linenumber)
+                      for err in block)
+
+    return errors
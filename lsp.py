@@ -0,0 +1,397 @@
+from __future__ import print_function
+
+import copy
+import json
+import os
+import re
+import subprocess
+import sys
+
+try:
+    from urllib.parse import unquote, urlparse
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlparse
+
+from classes import *
+import c_parser
+import comments
+import doxygen
+import edt
+import incremental
+import metrics
+import validate
+
+
+"""
+A Language Server Protocol front end, speaking JSON-RPC over stdio.
+
+Documentation errors are published as diagnostics whenever a document is
+opened or changed, and functions missing documentation get code actions which
+insert a generated EDT or Doxygen comment.
+
+Each open document keeps an IncrementalParser, so an edit only re-stubs and
+re-parses the top level blocks it touched.
+
+The custom "hornbill/metrics" request returns the server's run metrics, see
+metrics.to_json.
+"""
+
+
+_SEVERITY_WARNING = 2
+_SYNC_INCREMENTAL = 2
+
+_snippet_placeholder = re.compile(r"\$\{\d+:([^}]*)\}")
+
+
+def _read_message(stream):
+    """Reads one JSON-RPC message, returning None at end of stream"""
+    length = None
+    while True:
+        header = stream.readline()
+        if not header:
+            return None
+        header = header.decode("ascii").strip()
+        if not header:
+            break
+        name, _, value = header.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+
+    return json.loads(stream.read(length).decode("utf-8"))
+
+
+def _write_message(stream, message):
+    body = json.dumps(message).encode("utf-8")
+    stream.write("Content-Length: {}\r\n\r\n".format(len(body)).encode("ascii"))
+    stream.write(body)
+    stream.flush()
+
+
+def _uri_to_filename(uri):
+    return unquote(urlparse(uri).path)
+
+
+def generate_comment(func, comment_format):
+    """
+    Returns a template comment documenting func, as plain text ending in a
+    newline.
+    """
+    if comment_format == CommentFormat.EDT:
+        func = copy.copy(func)
+        func.comment = None
+        return edt.gen_edt(func) + "\n"
+    else:
+        # gen_doxygen writes a snippet, so drop the placeholder markup
+        return _snippet_placeholder.sub(r"\1", doxygen.gen_doxygen(func)) + "\n"
+
+
+def generate_at_line(filename, lines, linenumber, comment_format):
+    """
+    Generates a template comment for the function declared or defined at
+    linenumber (counting from 1) of the given lines of a C file, ie. the last
+    one whose declaration starts at or before it.
+
+    Returns (the line to insert the comment above, counting from 1, the
+    comment), or None if there's no function there.
+    """
+    found = None
+    for func in c_parser.parse_file_functions(filename, lines=lines):
+        start = c_parser.declaration_start(lines, func)
+        if start < linenumber and (found is None or start > found[0]):
+            found = (start, func)
+
+    if found is None:
+        return None
+
+    return (found[0] + 1, generate_comment(found[1], comment_format))
+
+
+class _Document(object):
+    """An open text document and the errors last found in it"""
+
+    def __init__(self, uri, text):
+        self.uri = uri
+        self.filename = _uri_to_filename(uri)
+        self.lines = text.splitlines(True)
+        self.parser = incremental.IncrementalParser(self.filename)
+        self.errors = []
+
+    def apply_change(self, change):
+        """
+        Applies one TextDocumentContentChangeEvent. Character offsets are
+        treated as code points, which matches UTF-16 outside the astral planes.
+        """
+        if "range" not in change:
+            self.lines = change["text"].splitlines(True)
+            return
+
+        start = change["range"]["start"]
+        end = change["range"]["end"]
+
+        # Only the lines the edit touches need joining together
+        lines = self.lines
+        first = min(start["line"], len(lines))
+        last = min(end["line"], len(lines) - 1)
+        text = "".join(lines[first:last + 1])
+
+        start_offset = start["character"] if start["line"] < len(lines) else 0
+        end_offset = len(text) - len(lines[last]) + end["character"] \
+            if end["line"] < len(lines) else len(text)
+
+        text = text[:start_offset] + change["text"] + text[end_offset:]
+        self.lines = lines[:first] + text.splitlines(True) + lines[last + 1:]
+
+    def analyze(self):
+        with metrics.timed("file_validation_seconds"):
+            functions = self.parser.functions(self.lines)
+            func_docstrings = comments.find_func_docstrings(self.filename,
+                                                            functions,
+                                                            self.lines)
+            self.errors = validate.check_func_docstrings(func_docstrings)
+
+        metrics.count("files_validated_total")
+        validate.count_errors(self.errors)
+
+    def diagnostics(self):
+        result = []
+        for err in self.errors:
+            line = err.func.location.linenumber - 1
+            length = len(self.lines[line].rstrip("\r\n")) \
+                if line < len(self.lines) else 0
+
+            result.append({
+                "range"   : {"start": {"line": line, "character": 0},
+                             "end"  : {"line": line, "character": length}},
+                "severity": _SEVERITY_WARNING,
+                "source"  : "hornbill",
+                "code"    : type(err).__name__,
+                "message" : err.message()})
+
+        return result
+
+    def code_actions(self, first_line, last_line):
+        """
+        Returns code actions generating documentation for any undocumented
+        function declared between the given (0-based) lines.
+        """
+        actions = []
+        for err in self.errors:
+            line = err.func.location.linenumber - 1
+            if not isinstance(err, validate.NoDocumentationError) or \
+                    not first_line <= line <= last_line:
+                continue
+
+            insert_at = {"line": c_parser.declaration_start(self.lines,
+                                                            err.func),
+                         "character": 0}
+
+            for name, comment_format in [("EDT", CommentFormat.EDT),
+                                         ("Doxygen", CommentFormat.Doxygen)]:
+                text = generate_comment(err.func, comment_format)
+                actions.append({
+                    "title": "Generate {} comment for {}".format(
+                                name, err.func.name),
+                    "kind" : "quickfix",
+                    "edit" : {"changes": {self.uri: [{
+                                "range"  : {"start": insert_at,
+                                            "end"  : insert_at},
+                                "newText": text}]}}})
+
+        return actions
+
+
+class Server(object):
+    def __init__(self, instream, outstream):
+        self.instream = instream
+        self.outstream = outstream
+        self.documents = dict()
+        self.shutdown = False
+
+    def _notify(self, method, params):
+        _write_message(self.outstream, {"jsonrpc": "2.0",
+                                        "method" : method,
+                                        "params" : params})
+
+    def _publish(self, document):
+        self._notify("textDocument/publishDiagnostics",
+                     {"uri"        : document.uri,
+                      "diagnostics": document.diagnostics()})
+
+    def _analyze(self, document):
+        try:
+            document.analyze()
+        except Exception as e:
+            print("hornbill: failed to analyze {}: {}".format(document.uri, e),
+                  file=sys.stderr)
+        self._publish(document)
+
+    def initialize(self, params):
+        return {"capabilities": {
+                    "textDocumentSync"  : {"openClose": True,
+                                           "change"   : _SYNC_INCREMENTAL},
+                    "codeActionProvider": True},
+                "serverInfo": {"name": "hornbill"}}
+
+    def did_open(self, params):
+        item = params["textDocument"]
+        document = _Document(item["uri"], item["text"])
+        self.documents[item["uri"]] = document
+        self._analyze(document)
+
+    def did_change(self, params):
+        document = self.documents[params["textDocument"]["uri"]]
+        for change in params["contentChanges"]:
+            document.apply_change(change)
+        self._analyze(document)
+
+    def did_close(self, params):
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self._notify("textDocument/publishDiagnostics",
+                     {"uri": uri, "diagnostics": []})
+
+    def code_action(self, params):
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None:
+            return []
+
+        return document.code_actions(params["range"]["start"]["line"],
+                                     params["range"]["end"]["line"])
+
+    def get_metrics(self, params):
+        return metrics.to_json()
+
+    def do_shutdown(self, params):
+        self.shutdown = True
+        return None
+
+    def handle(self, message):
+        """Handles one message, returning False once the server should exit"""
+        requests = {"initialize"             : self.initialize,
+                    "shutdown"               : self.do_shutdown,
+                    "hornbill/metrics"       : self.get_metrics,
+                    "textDocument/codeAction": self.code_action}
+
+        notifications = {"textDocument/didOpen"  : self.did_open,
+                         "textDocument/didChange": self.did_change,
+                         "textDocument/didClose" : self.did_close}
+
+        method = message.get("method")
+        params = message.get("params") or {}
+
+        if method == "exit":
+            return False
+
+        if "id" not in message:
+            if method in notifications:
+                notifications[method](params)
+            return True
+
+        if method in requests:
+            response = {"jsonrpc": "2.0", "id": message["id"],
+                        "result" : requests[method](params)}
+        else:
+            response = {"jsonrpc": "2.0", "id": message["id"],
+                        "error"  : {"code": -32601,
+                                    "message": "Unknown method {}".format(
+                                                    method)}}
+
+        _write_message(self.outstream, response)
+        return True
+
+    def run(self):
+        while True:
+            message = _read_message(self.instream)
+            if message is None or not self.handle(message):
+                break
+
+
+def serve():
+    """Runs a server on stdin/stdout until the client asks it to exit"""
+    instream = getattr(sys.stdin, "buffer", sys.stdin)
+    outstream = getattr(sys.stdout, "buffer", sys.stdout)
+
+    # The parsers print warnings, which must not end up in the protocol stream
+    sys.stdout = sys.stderr
+
+    Server(instream, outstream).run()
+
+
+def test_server():
+    """
+    Drive a real server over stdio: open a file, edit one function, and ask
+    for a code action.
+    """
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    filename = os.path.join(dir_path, 'test_sources', 'a.c')
+    uri = "file://" + filename
+
+    with open(filename) as f:
+        text = f.read()
+
+    proc = subprocess.Popen([sys.executable,
+                             os.path.join(dir_path, 'hornbill.py'), '--lsp'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def request(id, method, params):
+        _write_message(proc.stdin, {"jsonrpc": "2.0", "id": id,
+                                    "method": method, "params": params})
+        return _read_message(proc.stdout)
+
+    def notify(method, params):
+        _write_message(proc.stdin, {"jsonrpc": "2.0",
+                                    "method": method, "params": params})
+
+    def diagnosed_functions():
+        message = _read_message(proc.stdout)
+        assert message["method"] == "textDocument/publishDiagnostics"
+        return sorted((d["range"]["start"]["line"], d["code"])
+                      for d in message["params"]["diagnostics"])
+
+    assert "capabilities" in request(1, "initialize", {})["result"]
+
+    notify("textDocument/didOpen",
+           {"textDocument": {"uri": uri, "languageId": "c", "version": 1,
+                             "text": text}})
+    before = diagnosed_functions()
+    assert (37, "NoDocumentationError") in before
+
+    # Rename main, and give it an argument
+    main_line = text.splitlines().index("main (void)")
+    notify("textDocument/didChange",
+           {"textDocument": {"uri": uri, "version": 2},
+            "contentChanges": [{"range": {
+                                  "start": {"line": main_line, "character": 0},
+                                  "end"  : {"line": main_line,
+                                            "character": len("main (void)")}},
+                                "text": "entry (int argc)"}]})
+    assert diagnosed_functions() == before
+
+    actions = request(2, "textDocument/codeAction",
+                      {"textDocument": {"uri": uri},
+                       "range": {"start": {"line": main_line, "character": 0},
+                                 "end"  : {"line": main_line, "character": 0}},
+                       "context": {"diagnostics": []}})["result"]
+    assert [a["title"] for a in actions] == \
+        ["Generate EDT comment for entry", "Generate Doxygen comment for entry"]
+    edit = actions[0]["edit"]["changes"][uri][0]
+    assert edit["range"]["start"]["line"] == main_line - 1
+    assert "edt: * function entry" in edit["newText"]
+    assert "Argument: argc" in edit["newText"]
+
+    # Both analyses are counted, along with the errors each found
+    counted = request(3, "hornbill/metrics", None)["result"]
+    assert counted["counters"]["files_validated_total"] == 2
+    assert counted["histograms"]["file_validation_seconds"]["count"] == 2
+    assert sum(counted["counters"]["documentation_errors_total"].values()) \
+        == 2 * len(before)
+
+    assert request(4, "shutdown", None)["result"] is None
+    notify("exit", None)
+    proc.wait()
+
+
+if __name__ == '__main__':
+    test_server()
+    print('Tests passed.')
@@ -0,0 +1,325 @@
+import bisect
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+"""
+Counters and histograms describing a run, eg. how long each libclang parse
+took and how often the caches were hit, exported as JSON or as a Prometheus
+textfile (for node_exporter's textfile collector).
+
+Recording is meant to be cheap enough for the hot paths: a counter is one
+dict update, and a histogram observation a bisect into fixed buckets. Worker
+processes send what they've recorded back with their results (see take and
+merge), so a run's metrics cover all of its processes.
+"""
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+           5.0, 10.0, 30.0, 60.0, float("inf"))
+
+_PREFIX = "hornbill_"
+
+HELP = {
+    "files_validated_total": "C files validated",
+    "documentation_errors_total": "Documentation errors reported, by class",
+    "files_failed_total": "Files which couldn't be validated, by reason",
+    "file_validation_seconds": "Time to validate each file",
+    "libclang_parses_total": "Parses by libclang, including any retries"
+                             " with a different prelude",
+    "libclang_parse_seconds": "Time spent in each libclang parse",
+    "fast_engine_files_total": "Files read by the fast engine",
+    "fast_engine_fallbacks_total": "Files the fast engine left to libclang",
+    "parse_cache_hits_total": "Parse results reused from the parse cache",
+    "parse_cache_misses_total": "Parse results missing from the parse cache",
+    "comment_cache_hits_total": "Parsed comments reused from the cache",
+    "comment_cache_misses_total": "Comments which had to be parsed",
+    "run_seconds": "Time since the run started",
+    "files_per_second": "Files validated per second of the run",
+    "peak_rss_bytes": "Peak resident set size of hornbill or any of its"
+                      " worker processes",
+}
+
+# {(name, labels): value}, where labels is a sorted tuple of (name, value)
+_counters = collections.defaultdict(float)
+
+# {(name, labels): [count in each bucket, ..., sum]}
+_histograms = dict()
+
+# The highest peak resident set size reported by any worker, in bytes
+_worker_peak_rss = 0
+
+# Held for every update, as cluster.py merges results from its threads while
+# the main thread records its own
+_merge_lock = threading.Lock()
+_start_time = time.time()
+
+
+def count(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _merge_lock:
+        _counters[key] += amount
+
+
+def observe(name, value):
+    """Records a value, in seconds, in a histogram"""
+    key = (name, ())
+    bucket = bisect.bisect_left(BUCKETS, value)
+    with _merge_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0]
+
+        histogram[bucket] += 1
+        histogram[-1] += value
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Observes how long the with block takes in a histogram"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start)
+
+
+def take():
+    """
+    Returns everything recorded in this process since the last take, and
+    forgets it, eg. to send it from a worker to be merged. The snapshot also
+    holds this process's peak resident set size, as a worker which is still
+    running (or on another machine) isn't counted by the parent's rusage.
+    """
+    with _merge_lock:
+        snapshot = (dict(_counters), dict(_histograms), _peak_rss() or 0)
+        _counters.clear()
+        _histograms.clear()
+
+    return snapshot
+
+
+def merge(snapshot):
+    """Adds a snapshot from take, eg. from a worker, to this process"""
+    global _worker_peak_rss
+
+    counters, histograms, peak_rss = snapshot
+
+    with _merge_lock:
+        _worker_peak_rss = max(_worker_peak_rss, peak_rss)
+
+        for key, value in counters.items():
+            _counters[key] += value
+
+        for key, histogram in histograms.items():
+            ours = _histograms.get(key)
+            if ours is None:
+                _histograms[key] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    ours[i] += value
+
+
+def _peak_rss(who="RUSAGE_SELF"):
+    """
+    Peak resident set size in bytes of this process, or of its reaped
+    children if who is "RUSAGE_CHILDREN"
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    scale = 1 if os.uname()[0] == "Darwin" else 1024
+    return scale * resource.getrusage(getattr(resource, who)).ru_maxrss
+
+
+def _percentile(histogram, fraction):
+    """Estimates a percentile by interpolating within its bucket"""
+    total = sum(histogram[:-1])
+    if not total:
+        return None
+
+    rank = fraction * total
+    seen = 0
+    for i, bucket_count in enumerate(histogram[:-1]):
+        if seen + bucket_count >= rank and bucket_count:
+            lower = BUCKETS[i - 1] if i else 0.0
+            upper = BUCKETS[i] if i < len(BUCKETS) - 1 else lower
+            return lower + (upper - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+
+    return None
+
+
+def _gauges():
+    """Values derived from the counters when they're exported"""
+    elapsed = time.time() - _start_time
+    files = sum(value for (name, _), value in _counters.items()
+                if name == "files_validated_total")
+
+    gauges = {"run_seconds"     : elapsed,
+              "files_per_second": files / elapsed if elapsed else 0.0}
+
+    peak_rss = _peak_rss()
+    if peak_rss is not None:
+        gauges["peak_rss_bytes"] = max(peak_rss,
+                                       _peak_rss("RUSAGE_CHILDREN"),
+                                       _worker_peak_rss)
+
+    return gauges
+
+
+def _hit_rate(hits, misses):
+    hits = _counters.get((hits, ()), 0)
+    misses = _counters.get((misses, ()), 0)
+    return hits / (hits + misses) if hits + misses else None
+
+
+def to_json():
+    counters = dict()
+    for (name, labels), value in sorted(_counters.items()):
+        if labels:
+            counters.setdefault(name, dict())[
+                ",".join("{}={}".format(*x) for x in labels)] = value
+        else:
+            counters[name] = value
+
+    histograms = dict()
+    for (name, _), histogram in sorted(_histograms.items()):
+        histograms[name] = {
+            "count": sum(histogram[:-1]),
+            "sum"  : histogram[-1],
+            "p50"  : _percentile(histogram, 0.5),
+            "p90"  : _percentile(histogram, 0.9),
+            "p99"  : _percentile(histogram, 0.99),
+        }
+
+    return {"counters"   : counters,
+            "histograms" : histograms,
+            "gauges"     : _gauges(),
+            "cache_hit_rates": {
+                "parse"  : _hit_rate("parse_cache_hits_total",
+                                     "parse_cache_misses_total"),
+                "comment": _hit_rate("comment_cache_hits_total",
+                                     "comment_cache_misses_total")}}
+
+
+def _labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value)
+                          for name, value in labels) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def to_prometheus():
+    """Returns everything recorded in the Prometheus text format"""
+    lines = []
+
+    def header(name, kind):
+        full_name = _PREFIX + name
+        if name in HELP:
+            lines.append("# HELP {} {}".format(full_name, HELP[name]))
+        lines.append("# TYPE {} {}".format(full_name, kind))
+        return full_name
+
+    named = collections.OrderedDict()
+    for (name, labels), value in sorted(_counters.items()):
+        named.setdefault(name, []).append((labels, value))
+    for name, values in named.items():
+        full_name = header(name, "counter")
+        for labels, value in values:
+            lines.append("{}{} {}".format(full_name, _labels(labels),
+                                          _number(value)))
+
+    for (name, labels), histogram in sorted(_histograms.items()):
+        full_name = header(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram):
+            cumulative += bucket_count
+            lines.append("{}_bucket{} {}".format(
+                            full_name,
+                            _labels(labels, [("le", _number(bound))]),
+                            cumulative))
+        lines.append("{}_sum{} {}".format(full_name, _labels(labels),
+                                          _number(histogram[-1])))
+        lines.append("{}_count{} {}".format(full_name, _labels(labels),
+                                            cumulative))
+
+    for name, value in sorted(_gauges().items()):
+        full_name = header(name, "gauge")
+        lines.append("{} {}".format(full_name, _number(value)))
+
+    return "\n".join(lines) + "\n"
+
+
+def write(filename):
+    """
+    Writes everything recorded so far to filename, as JSON if it ends in
+    .json, and as a Prometheus textfile otherwise. The file is replaced in
+    one rename, so a collector never reads half of it.
+    """
+    if filename.endswith(".json"):
+        text = json.dumps(to_json(), indent=1, sort_keys=True) + "\n"
+    else:
+        text = to_prometheus()
+
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        f.write(text)
+    os.rename(tmp_filename, filename)
+
+
+def test_metrics():
+    global _worker_peak_rss
+
+    saved = take()
+    try:
+        count("files_validated_total", 3)
+        count("documentation_errors_total", error="NoReturnError")
+        for value in [0.002, 0.003, 0.2]:
+            observe("libclang_parse_seconds", value)
+
+        # As if from a worker
+        worker = ({("files_validated_total", ()): 2.0},
+                  {("libclang_parse_seconds", ()):
+                   [0] * (len(BUCKETS) - 1) + [1, 100.0]},
+                  1 << 50)
+        merge(worker)
+
+        report = to_json()
+        assert report["counters"]["files_validated_total"] == 5
+        assert report["counters"]["documentation_errors_total"] == \
+            {"error=NoReturnError": 1}
+        parses = report["histograms"]["libclang_parse_seconds"]
+        assert parses["count"] == 4
+        assert 0.0025 <= parses["p50"] <= 0.005
+        assert report["gauges"]["peak_rss_bytes"] == 1 << 50
+
+        text = to_prometheus()
+        assert 'hornbill_documentation_errors_total{error="NoReturnError"} 1.0' \
+            in text
+        assert 'hornbill_libclang_parse_seconds_bucket{le="+Inf"} 4' in text
+        assert "hornbill_libclang_parse_seconds_count 4" in text
+    finally:
+        _worker_peak_rss = 0
+        take()
+        merge(saved)
+
+
+if __name__ == '__main__':
+    test_metrics()
+    print('Tests passed.')
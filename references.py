@@ -0,0 +1,198 @@
+import hashlib
+import json
+import re
+
+from classes import *
+
+
+"""
+Rules deciding whether a comment says that a function is documented
+elsewhere, eg. "See foo.h for documentation" or "Implements the frob_cb
+callback", in which case the comment isn't checked against the function.
+
+Each CommentFormat has its own rules. A line of a comment is a reference if
+either:
+
+ - it contains a match for one of the header patterns (eg. a .h file name),
+   and one of the key phrases in any case, or
+ - it contains a match for one of the line patterns (eg. "implements
+   some_cb"), in any case if line_patterns_ignore_case is set.
+
+The rules are compiled once, and each comment is searched as a whole rather
+than line by line, so patterns must not match across a newline: "." never
+does, but negated character classes should exclude "\\n".
+
+Projects can replace any of the rules with a JSON file of the form
+
+    {"edt": {"key_phrases": [...],
+             "header_patterns": [...],
+             "line_patterns": [...],
+             "line_patterns_ignore_case": true},
+     "doxygen": {...}}
+
+where any format or list left out keeps its default.
+"""
+
+
+_SIGNATURE_TYPES = [
+    r"[^ \n]*_cb",
+    r"[^ \n]*_fn",
+    r"[^ \n]*_func",
+    r"[^ \n]*_type",
+    r"[^ \n]*_callback",
+    r"event_handler",
+]
+
+DEFAULT_RULES = {
+    "edt": {
+        "key_phrases": [
+            "function description",
+            "for documentation",
+            "see",
+            "edt in",
+            "edt comments in",
+        ],
+        "header_patterns": [r" [^. \n]*\.h", r" header file"],
+        "line_patterns": [r"implements (?:{})".format(
+                              "|".join(_SIGNATURE_TYPES))],
+        "line_patterns_ignore_case": True,
+    },
+    "doxygen": {
+        "key_phrases": [
+            "function description",
+            "for documentation",
+            "see",
+        ],
+        "header_patterns": [r" [^. \n]*\.h"],
+        "line_patterns": [r" implements [^ \n]*_cb"],
+        "line_patterns_ignore_case": False,
+    },
+}
+
+_FORMAT_NAMES = {CommentFormat.EDT: "edt", CommentFormat.Doxygen: "doxygen"}
+
+
+def _alternatives(patterns, flags=0):
+    if not patterns:
+        return None
+
+    return re.compile("|".join("(?:{})".format(p) for p in patterns), flags)
+
+
+class ReferenceRules(object):
+    """The compiled rules for one CommentFormat"""
+
+    def __init__(self, key_phrases, header_patterns, line_patterns,
+                 line_patterns_ignore_case=False):
+        self._headers = _alternatives(header_patterns) if key_phrases else None
+        self._phrases = _alternatives([re.escape(phrase)
+                                       for phrase in key_phrases],
+                                      re.IGNORECASE)
+        self._lines = _alternatives(line_patterns,
+                                    re.IGNORECASE if line_patterns_ignore_case
+                                    else 0)
+
+    def is_reference(self, lines):
+        """
+        Returns True iff any of the given comment lines says that the
+        documentation can be found elsewhere.
+        """
+        text = "\n".join(lines)
+
+        if self._lines is not None and self._lines.search(text):
+            return True
+
+        if self._headers is not None:
+            for match in self._headers.finditer(text):
+                # The key phrase must be on the same line
+                start = text.rfind("\n", 0, match.start()) + 1
+                end = text.find("\n", match.end())
+                if self._phrases.search(text, start,
+                                        len(text) if end < 0 else end):
+                    return True
+
+        return False
+
+
+def _compile(config):
+    return dict((comment_format,
+                 ReferenceRules(**dict(DEFAULT_RULES[name],
+                                       **config.get(name, {}))))
+                for comment_format, name in _FORMAT_NAMES.items())
+
+
+rules = _compile({})
+
+# The file the current rules were loaded from, if any
+rules_file = None
+
+# Identifies the current rules in the keys of cached results which depend on
+# them, so results found under other rules aren't reused
+rules_digest = "default"
+
+
+def load_rules(filename):
+    """Replaces the current rules with those in a JSON file"""
+    global rules, rules_file, rules_digest
+
+    with open(filename) as f:
+        config = json.load(f)
+
+    rules = _compile(config)
+    rules_file = filename
+    rules_digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode(
+                                    "utf-8")).hexdigest()
+
+
+def is_reference(comment_format, lines):
+    return rules[comment_format].is_reference(lines)
+
+
+def test_rules():
+    edt_rules = rules[CommentFormat.EDT]
+    assert edt_rules.is_reference(["See foo.h for documentation."])
+    assert edt_rules.is_reference(["Described in the", "EDT in widget.h"])
+    assert edt_rules.is_reference(["Implements Widget_Frob_CB."])
+    assert not edt_rules.is_reference(["Frobs the widget.", "See also foo.c"])
+    assert not edt_rules.is_reference(["widget.h", "see above"])
+
+    custom = _compile({"edt": {"line_patterns": [r"documented in \S+\.md"]}})
+    assert custom[CommentFormat.EDT].is_reference(["Documented in api.md"])
+    assert not custom[CommentFormat.EDT].is_reference(["Implements frob_cb"])
+    assert custom[CommentFormat.Doxygen].is_reference(
+                ["See widget.h for documentation."])
+    assert not custom[CommentFormat.Doxygen].is_reference(
+                ["This Implements frob_cb"])
+
+
+def test_rules_digest():
+    """Cached results are keyed by the content of the rules file"""
+    import os
+    import tempfile
+
+    global rules, rules_file, rules_digest
+    saved = (rules, rules_file, rules_digest)
+
+    fd, filename = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        digests = []
+        for config in [{"edt": {"key_phrases": ["see"]}},
+                       {"edt": {"line_patterns": []}},
+                       {"edt": {"line_patterns": []}}]:
+            with open(filename, 'w') as f:
+                json.dump(config, f)
+            load_rules(filename)
+            digests.append(rules_digest)
+
+        assert saved[2] not in digests
+        assert digests[0] != digests[1] == digests[2]
+    finally:
+        os.remove(filename)
+        rules, rules_file, rules_digest = saved
+
+
+if __name__ == '__main__':
+    test_rules()
+    test_rules_digest()
+    print('Tests passed.')
@@ -0,0 +1,167 @@
+import heapq
+import json
+
+import timings
+
+
+def parse_shard_spec(spec):
+    """
+    Parses a shard specification of the form "i/n", where shards are numbered
+    from 1 to n.
+
+    Returns (i, n).
+    """
+    try:
+        index, count = [int(x) for x in spec.split("/")]
+    except ValueError:
+        raise ValueError("Shard \"{}\" is not of the form i/n".format(spec))
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("Shard \"{}\" is out of range".format(spec))
+
+    return (index, count)
+
+
+def assign_shards(filenames, count, costs):
+    """
+    Assign each file to one of count shards, balancing the total cost of each
+    shard.
+
+    Files are handed out most expensive first, each to the currently cheapest
+    shard. Ties are broken by filename and then by shard number, so every
+    runner given the same file list and costs computes the same assignment.
+
+    Returns a list of shard numbers (1 to count), one per filename.
+    """
+    loads = [(0.0, shard) for shard in range(1, count + 1)]
+    assignment = [None] * len(filenames)
+
+    order = sorted(range(len(filenames)),
+                   key=lambda i: (-costs[i], filenames[i], i))
+
+    for i in order:
+        load, shard = heapq.heappop(loads)
+        heapq.heappush(loads, (load + costs[i], shard))
+        assignment[i] = shard
+
+    return assignment
+
+
+def shard_files(filenames, spec, timing_cache=None):
+    """
+    Returns the [(index, filename)] which belong to the shard described by
+    spec, where index is the position of the file in the full list.
+    """
+    index, count = parse_shard_spec(spec)
+
+    costs = timings.predict_costs(filenames, timing_cache)
+    assignment = assign_shards(filenames, count, costs)
+
+    return [(i, filename) for i, filename in enumerate(filenames)
+            if assignment[i] == index]
+
+
+def merge_reports(report_filenames):
+    """
+    Combine the JSON reports written by each shard into a single report, with
+    the files in the same order as a serial run over the full list.
+
+    Raises ValueError unless the reports are every shard of one run exactly
+    once, ie. they share a shard count and file count, and between them
+    report each file of the full list once.
+    """
+    files = dict()
+    shards = set()
+    runs = set()
+
+    for report_filename in report_filenames:
+        with open(report_filename) as f:
+            report = json.load(f)
+
+        if "shard" not in report or "total_files" not in report:
+            raise ValueError("{} is not the report of a --shard run".format(
+                                report_filename))
+
+        index, count = parse_shard_spec(report["shard"])
+        if index in shards:
+            raise ValueError("Shard {} is reported more than once".format(
+                                report["shard"]))
+        shards.add(index)
+        runs.add((count, report["total_files"]))
+
+        for entry in report["files"]:
+            if entry["index"] in files:
+                raise ValueError("File {} appears in more than one report".format(
+                                    entry["filename"]))
+
+            files[entry["index"]] = entry
+
+    if len(runs) != 1:
+        raise ValueError("The reports are of different runs, with (shards,"
+                         " files) of {}".format(", ".join(
+                             "({}, {})".format(*x) for x in sorted(runs))))
+
+    [(count, total_files)] = runs
+    missing = sorted(set(range(1, count + 1)) - shards)
+    if missing:
+        raise ValueError("Missing the reports of shards {}".format(
+                            ", ".join("{}/{}".format(x, count)
+                                      for x in missing)))
+
+    if sorted(files) != list(range(total_files)):
+        raise ValueError("The reports cover {} of {} files".format(
+                            len(files), total_files))
+
+    return {"files": [files[i] for i in range(total_files)]}
+
+
+def test_shard():
+    import os
+    import shutil
+    import tempfile
+
+    filenames = ["{}.c".format(x) for x in "abcdefghij"]
+    costs = [5.0, 1.0, 1.0, 3.0, 2.0, 2.0, 8.0, 1.0, 1.0, 4.0]
+
+    # The same on every runner, whatever order the files were listed in
+    assignment = assign_shards(filenames, 3, costs)
+    assert assignment == assign_shards(filenames, 3, costs)
+    order = list(reversed(range(len(filenames))))
+    assert [assignment[i] for i in order] == assign_shards(
+        [filenames[i] for i in order], 3, [costs[i] for i in order])
+
+    # Every file in exactly one shard, with the cost spread evenly
+    assert sorted(set(assignment)) == [1, 2, 3]
+    loads = [sum(c for c, s in zip(costs, assignment) if s == shard)
+             for shard in [1, 2, 3]]
+    assert max(loads) - min(loads) <= max(costs)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        reports = []
+        for index in [1, 2, 3]:
+            spec = "{}/3".format(index)
+            reports.append(os.path.join(tmp_dir, "{}.json".format(index)))
+            with open(reports[-1], "w") as f:
+                json.dump({"shard": spec, "total_files": len(filenames),
+                           "files": [{"index": i, "filename": filenames[i]}
+                                     for i, shard in enumerate(assignment)
+                                     if shard == index]}, f)
+
+        merged = merge_reports(reports)
+        assert [x["filename"] for x in merged["files"]] == filenames
+
+        for bad in [reports[:2], reports + reports[:1]]:
+            try:
+                merge_reports(bad)
+            except ValueError:
+                pass
+            else:
+                assert False, "merged {}".format(bad)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    test_shard()
+    print('Tests passed.')
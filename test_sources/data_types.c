@@ -0,0 +1,57 @@
+#include <stdint.h>
+#ifndef DT_H
+#define DT_H
+#endif
+
+/** Largest widget */
+#define WIDGET_MAX 16
+
+#define WIDGET_MIN(a, b) \
+    ((a) < (b) ? (a) : (b))
+
+/**
+ * A point
+ */
+struct point {
+    int x; /**< Across */
+    /** Down */
+    int y;
+    uint32_t z;
+};
+
+typedef struct point point_t;
+
+/** Colours */
+typedef enum {
+    RED,   /**< Red */
+    GREEN,
+} colour_t;
+
+union u {
+    int i;
+    float f;
+};
+
+typedef int (*frob_cb)(point_t *p, int how);
+
+struct forward;
+
+/**
+ * Frob
+ *
+ * @param[in] p
+ *
+ * @return int
+ */
+int
+frob (point_t *p)
+{
+    struct point local = { 1, 2 };
+    return (p->x);
+}
+
+static struct point
+make (colour_t c, union u v)
+{
+    return (struct point) { 0 };
+}
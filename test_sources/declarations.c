@@ -0,0 +1,81 @@
+/*
+ * A corpus of plain declarations, which the fast engine should read exactly
+ * as clang does.
+ */
+#define BUFFER_SIZE 16
+#define MAX(a, b) \
+    ((a) > (b) ? (a) : (b))
+
+struct point {
+    int x;
+    int y;
+};
+
+typedef struct point point_t;
+
+static int counter = 0;
+const char *names[] = { "a", "b" };
+
+static inline unsigned
+count_bits (unsigned value)
+{
+    unsigned count = 0;
+    while (value) {
+        count += value & 1;
+        value >>= 1;
+    }
+    return (count);
+}
+
+/**
+ * Sums two longs
+ *
+ * @param[in] a
+ * @param[in] b
+ *
+ * @return long
+ */
+long int
+add_longs (long int a, signed long b)
+{
+    return (a + b);
+}
+
+const char * const *
+lookup_names (char const * const *table,
+              volatile int *volatile index,
+              struct point *where,
+              enum colour shade);
+
+void
+reset (void)
+{
+    counter = 0;
+}
+
+void
+legacy_reset ();
+
+extern point_t *
+make_point (const point_t *template,
+            point_t const copy,
+            unsigned short int x,
+            signed char y);
+
+unsigned long long
+checksum (const unsigned char *data, unsigned long long len, _Bool strict)
+{
+    return (len);
+}
+
+long double
+scale (long double value, double factor, float bias);
+
+int
+unnamed_args (int, char *);
+
+union u *
+pick (union u *a, const struct point * const b)
+{
+    return (a);
+}
@@ -0,0 +1,58 @@
+import json
+import os
+
+
+"""
+A timing cache records how long each file took to validate on previous runs,
+as a JSON object of {filename: seconds}. It is used to predict the cost of
+validating a file, falling back to the file size when a file has no history.
+"""
+
+
+def load_timings(filename):
+    """Returns the {filename: seconds} dict stored in filename, if any"""
+    if filename is None or not os.path.exists(filename):
+        return dict()
+
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_timings(filename, timings):
+    with open(filename, 'w') as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def predict_costs(filenames, timings=None):
+    """
+    Predict the cost of validating each file, returning a list of costs in the
+    same order as filenames.
+
+    Files with a recorded time use it. Files without one are estimated from
+    their size, scaled by the average seconds-per-byte of the timed files so
+    that the two kinds of estimate are comparable.
+    """
+    timings = timings or dict()
+    sizes = [_file_size(f) for f in filenames]
+
+    timed_bytes = 0
+    timed_seconds = 0.0
+    for filename, size in zip(filenames, sizes):
+        if filename in timings and size:
+            timed_bytes += size
+            timed_seconds += timings[filename]
+
+    if timed_bytes:
+        seconds_per_byte = timed_seconds / timed_bytes
+    else:
+        seconds_per_byte = 1.0
+
+    return [timings[f] if f in timings else size * seconds_per_byte
+            for f, size in zip(filenames, sizes)]
@@ -1,9 +1,11 @@
 from __future__ import print_function
+import io
 import os
 
 from classes import *
 import c_parser
 import comments
+import metrics
 
 
 class BaseDocumentationError(object):
@@ -14,17 +16,40 @@ class BaseDocumentationError(object):
         self.func = func
         self.argname = argname
 
-    def print_err(self):
-        print(self.base_string.format(
+    def __str__(self):
+        return self.base_string.format(
+                    kind = getattr(self.func, "kind", "function"),
                     funcname = self.func.name,
                     filename = os.path.basename(self.func.location.filename),
-                    linenumber = self.func.location.linenumber),
-               end = "")
+                    linenumber = self.func.location.linenumber) + self.message()
 
+    def message(self):
+        """The description of the error, without saying where it is"""
         if self.argname is not None:
-            print(self.string.format(argname = self.argname))
+            return self.string.format(argname = self.argname)
         else:
-            print(self.string)
+            return self.string
+
+    def key(self):
+        """
+        Identity of this error which survives the function moving around in
+        its file, ie. ignores the line number.
+        """
+        return (self.func.location.filename,
+                self.func.name,
+                type(self).__name__,
+                self.argname)
+
+    def print_err(self):
+        print(str(self))
+
+    def dictify(self):
+        return {"error"   : type(self).__name__,
+                "filename": self.func.location.filename,
+                "line"    : self.func.location.linenumber,
+                "function": self.func.name,
+                "argname" : self.argname,
+                "message" : str(self)}
 
 
 class NoDocumentationError(BaseDocumentationError):
@@ -47,9 +72,157 @@ class WrongArgumentError(BaseDocumentationError):
     string = "Argument incorrect in docstring: {argname}"
 
 
-def find_documentation_errors(filename):
-    c_functions = c_parser.parse_file_functions(filename)
-    func_docstrings = comments.find_func_docstrings(filename, c_functions)
+class NoTypeDocumentationError(BaseDocumentationError):
+    """func is the undocumented DataType"""
+    base_string = "{filename}:{linenumber} in {kind} {funcname} - "
+    string = "Is missing documentation!"
+
+
+class NoMemberDocumentationError(NoTypeDocumentationError):
+    string = "Member missing documentation: {argname}"
+
+
+class ValidationFailedError(BaseDocumentationError):
+    """A whole file which couldn't be validated, eg. because it timed out"""
+    base_string = "{filename} - "
+    string = "Could not be validated: {reason}"
+
+    def __init__(self, filename, reason):
+        func = Function()
+        func.location = Location(filename, 0)
+        super(ValidationFailedError, self).__init__(func)
+        self.reason = reason
+
+    def message(self):
+        return self.string.format(reason = self.reason)
+
+
+# When set to a ResultCache, find_documentation_errors caches its results per
+# function, see incremental.find_documentation_errors
+function_cache = None
+
+# When set, files on disk are streamed through the parsers rather than read
+# into memory, see find_documentation_errors_streaming. This takes precedence
+# over function_cache and data_types, which aren't used for streamed files.
+streaming = False
+
+# When set, the structs, unions, enums, typedefs and macros of each file are
+# validated too, from the same parse as its functions. function_cache isn't
+# used when this is set.
+data_types = False
+
+
+def find_documentation_errors(filename, source=None):
+    """
+    Returns the documentation errors in a C file.
+
+    source, if given, is the text of the file to validate in place of reading
+    filename, which is then only used to name the file in errors.
+    """
+    with metrics.timed("file_validation_seconds"):
+        errors = _find_documentation_errors(filename, source)
+
+    metrics.count("files_validated_total")
+    return errors
+
+
+def count_errors(errors):
+    """
+    Counts reported errors by class in metrics. Every path which reports
+    errors calls this once they're filtered, so each is counted once.
+    """
+    for err in errors:
+        metrics.count("documentation_errors_total", error=type(err).__name__)
+
+
+def _find_documentation_errors(filename, source):
+    if source is None and streaming:
+        return find_documentation_errors_streaming(filename)
+
+    buffer, c_lines = _read_source(filename, source)
+
+    if data_types:
+        return find_declaration_errors(filename, buffer, c_lines)
+
+    if function_cache is not None:
+        import incremental
+        return incremental.find_documentation_errors(filename, c_lines,
+                                                     function_cache)
+
+    return check_func_docstrings(_find_func_docstrings(filename, buffer,
+                                                       c_lines))
+
+
+def _read_source(filename, source=None):
+    """
+    Returns (buffer, lines) of a C file, or of source if given.
+
+    The comments are found in a single buffer of the source, which the lines
+    handed to the C parser are decoded from.
+    """
+    if source is None:
+        with open(filename, 'rb') as f:
+            buffer = f.read()
+        c_lines = io.TextIOWrapper(io.BytesIO(buffer), encoding="utf-8",
+                                   errors="replace").readlines()
+    else:
+        buffer = source.encode("utf-8")
+        c_lines = io.StringIO(source, newline=None).readlines()
+
+    return (buffer, c_lines)
+
+
+def _find_func_docstrings(filename, buffer, c_lines):
+    c_functions = c_parser.parse_file_functions(filename, lines=c_lines)
+    return comments.find_func_docstrings(filename, c_functions, buffer)
+
+
+def find_documented_functions(filename, source=None):
+    """
+    Returns a list of (function, docstring) for every function declared in a
+    C file, where docstring is the parsed comment matched to the function, or
+    None.
+
+    source is as for find_documentation_errors.
+    """
+    buffer, c_lines = _read_source(filename, source)
+    return list(_find_func_docstrings(filename, buffer, c_lines))
+
+
+def find_declaration_errors(filename, buffer, c_lines):
+    """
+    Returns the documentation errors in the functions and data types of a C
+    file, given as for _read_source, in file order.
+    """
+    functions, types = c_parser.parse_file_declarations(filename,
+                                                         lines=c_lines)
+
+    errors = check_func_docstrings(comments.find_func_docstrings(
+                                       filename, functions, buffer))
+    errors.extend(check_type_docstrings(comments.find_type_docstrings(
+                                            filename, types, buffer)))
+
+    errors.sort(key=lambda err: err.func.location.linenumber)
+    return errors
+
+
+def find_documentation_errors_streaming(filename):
+    """
+    Returns the documentation errors in a C file, holding no more than a line
+    or comment of it in memory at once. Intended for huge generated files.
+    """
+    c_functions = c_parser.parse_file_functions_streaming(filename)
+    func_docstrings = comments.find_func_docstrings_streaming(filename,
+                                                              c_functions)
+
+    return check_func_docstrings(func_docstrings)
+
+
+def check_func_docstrings(func_docstrings):
+    """
+    Compares each (function, docstring) pair, as returned by
+    comments.find_func_docstrings, and returns the list of errors found.
+    """
     errors = list()
 
     for func in func_docstrings:
@@ -82,3 +255,72 @@ def find_documentation_errors(filename):
             errors.append(NoReturnError(c_def, None))
 
     return errors
+
+
+def check_type_docstrings(type_docstrings):
+    """
+    Returns the errors for each (data type, docstring, undocumented members),
+    as returned by comments.find_type_docstrings. The members of undocumented
+    types aren't checked.
+    """
+    errors = list()
+
+    for data_type, docstring, undocumented in type_docstrings:
+        if docstring is None:
+            errors.append(NoTypeDocumentationError(data_type))
+            continue
+
+        errors.extend(NoMemberDocumentationError(data_type, name)
+                      for name in undocumented)
+
+    return errors
+
+
+def test_data_types():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    filename = os.path.join(dir_path, 'test_sources', 'data_types.c')
+
+    global data_types
+    data_types = True
+    try:
+        errors = find_documentation_errors(filename)
+    finally:
+        data_types = False
+
+    assert [(type(e).__name__, e.func.name, e.argname) for e in errors] == [
+        ("NoTypeDocumentationError", "WIDGET_MIN", None),
+        ("NoMemberDocumentationError", "point", "z"),
+        ("NoTypeDocumentationError", "point_t", None),
+        ("NoMemberDocumentationError", "colour_t", "GREEN"),
+        ("NoTypeDocumentationError", "u", None),
+        ("NoTypeDocumentationError", "frob_cb", None),
+        ("NoDocumentationError", "make", None),
+    ], errors
+    assert str(errors[1]).startswith("data_types.c:15 in struct point - ")
+
+    # A struct missing its semicolon makes clang quote more than identifiers
+    # in its diagnostics, which mustn't stop the rest of the file validating
+    malformed = ("/** A widget */\n"
+                 "struct widget { int a; /**< a */ }\n"
+                 "\n"
+                 "int foo(int a)\n"
+                 "{\n"
+                 "}\n")
+    data_types = True
+    try:
+        errors = find_documentation_errors("malformed.c", malformed)
+    finally:
+        data_types = False
+    assert [(type(e).__name__, e.func.name) for e in errors] == \
+        [("NoDocumentationError", "foo")], errors
+
+    # The functions are the same as those found without the data types
+    functions, _ = c_parser.parse_file_declarations(filename)
+    assert [str(f) for f in functions] == \
+        [str(f) for f in c_parser.parse_file_functions(filename,
+                                                        engine="clang")]
+
+
+if __name__ == '__main__':
+    test_data_types()
+    print('Tests passed.')
@@ -0,0 +1,220 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import validate
+
+
+def _scan_tree(directory, extensions):
+    """
+    Stat every C source file below directory.
+
+    Returns a dict of {filename: (mtime, size)}.
+    """
+    stats = dict()
+
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            if not name.endswith(extensions):
+                continue
+
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # File vanished between listing and stat
+                continue
+            stats[path] = (st.st_mtime, st.st_size)
+
+    return stats
+
+
+def _changed_files(old_stats, new_stats):
+    """
+    Returns the set of filenames which were added, removed or modified between
+    two scans.
+    """
+    changed = set(new_stats) ^ set(old_stats)
+    for filename, stat in new_stats.items():
+        if filename in old_stats and old_stats[filename] != stat:
+            changed.add(filename)
+
+    return changed
+
+
+class Watcher(object):
+    """
+    Keeps the documentation errors for every file in a tree in memory, and
+    re-validates only those files which change on disk.
+    """
+
+    def __init__(self, directory, ignore_funcs=None, poll_interval=0.5,
+                 debounce=0.3, extensions=(".c",), out=sys.stdout):
+        self.directory = directory
+        self.ignore_funcs = set(ignore_funcs or [])
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.extensions = tuple(extensions)
+        self.out = out
+
+        self.stats = dict()
+        self.errors = dict()
+
+    def _validate(self, filename):
+        """
+        Returns {error key: [error]} for a single file. There can be more than
+        one error with a key, eg. for a prototype and its definition.
+        """
+        try:
+            errors = validate.find_documentation_errors(filename)
+        except Exception as e:
+            print("{} - Failed to validate: {}".format(filename, e),
+                  file=self.out)
+            errors = []
+
+        errors = [err for err in errors
+                  if err.func.name not in self.ignore_funcs]
+        validate.count_errors(errors)
+
+        keyed = dict()
+        for err in errors:
+            keyed.setdefault(err.key(), []).append(err)
+
+        return keyed
+
+    def _wait_for_quiet(self, stats):
+        """
+        Keep rescanning until nothing has changed for a full debounce period,
+        so that a burst of saves is validated once.
+        """
+        while True:
+            time.sleep(self.debounce)
+            new_stats = _scan_tree(self.directory, self.extensions)
+            if not _changed_files(stats, new_stats):
+                return new_stats
+            stats = new_stats
+
+    def initial_run(self):
+        """Validate the whole tree, printing every error found"""
+        self.stats = _scan_tree(self.directory, self.extensions)
+
+        for filename in sorted(self.stats):
+            self.errors[filename] = self._validate(filename)
+            for errors in self.errors[filename].values():
+                for err in errors:
+                    print(err, file=self.out)
+
+    def update(self):
+        """
+        Poll the tree once. If anything changed, re-validate the changed files
+        and print the errors which appeared and disappeared.
+
+        Returns the set of files which were re-validated.
+        """
+        new_stats = _scan_tree(self.directory, self.extensions)
+        changed = _changed_files(self.stats, new_stats)
+        if not changed:
+            return changed
+
+        new_stats = self._wait_for_quiet(new_stats)
+        changed = _changed_files(self.stats, new_stats)
+        self.stats = new_stats
+
+        for filename in sorted(changed):
+            old_errors = self.errors.pop(filename, dict())
+            if filename in new_stats:
+                new_errors = self._validate(filename)
+                self.errors[filename] = new_errors
+            else:
+                new_errors = dict()
+
+            # Errors with the same key are told apart only by how many there
+            # are, as their line numbers move with unrelated edits
+            for key, errors in old_errors.items():
+                for err in errors[len(new_errors.get(key, [])):]:
+                    print("- {}".format(err), file=self.out)
+
+            for key, errors in new_errors.items():
+                for err in errors[len(old_errors.get(key, [])):]:
+                    print("+ {}".format(err), file=self.out)
+
+        self.out.flush()
+        return changed
+
+    def run(self):
+        """Watch forever"""
+        self.initial_run()
+        self.out.flush()
+
+        while True:
+            time.sleep(self.poll_interval)
+            self.update()
+
+
+def test_watch():
+    """A new undocumented function is reported, then withdrawn once fixed"""
+    import io
+    import shutil
+    import tempfile
+
+    import metrics
+
+    saved = metrics.take()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, "watched.c")
+        documented = "/**\n * Does foo\n */\nvoid foo(void)\n{\n}\n"
+        with open(filename, "w") as f:
+            f.write(documented)
+
+        out = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+        watcher = Watcher(tmp_dir, debounce=0, out=out)
+        watcher.initial_run()
+        assert out.getvalue() == ""
+        assert watcher.update() == set()
+
+        with open(filename, "a") as f:
+            f.write("\nvoid bar(void)\n{\n}\n")
+        assert watcher.update() == set([filename])
+        [line] = out.getvalue().splitlines()
+        assert line.startswith("+ ") and "bar" in line
+
+        # Each file validated is counted, along with the errors it reported
+        counters, _, _ = metrics.take()
+        assert counters[("files_validated_total", ())] == 2
+        assert counters[("documentation_errors_total",
+                         (("error", "NoDocumentationError"),))] == 1
+
+        with open(filename, "w") as f:
+            f.write(documented)
+        assert watcher.update() == set([filename])
+        line = out.getvalue().splitlines()[-1]
+        assert line.startswith("- ") and "bar" in line
+        assert watcher.errors[filename] == dict()
+
+        # A prototype and its definition with the same error are reported,
+        # and withdrawn, separately
+        with open(filename, "a") as f:
+            f.write("\nvoid bar(void);\n\nvoid bar(void)\n{\n}\n")
+        watcher.update()
+        added = out.getvalue().splitlines()[-2:]
+        assert [line[:2] for line in added] == ["+ ", "+ "]
+        assert len(set(added)) == 2
+
+        with open(filename, "w") as f:
+            f.write(documented + "\nvoid bar(void);\n")
+        watcher.update()
+        [removed] = out.getvalue().splitlines()[4:]
+        assert removed.startswith("- ") and "bar" in removed
+        assert [len(x) for x in watcher.errors[filename].values()] == [1]
+    finally:
+        shutil.rmtree(tmp_dir)
+        metrics.take()
+        metrics.merge(saved)
+
+
+if __name__ == '__main__':
+    test_watch()
+    print('Tests passed.')
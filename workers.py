@@ -0,0 +1,383 @@
+import collections
+import multiprocessing
+import time
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    # Python 2, see _wait_for_workers
+    wait = None
+
+import c_parser
+import metrics
+
+
+"""
+Validates files in a pool of supervised worker processes, so that one
+pathological file can't stall or kill a whole run.
+
+Each file gets a wall clock timeout, and each worker an address space limit.
+A worker which times out, crashes or runs out of memory is replaced, and the
+file it was working on is reported as a validate.ValidationFailedError.
+"""
+
+
+def current_settings():
+    """
+    The module level settings of this process which a worker needs to
+    validate files the same way.
+    """
+    import references
+    import validate
+
+    parse_cache = c_parser.parse_cache
+    return {"engine"   : c_parser.default_engine,
+            "rules"    : references.rules_file,
+            "types"    : sorted(c_parser.known_unknown_types),
+            "streaming": validate.streaming,
+            "data_types": validate.data_types,
+            "cache_dir": parse_cache.directory if parse_cache else None}
+
+
+def apply_settings(settings):
+    """Applies settings from current_settings to this process"""
+    import cache
+    import validate
+
+    c_parser.default_engine = settings["engine"]
+    if settings["rules"]:
+        import references
+        references.load_rules(settings["rules"])
+    c_parser.known_unknown_types.update(settings["types"])
+    validate.streaming = settings["streaming"]
+    validate.data_types = settings["data_types"]
+    if settings["cache_dir"]:
+        c_parser.parse_cache = cache.ResultCache(settings["cache_dir"])
+        validate.function_cache = c_parser.parse_cache
+
+
+def new_types(sent):
+    """
+    Returns the unknown type names this process has found since those in
+    sent, and adds them to sent, eg. to send them back from a worker so that
+    --type-cache gains them.
+    """
+    new = c_parser.known_unknown_types - sent
+    sent.update(new)
+    return sorted(new)
+
+
+def _limit_memory(limit):
+    try:
+        import resource
+    except ImportError:
+        # Not available on this platform, so run without a limit
+        return
+
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, settings, memory_limit):
+    import validate
+
+    apply_settings(settings)
+
+    if memory_limit:
+        # Mapping libclang itself shouldn't count against the limit
+        if settings["engine"] == "clang":
+            c_parser._cindex().conf.lib
+        _limit_memory(memory_limit)
+
+    sent_types = set(c_parser.known_unknown_types)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        index, filename = task
+        start = time.time()
+        try:
+            errors = validate.find_documentation_errors(filename)
+        except MemoryError:
+            # Anything could be left half built, so have this worker replaced
+            conn.send(("fatal", index, "ran out of memory",
+                       time.time() - start, metrics.take(),
+                       new_types(sent_types)))
+            break
+        except Exception as e:
+            conn.send(("failed", index, "{}: {}".format(type(e).__name__, e),
+                       time.time() - start, metrics.take(),
+                       new_types(sent_types)))
+        else:
+            conn.send(("ok", index, errors, time.time() - start,
+                       metrics.take(), new_types(sent_types)))
+
+
+class _Worker(object):
+    def __init__(self, settings, memory_limit):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main,
+                                               args=(child_conn, settings,
+                                                     memory_limit))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+        # The (index, filename) being validated, and when it was sent
+        self.task = None
+        self.started = None
+
+    def send(self, task):
+        self.task = task
+        self.started = time.time()
+        self.conn.send(task)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+def _wait_for_workers(busy, timeout):
+    """
+    Waits up to timeout seconds, or for ever if it's None, for any of the busy
+    workers to answer or die.
+
+    Returns (the workers which answered, the workers which died).
+    """
+    if wait is not None:
+        ready = wait([w.conn for w in busy] +
+                     [w.process.sentinel for w in busy], timeout)
+        return ([w for w in busy if w.conn in ready],
+                [w for w in busy if w.process.sentinel in ready])
+
+    # Without wait or sentinels, poll every worker in turn
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        answered = [w for w in busy if w.conn.poll()]
+        died = [w for w in busy
+                if w not in answered and not w.process.is_alive()]
+        if answered or died or \
+                deadline is not None and time.time() >= deadline:
+            return (answered, died)
+        time.sleep(0.01)
+
+
+class Supervisor(object):
+    """
+    Runs files through a pool of worker processes.
+
+    timeout is the most seconds a single file may take, and memory_limit the
+    most bytes of address space each worker may use. Either may be None for
+    no limit.
+    """
+
+    def __init__(self, jobs, timeout=None, memory_limit=None, settings=None):
+        self.jobs = jobs
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.settings = settings or current_settings()
+
+        # How many workers had to be replaced
+        self.restarts = 0
+
+        # Wall clock time of the last run, and how much of it was spent with
+        # some workers idle while others were still busy (the tail)
+        self.wall_seconds = 0.0
+        self.tail_seconds = 0.0
+
+    def _start_worker(self):
+        return _Worker(self.settings, self.memory_limit)
+
+    def _replace(self, workers, worker):
+        worker.kill()
+        workers[workers.index(worker)] = self._start_worker()
+        self.restarts += 1
+
+    def _failed(self, worker, reason, kind):
+        import validate
+
+        index, filename = worker.task
+        worker.task = None
+        metrics.count("files_failed_total", reason=kind)
+        return (index, filename, time.time() - worker.started,
+                [validate.ValidationFailedError(filename, reason)])
+
+    def run(self, indexed_files, costs=None):
+        """
+        Validates each (index, filename) pair, yielding
+        (index, filename, seconds, errors) for each file as it finishes.
+
+        costs, if given, is the predicted cost of each file (see
+        timings.predict_costs). Files are then handed out longest first, so
+        that the run doesn't end with one worker on a huge file while the
+        rest sit idle.
+        """
+        import validate
+
+        indexed_files = list(indexed_files)
+        if costs is not None:
+            order = sorted(range(len(indexed_files)),
+                           key=lambda i: (-costs[i], indexed_files[i][0]))
+            indexed_files = [indexed_files[i] for i in order]
+
+        pending = collections.deque(indexed_files)
+        filenames = dict(pending)
+        workers = [self._start_worker()
+                   for _ in range(min(self.jobs, len(pending)))]
+
+        run_start = time.time()
+        self.tail_seconds = 0.0
+
+        try:
+            while True:
+                # Whichever worker is idle takes the next most expensive file
+                for worker in workers:
+                    if worker.task is None and pending:
+                        worker.send(pending.popleft())
+
+                busy = [w for w in workers if w.task is not None]
+                if not busy:
+                    break
+
+                wait_for = None
+                if self.timeout is not None:
+                    deadline = min(w.started for w in busy) + self.timeout
+                    wait_for = max(0, deadline - time.time())
+
+                wait_start = time.time()
+                answered, died = _wait_for_workers(busy, wait_for)
+                if len(busy) < self.jobs:
+                    self.tail_seconds += time.time() - wait_start
+
+                for worker in busy:
+                    if worker in answered:
+                        try:
+                            status, index, result, seconds, worker_metrics, \
+                                types = worker.conn.recv()
+                        except EOFError:
+                            yield self._failed(worker, "worker crashed",
+                                               "crash")
+                            self._replace(workers, worker)
+                            continue
+
+                        metrics.merge(worker_metrics)
+                        c_parser.known_unknown_types.update(types)
+
+                        worker.task = None
+                        if status == "ok":
+                            yield (index, filenames[index], seconds, result)
+                        else:
+                            metrics.count("files_failed_total",
+                                          reason="memory" if status == "fatal"
+                                          else "error")
+                            yield (index, filenames[index], seconds,
+                                   [validate.ValidationFailedError(
+                                        filenames[index], result)])
+
+                        if status == "fatal":
+                            self._replace(workers, worker)
+
+                    elif worker in died:
+                        # Died without answering, eg. libclang crashed
+                        worker.process.join()
+                        yield self._failed(worker,
+                                           "worker crashed (exit code {})"
+                                           .format(worker.process.exitcode),
+                                           "crash")
+                        self._replace(workers, worker)
+
+                    elif self.timeout is not None and \
+                            time.time() - worker.started >= self.timeout:
+                        yield self._failed(worker, "timed out after {}s"
+                                                   .format(self.timeout),
+                                           "timeout")
+                        self._replace(workers, worker)
+        finally:
+            self.wall_seconds = time.time() - run_start
+            for worker in workers:
+                worker.stop()
+
+
+def test_supervisor():
+    """
+    A file which never finishes (reading from a FIFO), and one which can't be
+    read, fail on their own without holding up the rest.
+    """
+    import os
+    import shutil
+    import tempfile
+
+    import validate
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    good = os.path.join(dir_path, 'test_sources', 'single_func.c')
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        stuck = os.path.join(tmp_dir, 'stuck.c')
+        os.mkfifo(stuck)
+        missing = os.path.join(tmp_dir, 'missing.c')
+
+        supervisor = Supervisor(2, timeout=2)
+        start = time.time()
+        results = dict((filename, errors) for _, filename, _, errors in
+                       supervisor.run(list(enumerate([stuck, good, missing,
+                                                      good]))))
+        assert time.time() - start < 10
+
+        assert [type(e) for e in results[good]] == \
+            [validate.NoDocumentationError]
+
+        for filename, reason in [(stuck, "timed out"),
+                                 (missing, "FileNotFoundError")]:
+            [err] = results[filename]
+            assert isinstance(err, validate.ValidationFailedError)
+            assert reason in err.message()
+
+        assert supervisor.restarts == 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_worker_types():
+    """Unknown types the workers find are added to this process's set"""
+    import os
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    sources = os.path.join(dir_path, 'test_sources')
+    filenames = [os.path.join(sources, name)
+                 for name in ['a.c', 'single_func.c']]
+
+    saved = set(c_parser.known_unknown_types)
+    c_parser.known_unknown_types.clear()
+    try:
+        for _ in Supervisor(2, settings=dict(current_settings(),
+                                             engine="clang")).run(
+                        list(enumerate(filenames))):
+            pass
+
+        assert set(["madeup_type_t", "foo_t"]) <= \
+            c_parser.known_unknown_types, c_parser.known_unknown_types
+    finally:
+        c_parser.known_unknown_types.clear()
+        c_parser.known_unknown_types.update(saved)
+
+
+if __name__ == '__main__':
+    test_supervisor()
+    test_worker_types()
+    print('Tests passed.')